@@ -2,7 +2,7 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import UserProfile, Connection, ReconnectRequest
+from .models import ChatEvent, UserProfile, Connection, ReconnectRequest
 
 
 @admin.register(UserProfile)
@@ -23,3 +23,9 @@ class ReconnectRequestAdmin(admin.ModelAdmin):
     list_display = ("id", "from_user", "to_user", "is_active", "created_at")
     list_filter = ("is_active", "created_at")
     search_fields = ("from_user__username", "to_user__username")
+
+
+@admin.register(ChatEvent)
+class ChatEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "at", "event", "data")
+    list_filter = ("event", "at")
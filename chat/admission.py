@@ -0,0 +1,85 @@
+"""
+Admission control for chat sockets.
+
+ChatConsumer asks admit() before it does any work for a new socket. A
+socket is turned away while this process already holds
+CHAT_MAX_CONNECTIONS sockets, or while its event loop runs more than
+CHAT_MAX_LOOP_LAG seconds late (every socket on it is already waiting
+that long). Turned-away sockets are closed with BUSY_CLOSE_CODE and the
+reason "retry=N"; chat.js waits about N seconds, with jitter, before
+trying again.
+
+Shedding early keeps the sockets that did get in fast, so throughput
+levels off past capacity instead of collapsing for everyone.
+"""
+import asyncio
+
+from django.conf import settings
+
+from . import metrics
+
+BUSY_CLOSE_CODE = 4503
+
+_active = 0  # admitted sockets in this process
+
+
+class LoopLagMonitor:
+    """Measures how late this event loop wakes up from a short sleep."""
+
+    def __init__(self, interval=0.1, decay=0.8):
+        self.interval = interval
+        self.decay = decay
+        self.lag = 0.0  # peak lag, decays by `decay` every interval once the loop catches up
+        self._task = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self.lag = 0.0
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            late = loop.time() - start - self.interval
+            self.lag = max(late, self.lag * self.decay)
+
+
+lag_monitor = LoopLagMonitor()
+
+
+def admit():
+    """Take a slot for a new socket. False if it must be turned away; the reason is counted in SHED."""
+    global _active
+    lag_monitor.start()
+    ceiling = settings.CHAT_MAX_CONNECTIONS
+    if ceiling and _active >= ceiling:
+        reason = "connections"
+    elif settings.CHAT_MAX_LOOP_LAG and lag_monitor.lag > settings.CHAT_MAX_LOOP_LAG:
+        reason = "loop_lag"
+    else:
+        _active += 1
+        return True
+    SHED.inc(reason=reason)
+    return False
+
+
+def release():
+    global _active
+    _active -= 1
+
+
+def retry_after():
+    return settings.CHAT_BUSY_RETRY
+
+
+async def _process_state():
+    return {(("state", "active"),): _active, (("state", "loop_lag_ms"),): round(lag_monitor.lag * 1000, 3)}
+
+
+SHED = metrics.Counter("chat_shed", "Sockets turned away by admission control, by reason.")
+ADMISSION = metrics.Gauge(
+    "chat_admission", "Admitted sockets and event loop lag (ms) of the process serving /metrics.", _process_state
+)
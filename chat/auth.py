@@ -0,0 +1,117 @@
+"""
+Cheap identity for the chat socket.
+
+Guests carry a signed cookie with their nickname instead of a database
+session. For logged-in users, the handshake resolves the session and user
+row once, then caches the few fields ChatConsumer needs (user id,
+nickname, guest flag) for CHAT_AUTH_CACHE_TTL seconds. Reconnects then
+never touch the database.
+"""
+import secrets
+from importlib import import_module
+from types import SimpleNamespace
+
+from channels.db import database_sync_to_async
+from channels.sessions import CookieMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import signing
+from django.core.cache import cache
+
+GUEST_COOKIE = "vc_guest"
+GUEST_SALT = "chat.guest"
+
+
+def make_guest_token(nickname):
+    return signing.dumps({"n": nickname, "i": secrets.token_hex(8)}, salt=GUEST_SALT, compress=True)
+
+
+def read_guest_token(token):
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=GUEST_SALT, max_age=settings.GUEST_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def set_guest_cookie(response, nickname):
+    response.set_cookie(
+        GUEST_COOKIE,
+        make_guest_token(nickname),
+        max_age=settings.GUEST_TOKEN_MAX_AGE,
+        httponly=True,
+        samesite="Lax",
+        secure=not settings.DEBUG,
+    )
+
+
+def auth_cache_key(session_key):
+    return f"chat:ws-auth:{session_key}"
+
+
+def force_match_key(user_id):
+    return f"chat:force-match:{user_id}"
+
+
+def resume_key(token):
+    return f"chat:resume:{token}"
+
+
+async def aforget_session(request):
+    """Drop the cached identity of this request's session, e.g. before aflush()."""
+    if request.session.session_key:
+        await cache.adelete(auth_cache_key(request.session.session_key))
+
+
+class ChatSession(dict):
+    """The part of a session ChatConsumer reads, with the key it came from."""
+
+    def __init__(self, data, session_key=None):
+        super().__init__(data)
+        self.session_key = session_key
+
+
+@database_sync_to_async
+def resolve_session(session_key):
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(session_key)
+    user = get_user(SimpleNamespace(session=session))
+    return {
+        "user_id": user.id if user.is_authenticated else None,
+        "guest": bool(session.get("guest")),
+        "guest_nickname": session.get("guest_nickname"),
+        "nickname": session.get("nickname"),
+    }
+
+
+class ChatAuthMiddleware:
+    """Fills scope["session"] and scope["user"] for ChatConsumer from cookies and the cache."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        cookies = scope.get("cookies", {})
+        guest = read_guest_token(cookies.get(GUEST_COOKIE))
+        if guest:
+            session = ChatSession({"guest": True, "guest_nickname": guest["n"]}, f"g{guest['i']}")
+            return await self.inner(dict(scope, session=session, user=AnonymousUser()), receive, send)
+
+        session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+        identity = None
+        if session_key:
+            identity = await cache.aget(auth_cache_key(session_key))
+            if identity is None:
+                identity = await resolve_session(session_key)
+                await cache.aset(auth_cache_key(session_key), identity, settings.CHAT_AUTH_CACHE_TTL)
+        identity = identity or {"user_id": None}
+
+        user = User(id=identity["user_id"]) if identity["user_id"] else AnonymousUser()
+        session = ChatSession({k: v for k, v in identity.items() if k != "user_id"}, session_key)
+        return await self.inner(dict(scope, session=session, user=user), receive, send)
+
+
+def ChatAuthMiddlewareStack(inner):
+    return CookieMiddleware(ChatAuthMiddleware(inner))
@@ -0,0 +1,25 @@
+"""
+Loading the pluggable parts of chat, and the Redis client they share.
+
+Matchmaking, presence, rendezvous, rate counting, room history, metrics and
+the event log are each configured like CHANNEL_LAYERS: a settings dict with
+a dotted BACKEND path and its CONFIG kwargs, loaded once per process by
+load_backend(). The Redis backends take their client from get_redis(), so a
+worker keeps one connection pool per Redis URL instead of one per backend.
+"""
+from django.utils.module_loading import import_string
+
+_clients = {}  # url -> redis.asyncio.Redis
+
+
+def load_backend(config):
+    return import_string(config["BACKEND"])(**config.get("CONFIG", {}))
+
+
+def get_redis(url):
+    client = _clients.get(url)
+    if client is None:
+        import redis.asyncio as redis
+
+        client = _clients[url] = redis.from_url(url)
+    return client
@@ -1,34 +1,72 @@
+import asyncio
+import secrets
+import time
 import uuid
-from channels.generic.websocket import AsyncWebsocketConsumer
-
-GUEST_QUEUE = []
-USER_QUEUE = []
-ONLINE_USERS = set()  # user_id set
-
+from urllib.parse import parse_qs
 
-def clean(text: str) -> str:
-    return (text or "").replace("|", " ").strip()
+from channels.exceptions import ChannelFull
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.cache import cache
 
+from . import admission, contentfilter, events, heartbeat, metrics, outbox
+from .auth import force_match_key, resume_key
+from .history import get_room_history
+from .matchmaking import GUEST_POOL, TAGS_COOKIE, USER_POOL, get_matchmaker, make_ticket, parse_tags
+from .presence import get_presence
+from .protocol import negotiate
+from .ratelimit import RateLimiter, get_shared_counter
+from .rendezvous import get_rendezvous
+from .typingindicator import TypingIndicator
 
-def pack_sys(message):
-    return f"SYS|{clean(message)}"
 
+def user_group(user_id):
+    # every socket of a logged-in user, on any worker
+    return f"user_{user_id}"
 
-def pack_msg(nick, msg):
-    return f"MSG|{clean(nick)}|{clean(msg)}"
 
+class ChatConsumer(AsyncWebsocketConsumer):
+    admitted = False
 
-def pack_match(nick, uid):
-    uid = "" if uid is None else str(uid)
-    return f"MATCH|{clean(nick)}|{uid}"
+    async def connect(self):
+        # ✅ binary msgpack frames if the client offers them, text otherwise
+        self.codec = negotiate(self.scope.get("subprotocols"))
+        await self.accept(subprotocol=self.codec.subprotocol)
 
+        # ✅ load shedding: over capacity, tell the client when to come back instead of serving it slowly
+        if not admission.admit():
+            await self.close(code=admission.BUSY_CLOSE_CODE, reason=f"retry={admission.retry_after()}")
+            return
+        self.admitted = True
+
+        # ✅ all outgoing frames go through a bounded queue drained by a writer task
+        self.outbox = outbox.Outbox(
+            self.send,
+            self.codec.join,
+            maxsize=settings.CHAT_OUTBOX_SIZE,
+            policy=settings.CHAT_OUTBOX_POLICY,
+            grace=settings.CHAT_OUTBOX_GRACE,
+            max_batch=settings.CHAT_OUTBOX_BATCH,
+            on_evict=lambda: asyncio.ensure_future(self.close(code=4008)),
+        )
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        await self.accept()
+        # ✅ keystrokes coalesced into at most one typing start/stop per CHAT_TYPING_INTERVAL
+        self.typing = TypingIndicator(self.send_typing, settings.CHAT_TYPING_INTERVAL, settings.CHAT_TYPING_TIMEOUT)
 
         self.room_name = None
-        self.partner = None
+        self.partner = None  # partner's channel name, never the consumer itself
+        self.partner_info = None  # (nickname, user_id), re-sent in MATCH after a resume
+        self.partner_token = None  # resume token of a partner whose socket dropped
+        self.partner_is_typing = False  # our client shows the partner typing
+        self.away_timer = None
+        self.waiting_since = time.monotonic()  # for the match wait histogram
+        self.rendezvous_with = None  # user id we are waiting for after an accepted request
+        self.rendezvous_timer = None
+        self.fallback_timer = None
+
+        # ✅ interest tags picked on the chat page; matched on overlap for CHAT_TAG_WAIT seconds
+        self.tags = parse_tags(self.scope.get("cookies", {}).get(TAGS_COOKIE))
+        self.search_tags = self.tags
 
         session = self.scope["session"]
         user = self.scope["user"]
@@ -39,135 +77,533 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.nickname = "Guest"
 
         self.user_id = user.id if user.is_authenticated else None
+        self.pool = GUEST_POOL if self.is_guest else USER_POOL
+
+        # ✅ per-socket + per-user command limits
+        session_key = getattr(session, "session_key", None)
+        if self.user_id:
+            limit_key = f"u{self.user_id}"
+        else:
+            limit_key = f"s{session_key}" if session_key else None
+        self.limiter = RateLimiter(limit_key, counter=get_shared_counter())
+        self.identity = limit_key
+
+        # ✅ lets this client pick up its room again if the socket drops
+        self.resume_token = secrets.token_urlsafe(16)
+        await self.send_frame("RESUME", self.resume_token)
+
+        metrics.get_metrics().start()
+        metrics.CONNECTS.inc(pool=self.pool)
+
+        # ✅ anonymized event log for capacity planning and abuse review, see chat/events.py
+        self.socket_id = events.anonymize(self.channel_name)
+        self.who = events.anonymize(self.identity)
+        self.connected_at = time.monotonic()
+        self.room_started = None  # unknown after a resume
+        self.room_messages = self.messages_sent = 0
+        self.log_event("connect", tags=len(self.tags))
+
+        # ✅ PING/PONG: a socket that goes quiet for CHAT_HEARTBEAT_TIMEOUT is reaped
+        self.last_seen = time.monotonic()
+        heartbeat.register(self)
+
+        # ✅ blocklist edits apply without a restart
+        contentfilter.start()
 
         # ✅ Online tracking
         if self.user_id:
-            ONLINE_USERS.add(self.user_id)
+            await get_presence().connect(self.user_id, self.channel_name)
+            await self.channel_layer.group_add(user_group(self.user_id), self.channel_name)
 
-        # ✅ force reconnect
-        force_user_id = session.get("force_match_user_id")
-        if force_user_id and self.user_id:
-            session["force_match_user_id"] = None
-            await self.force_match(force_user_id)
+        if await self.resume():
             return
 
+        # ✅ force reconnect (set by accept_request)
+        if self.user_id:
+            force_user_id = await cache.aget(force_match_key(self.user_id))
+            if force_user_id:
+                await cache.adelete(force_match_key(self.user_id))
+                await self.force_match(force_user_id)
+                return
+
         await self.match()
 
     async def disconnect(self, close_code):
-        if self.is_guest:
-            if self in GUEST_QUEUE:
-                GUEST_QUEUE.remove(self)
-        else:
-            if self in USER_QUEUE:
-                USER_QUEUE.remove(self)
+        if not self.admitted:
+            return  # turned away, or already reaped
+        self.admitted = False
+        admission.release()
+        heartbeat.unregister(self)
+        self.outbox.close()
+        self.typing.close()
+        self.limiter.close()
+        self.cancel_fallback()
+        metrics.DISCONNECTS.inc(pool=self.pool)
+        self.log_event(
+            "disconnect",
+            code=close_code,
+            room=self.room_name,
+            duration=round(time.monotonic() - self.connected_at, 3),
+            messages=self.messages_sent,
+        )
+        await self.leave_pool()
 
-        if self.user_id and self.user_id in ONLINE_USERS:
-            ONLINE_USERS.remove(self.user_id)
+        await self.leave_rendezvous()
+
+        if self.user_id:
+            await get_presence().disconnect(self.user_id, self.channel_name)
+            await self.channel_layer.group_discard(user_group(self.user_id), self.channel_name)
 
         if self.partner:
-            await self.partner.send(text_data=pack_sys("Partner disconnected. Click Next."))
+            if close_code == 1000 or (close_code or 0) >= 4000:
+                # closed on purpose (left the page, or evicted by us): the chat is over
+                await self.forget_away_partner()
+                await self.notify_partner_left("Partner disconnected. Click Next.")
+            else:
+                if self.away_timer:
+                    self.away_timer.cancel()
+                await self.park()
+            await self.leave_room()
+
+    async def reap(self):
+        """Clean up after a client that stopped answering PINGs. Returns the entries it held."""
+        held = {
+            "queue": int(self.room_name is None and self.rendezvous_with is None),
+            "presence": int(bool(self.user_id)),
+            "group": int(bool(self.user_id)) + int(bool(self.room_name)),
+        }
+        try:
+            await self.disconnect(1006)  # like a dropped socket: a partnered one is parked and can still resume
+        finally:
+            await self.close(code=heartbeat.REAPED_CLOSE_CODE)
+        return held
+
+    async def park(self):
+        """Keep our seat in the room for CHAT_RESUME_GRACE seconds, see resume()."""
+        record = {
+            "identity": self.identity,
+            "pool": self.pool,
+            "room": self.room_name,
+            "partner": self.partner,
+            "partner_info": self.partner_info,
+            "parked_at": time.time(),
+        }
+        # kept longer than the grace window so partner_gone can tell "expired" from "resumed"
+        await cache.aset(resume_key(self.resume_token), record, settings.CHAT_RESUME_GRACE * 2)
+        await self.channel_layer.send(
+            self.partner, {"type": "partner_away", "room": self.room_name, "token": self.resume_token}
+        )
+
+    async def resume(self):
+        token = parse_qs(self.scope.get("query_string", b"").decode()).get("resume", [None])[0]
+        if not token:
+            return False
+        record = await cache.aget(resume_key(token))
+        if (
+            not record
+            or record["identity"] != self.identity
+            or record["pool"] != self.pool
+            or time.time() - record["parked_at"] > settings.CHAT_RESUME_GRACE
+            or not await cache.adelete(resume_key(token))
+        ):
+            metrics.RESUMES.inc(result="ended")
+            await self.send_frame("SYS", "Your last chat has ended.")
+            return False
+
+        self.room_name, self.partner = record["room"], record["partner"]
+        self.partner_info = record["partner_info"]
+        await self.join_room(self.channel_name)
+        await self.channel_layer.send(
+            self.partner, {"type": "partner_back", "room": self.room_name, "channel": self.channel_name}
+        )
+
+        # same room, same partner: redraw it and replay what was said meanwhile
+        await self.send_frame("MATCH", *self.partner_info)
+        for nickname, message in await get_room_history().recent(self.room_name):
+            await self.send_frame("MSG", nickname, message)
+        await self.send_frame("SYS", "Reconnected ✅")
+        metrics.RESUMES.inc(result="resumed")
+        return True
+
+    async def partner_away(self, event):
+        if event["room"] != self.room_name:
+            return
+        self.partner_token = event["token"]
+        self.away_timer = asyncio.ensure_future(self.partner_gone(event["room"]))
+        await self.clear_partner_typing()
+        await self.send_frame("SYS", "Partner's connection dropped. Waiting for them to come back...")
+
+    async def partner_gone(self, room):
+        await asyncio.sleep(settings.CHAT_RESUME_GRACE)
+        self.away_timer = None
+        if not await self.forget_away_partner():
+            return  # they resumed just now, partner_back is on its way
+        await self.partner_left({"room": room, "message": "Partner disconnected. Click Next."})
+
+    async def partner_back(self, event):
+        if event["room"] != self.room_name:
+            return
+        if self.away_timer:
+            self.away_timer.cancel()
+        self.away_timer = self.partner_token = None
+        self.partner = event["channel"]
+        await self.send_frame("SYS", "Partner is back ✅")
+
+    async def forget_away_partner(self):
+        """Stop waiting for a dropped partner and void their resume token. False if they already used it."""
+        if self.away_timer and self.away_timer is not asyncio.current_task():
+            self.away_timer.cancel()
+        token, self.partner_token, self.away_timer = self.partner_token, None, None
+        if token is None:
+            return False
+        return await cache.adelete(resume_key(token))
 
     async def receive(self, text_data=None, bytes_data=None):
-        if not text_data:
+        if not self.admitted:
+            return
+        self.last_seen = time.monotonic()
+        cmd, arg = self.codec.decode(text_data, bytes_data)
+        if not cmd or cmd == "PONG":
             return
 
-        parts = text_data.split("|", 1)
-        cmd = parts[0].upper().strip()
+        if not await self.limiter.allow(cmd):
+            if self.limiter.should_notify():
+                await self.send_frame("SYS", "You're going too fast. Slow down a bit.")
+            return
 
         if cmd == "MSG":
             if not self.room_name:
                 return
 
-            msg = parts[1].strip() if len(parts) > 1 else ""
+            msg = arg.strip()
             if not msg:
                 return
 
-            await self.channel_layer.group_send(
-                self.room_name,
-                {
+            # ✅ blocklist, one pass over the message whatever the list's size
+            msg = contentfilter.screen(msg)
+            if msg is None:
+                await self.send_frame("SYS", "Message not sent: it contains blocked words.")
+                return
+
+            metrics.MESSAGES.inc()
+            self.messages_sent += 1
+            self.room_messages += 1
+            self.typing.reset()  # the partner's client stops showing us typing when the message lands
+            # the two round trips don't depend on each other
+            await asyncio.gather(
+                get_room_history().append(self.room_name, self.nickname, msg),
+                self.relay({
                     "type": "broadcast_message",
                     "nickname": self.nickname,
                     "message": msg,
-                }
+                    "sender": self.channel_name,
+                }),
             )
 
         elif cmd == "NEXT":
+            self.log_event("next", room=self.room_name, duration=self.room_duration(), messages=self.room_messages)
             # if partner clicked interested but I skip => auto end
             if self.partner:
-                await self.partner.send(text_data=pack_sys("Partner skipped. Chat ended."))
+                await self.notify_partner_left("Partner skipped. Chat ended.")
             await self.next_match()
 
+        elif cmd == "TYPING":
+            # not rate limited: a TYPING is a couple of assignments, and what reaches the partner is bounded
+            metrics.TYPING.inc(kind="received")
+            if self.room_name:
+                self.typing.update(arg.strip() != "0")
+
         elif cmd == "INTEREST":
             if self.partner:
-                await self.partner.send(text_data="PINTEREST|")
+                self.log_event("interest", room=self.room_name)
+                await self.channel_layer.send(self.partner, {"type": "partner_interest", "room": self.room_name})
 
-    async def match(self):
-        # ✅ Guests only match guests
-        if self.is_guest:
-            if len(GUEST_QUEUE) > 0:
-                partner = GUEST_QUEUE.pop(0)
-                await self.start_room(partner)
-            else:
-                GUEST_QUEUE.append(self)
-                await self.send(text_data=pack_sys("Waiting for another guest..."))
+    async def send_typing(self, active):
+        if not self.partner:
             return
+        metrics.TYPING.inc(kind="relayed")
+        try:
+            await self.channel_layer.send(
+                self.partner, {"type": "partner_typing", "room": self.room_name, "active": active}
+            )
+        except ChannelFull:
+            pass  # a typing hint is not worth more than that
+
+    async def group_send(self, group, event):
+        with metrics.GROUP_SEND.time(event=event["type"]):
+            await self.channel_layer.group_send(group, event)
+
+    async def relay(self, event):
+        """Deliver a room event to both of us."""
+        if settings.CHAT_RELAY == "group":
+            await self.group_send(self.room_name, event)
+            return
+        # ✅ a room only ever has two members: one send to the partner, and our own copy handled right here
+        with metrics.GROUP_SEND.time(event=event["type"]):
+            try:
+                await self.channel_layer.send(self.partner, event)
+            except ChannelFull:
+                pass  # partner gone or not reading; group_send drops these the same way
+        await getattr(self, event["type"])(event)
+
+    async def join_room(self, *channels):
+        # the direct relay never needs the room as a channel-layer group
+        if settings.CHAT_RELAY == "group":
+            for channel in channels:
+                await self.channel_layer.group_add(self.room_name, channel)
+
+    async def leave_room(self):
+        if settings.CHAT_RELAY == "group":
+            await self.channel_layer.group_discard(self.room_name, self.channel_name)
 
-        # ✅ Logged users only match logged users
-        if len(USER_QUEUE) > 0:
-            partner = USER_QUEUE.pop(0)
+    def record_match(self):
+        wait = time.monotonic() - self.waiting_since
+        metrics.MATCH_WAIT.observe(wait, pool=self.pool)
+        self.room_started = time.monotonic()
+        self.room_messages = 0
+        self.partner_is_typing = False
+        self.log_event("match", room=self.room_name, partner=events.anonymize(self.partner), wait=round(wait, 3))
+
+    def room_duration(self):
+        if not self.room_name or self.room_started is None:
+            return None
+        return round(time.monotonic() - self.room_started, 3)
+
+    def log_event(self, event, **fields):
+        events.emit(event, socket=self.socket_id, who=self.who, pool=self.pool, **fields)
+
+    async def send_frame(self, kind, *fields):
+        return self.outbox.put(self.codec.encode(kind, *fields))
+
+    def ticket(self):
+        return make_ticket(self.channel_name, self.nickname, self.user_id, self.search_tags)
+
+    async def match(self):
+        # ✅ Guests only match guests, logged users only match logged users
+        if settings.MATCHMAKING_WORKER:
+            # the matchmaking worker pairs us on its next tick, see mm_matched
+            await self.channel_layer.send(
+                settings.MATCHMAKING_CHANNEL, {"type": "mm.enqueue", "pool": self.pool, "ticket": self.ticket()}
+            )
+            partner = None
+        else:
+            partner = await get_matchmaker().pair_or_wait(self.pool, self.ticket())
+        if partner:
             await self.start_room(partner)
+        elif self.search_tags:
+            self.fallback_timer = asyncio.ensure_future(self.tag_fallback())
+            await self.send_frame("SYS", f"Looking for someone into {', '.join(self.search_tags)}...")
+        elif self.is_guest:
+            await self.send_frame("SYS", "Waiting for another guest...")
+        else:
+            await self.send_frame("SYS", "Searching for a match...")
+
+    async def tag_fallback(self):
+        await asyncio.sleep(settings.CHAT_TAG_WAIT)
+        self.fallback_timer = None
+        self.search_tags = []
+        if settings.MATCHMAKING_WORKER:
+            # the worker only requeues us if it hasn't paired us in the meantime
+            await self.channel_layer.send(
+                settings.MATCHMAKING_CHANNEL, {"type": "mm.requeue", "pool": self.pool, "ticket": self.ticket()}
+            )
+        elif await get_matchmaker().remove(self.pool, self.channel_name):
+            partner = await get_matchmaker().pair_or_wait(self.pool, self.ticket())
+            if partner:
+                await self.start_room(partner)
+                return
         else:
-            USER_QUEUE.append(self)
-            await self.send(text_data=pack_sys("Searching for a match..."))
+            return  # paired just now, room_joined is on its way
+        metrics.TAG_FALLBACKS.inc(pool=self.pool)
+        await self.send_frame("SYS", "No one with your interests is around. Finding you a random match...")
+
+    def cancel_fallback(self):
+        if self.fallback_timer and self.fallback_timer is not asyncio.current_task():
+            self.fallback_timer.cancel()
+        self.fallback_timer = None
+
+    async def leave_pool(self):
+        if settings.MATCHMAKING_WORKER:
+            await self.channel_layer.send(
+                settings.MATCHMAKING_CHANNEL, {"type": "mm.dequeue", "pool": self.pool, "channel": self.channel_name}
+            )
+        else:
+            await get_matchmaker().remove(self.pool, self.channel_name)
+
+    async def mm_matched(self, event):
+        if self.room_name or self.rendezvous_with is not None:
+            # we moved on (rendezvous) before the worker's tick: the worker puts the partner back in line
+            await self.leave_pool()
+            return
+        await self.start_room(event["partner"])
+        await self.channel_layer.send(
+            settings.MATCHMAKING_CHANNEL, {"type": "mm.started", "channel": self.channel_name}
+        )
 
     async def force_match(self, force_id):
         # Only reconnect if other user is online
-        if force_id not in ONLINE_USERS:
-            await self.send(text_data=pack_sys("User is offline. Reconnect works only when user is online."))
-            USER_QUEUE.append(self)
+        if not await get_presence().is_online(force_id):
+            await self.send_frame("SYS", "User is offline. Reconnect works only when user is online.")
+            await self.match()
             return
 
-        for partner in list(USER_QUEUE):
-            if partner.user_id == force_id:
-                USER_QUEUE.remove(partner)
-                await self.start_room(partner)
-                return
+        # ✅ meet at the rendezvous for this pair, never in the random pool
+        ttl = settings.RECONNECT_RENDEZVOUS_TTL
+        partner = await get_rendezvous().arrive(self.user_id, force_id, self.ticket(), ttl)
+        if partner:
+            await self.start_room(partner)
+            return
 
-        await self.send(text_data=pack_sys("Reconnect requested... waiting for user..."))
-        USER_QUEUE.append(self)
+        self.rendezvous_with = force_id
+        self.rendezvous_timer = asyncio.ensure_future(self.rendezvous_timeout(force_id, ttl))
+        await self.group_send(
+            user_group(force_id),
+            {"type": "rendezvous_waiting", "user_id": self.user_id, "nickname": self.nickname},
+        )
+        await self.send_frame("SYS", "Reconnect requested... waiting for user...")
+
+    async def rendezvous_timeout(self, force_id, ttl):
+        await asyncio.sleep(ttl)
+        if await self.leave_rendezvous():
+            await self.send_frame("SYS", "User didn't join in time. Finding you a random match...")
+            await self.match()
+
+    async def leave_rendezvous(self):
+        """Give up our rendezvous ticket. False if the partner already claimed it."""
+        if self.rendezvous_with is None:
+            return False
+        if self.rendezvous_timer and self.rendezvous_timer is not asyncio.current_task():
+            self.rendezvous_timer.cancel()
+        force_id, self.rendezvous_with, self.rendezvous_timer = self.rendezvous_with, None, None
+        return await get_rendezvous().leave(self.user_id, force_id, self.ticket())
+
+    async def claim_rendezvous(self, user_id):
+        partner = await get_rendezvous().claim(self.user_id, user_id)
+        if not partner:
+            return False
+        await self.leave_pool()
+        await self.start_room(partner)
+        return True
+
+    async def rendezvous_waiting(self, event):
+        # someone accepted our reconnect request and is waiting for us
+        if self.room_name:
+            await self.send_frame("SYS", f"{event['nickname']} accepted your reconnect request. Click Next to join them.")
+            return
+        await self.claim_rendezvous(event["user_id"])
 
-    async def start_room(self, partner):
-        self.partner = partner
-        partner.partner = self
+    async def reconnect_request(self, event):
+        # pushed by the request views: "new", "accepted" or "rejected"
+        await self.send_frame("REQUEST", event["event"], event["nickname"], event.get("request_id"))
 
+    async def start_room(self, partner):
+        # partner is a ticket: it may belong to a socket on another worker
         room = f"room_{uuid.uuid4().hex[:10]}"
+        self.cancel_fallback()
         self.room_name = room
-        partner.room_name = room
-
-        await self.channel_layer.group_add(room, self.channel_name)
-        await self.channel_layer.group_add(room, partner.channel_name)
-
-        await self.send(text_data=pack_match(partner.nickname, partner.user_id))
-        await partner.send(text_data=pack_match(self.nickname, self.user_id))
-
-        await self.channel_layer.group_send(
-            room, {"type": "broadcast_system", "message": "✅ Connected! Start chatting."}
+        self.partner = partner["channel"]
+        self.partner_info = (partner["nickname"], partner["user_id"])
+
+        await self.join_room(self.channel_name, partner["channel"])
+
+        metrics.MATCHES.inc(pool=self.pool)
+        self.record_match()
+        await self.send_frame("MATCH", partner["nickname"], partner["user_id"])
+        await self.channel_layer.send(
+            partner["channel"],
+            {
+                "type": "room_joined",
+                "room": room,
+                "channel": self.channel_name,
+                "nickname": self.nickname,
+                "user_id": self.user_id,
+            }
         )
 
+        await self.relay({"type": "broadcast_system", "message": "✅ Connected! Start chatting."})
+
     async def next_match(self):
         if self.room_name:
-            await self.channel_layer.group_discard(self.room_name, self.channel_name)
-
-        if self.partner:
-            self.partner.partner = None
-            self.partner.room_name = None
+            await self.forget_away_partner()
+            await self.leave_room()
+            await get_room_history().discard(self.room_name)
+            self.typing.reset()
+        else:
+            # still waiting: leave the pool first so we can't be paired with ourselves
+            await self.leave_pool()
 
         self.partner = None
         self.room_name = None
+        self.waiting_since = time.monotonic()
+        self.cancel_fallback()
+        self.search_tags = self.tags
+
+        if self.user_id:
+            await self.leave_rendezvous()
+            for user_id in await get_rendezvous().pending(self.user_id):
+                if await self.claim_rendezvous(user_id):
+                    return
+
         await self.match()
 
+    async def room_joined(self, event):
+        if self.rendezvous_timer:
+            self.rendezvous_timer.cancel()
+        self.rendezvous_with = self.rendezvous_timer = None
+        self.cancel_fallback()
+        self.room_name = event["room"]
+        self.partner = event["channel"]
+        self.partner_info = (event["nickname"], event["user_id"])
+        self.record_match()
+        await self.send_frame("MATCH", event["nickname"], event["user_id"])
+
+    async def notify_partner_left(self, message):
+        await self.channel_layer.send(
+            self.partner, {"type": "partner_left", "room": self.room_name, "message": message}
+        )
+
+    async def partner_left(self, event):
+        # ignore notices about a room we already moved on from
+        if event["room"] != self.room_name:
+            return
+        await self.leave_room()
+        await get_room_history().discard(self.room_name)
+        self.typing.reset()
+        self.partner = None
+        self.room_name = None
+        await self.clear_partner_typing()
+        await self.send_frame("SYS", event["message"])
+
+    async def partner_typing(self, event):
+        if event["room"] == self.room_name:
+            self.partner_is_typing = event["active"]
+            await self.send_frame("TYPING", int(event["active"]))
+
+    async def clear_partner_typing(self):
+        # the partner can no longer send the stop themselves
+        if self.partner_is_typing:
+            self.partner_is_typing = False
+            await self.send_frame("TYPING", 0)
+
+    async def partner_interest(self, event):
+        if event["room"] == self.room_name:
+            await self.send_frame("PINTEREST")
+
     async def broadcast_message(self, event):
-        await self.send(text_data=pack_msg(event["nickname"], event["message"]))
+        if event["sender"] != self.channel_name:
+            self.partner_is_typing = False  # chat.js clears it when the message lands
+        delivered = await self.send_frame("MSG", event["nickname"], event["message"])
+        # tell the sender once per overflow, not for every dropped message
+        if (
+            not delivered
+            and self.outbox.policy == outbox.NOTIFY
+            and self.outbox.overflow_drops == 1
+            and event["sender"] != self.channel_name
+        ):
+            await self.channel_layer.send(
+                event["sender"],
+                {"type": "broadcast_system", "message": "Partner has a slow connection, some messages were not delivered."},
+            )
 
     async def broadcast_system(self, event):
-        await self.send(text_data=pack_sys(event["message"]))
+        await self.send_frame("SYS", event["message"])
@@ -0,0 +1,208 @@
+"""
+Blocklist filter for chat messages.
+
+The words and phrases in the CHAT_BLOCKLIST file (one per line, "#"
+starts a comment) are compiled once into an Aho–Corasick automaton. A
+message is then screened in a single pass over its characters, however
+long the list is. Matching ignores case and, by default, only counts
+whole words, so "class" doesn't hit "ass". CHAT_FILTER_ACTION decides
+what happens to a message that hits:
+
+- mask: blocked words are replaced with asterisks;
+- reject: the message is not sent and its author is told why.
+
+One watcher task per process checks the file every CHAT_BLOCKLIST_RELOAD
+seconds and recompiles it on a thread when it changed, so an edited list
+takes effect on every worker without a restart. A list that fails to load
+leaves the current one in place and is logged, once per distinct error.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MASK = "mask"
+REJECT = "reject"
+
+FILTERED = metrics.Counter("chat_filtered", "Messages that hit the blocklist, by action (mask / reject).")
+
+
+class Automaton:
+    """Aho–Corasick over lowercased patterns. spans() is linear in the text, plus one step per match."""
+
+    def __init__(self, patterns):
+        goto = [{}]  # state -> {char: state}
+        fail = [0]
+        out = [()]  # state -> lengths of the patterns that end here, fail links included
+        for pattern in patterns:
+            pattern = pattern.lower()
+            state = 0
+            for char in pattern:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                state = nxt
+            if state:
+                out[state] = (len(pattern),)
+
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(char, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self.goto, self.fail, self.out = goto, fail, out
+        self.states = len(goto)
+
+    def spans(self, text):
+        """(start, end) of every pattern occurrence in `text`, which must already be lowercased."""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        found = []
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.extend((i + 1 - n, i + 1) for n in out[state])
+        return found
+
+
+class ContentFilter:
+    def __init__(self, patterns=(), whole_words=True):
+        patterns = {p.strip().lower() for p in patterns}
+        patterns.discard("")
+        self.size = len(patterns)
+        self.whole_words = whole_words
+        self.automaton = Automaton(sorted(patterns))
+
+    def matches(self, text):
+        """Merged (start, end) spans of blocked words in `text`."""
+        lowered = text.lower()
+        spans = self.automaton.spans(lowered)
+        if self.whole_words:
+            spans = [(s, e) for s, e in spans if self._is_word(lowered, s, e)]
+        if len(lowered) != len(text):
+            # a few characters lowercase to two ("İ"): map spans back to positions in `text`
+            origin = [i for i, char in enumerate(text) for _ in char.lower()]
+            spans = [(origin[s], origin[e - 1] + 1) for s, e in spans]
+        merged = []
+        for start, end in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+
+    @staticmethod
+    def _is_word(text, start, end):
+        return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+    def apply(self, text, action=MASK):
+        """The text to send, with blocked words masked; None if it hits the list and `action` is reject."""
+        if not self.size:
+            return text
+        spans = self.matches(text)
+        if not spans:
+            return text
+        FILTERED.inc(action=action)
+        if action == REJECT:
+            return None
+        parts, last = [], 0
+        for start, end in spans:
+            parts += [text[last:start], "*" * (end - start)]
+            last = end
+        parts.append(text[last:])
+        return "".join(parts)
+
+
+def load(path):
+    if not path:
+        return ContentFilter()
+    with open(path, encoding="utf-8") as f:
+        return ContentFilter(line.split("#", 1)[0] for line in f)
+
+
+def _stamp(path):
+    if not path:
+        return None
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+_filter = None
+_stamp_loaded = None
+_watcher = None
+_failure = None  # the load error logged last, so a file that stays broken is reported once
+
+
+def _load_failed(exc):
+    global _failure
+    if (type(exc), str(exc)) != _failure:
+        _failure = (type(exc), str(exc))
+        logger.warning("Could not load blocklist %s, keeping the current one: %s", settings.CHAT_BLOCKLIST, exc)
+
+
+def get_content_filter():
+    global _filter, _stamp_loaded, _failure
+    if _filter is None:
+        # first message of this process; later changes are picked up by the watcher
+        path = settings.CHAT_BLOCKLIST
+        try:
+            _stamp_loaded = _stamp(path)
+            _filter = load(path)
+            _failure = None
+        except (OSError, ValueError) as exc:
+            _stamp_loaded, _filter = None, ContentFilter()
+            _load_failed(exc)
+    return _filter
+
+
+def screen(text):
+    """`text` as it may be sent, or None if it must not be."""
+    return get_content_filter().apply(text, settings.CHAT_FILTER_ACTION)
+
+
+async def reload():
+    """Recompile the blocklist if its file changed since it was loaded. True if it did."""
+    global _filter, _stamp_loaded, _failure
+    path = settings.CHAT_BLOCKLIST
+    stamp = _stamp(path)
+    if _filter is not None and stamp == _stamp_loaded:
+        return False
+    _filter = await asyncio.to_thread(load, path)
+    _stamp_loaded, _failure = stamp, None
+    return True
+
+
+def start():
+    global _watcher
+    loop = asyncio.get_running_loop()
+    if _watcher is None or _watcher.done() or _watcher.get_loop() is not loop:
+        _watcher = loop.create_task(_watch_loop())
+
+
+async def _watch_loop():
+    while True:
+        await asyncio.sleep(settings.CHAT_BLOCKLIST_RELOAD)
+        try:
+            await reload()
+        except (OSError, ValueError) as exc:
+            _load_failed(exc)
+        except Exception:
+            logger.exception("Reloading blocklist %s failed", settings.CHAT_BLOCKLIST)
@@ -0,0 +1,186 @@
+"""
+Structured chat events for capacity planning and abuse review.
+
+ChatConsumer emits connect, match, next, interest and disconnect events.
+emit() only appends a dict to this process's buffer. One flusher task per
+process hands the buffer to the sink every CHAT_EVENT_LOG_INTERVAL
+seconds, on a writer thread of its own, so no chat handler waits on disk
+or the database. If the buffer is full, the oldest events are dropped and
+counted in chat_events_total{result="dropped"}.
+
+Sockets and people only appear as anonymize()d ids: a keyed hash that
+links the events of one socket, or of one account or guest session, and
+can't be turned back into either. Pick the sink with
+settings.CHAT_EVENT_LOG and read hourly stats with `manage.py chat_stats`.
+
+- FileEventSink: append-only gzip JSON lines, one file per UTC hour,
+  files older than `keep_hours` removed.
+- DatabaseEventSink: ChatEvent rows, bulk inserted.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import groupby
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+from .backends import load_backend
+
+logger = logging.getLogger(__name__)
+
+EVENTS = metrics.Counter(
+    "chat_events", "Chat events logged, by result: written, dropped (buffer full) or failed (write retried later).",
+)
+
+_buffer = deque()
+_flusher = None
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-events")  # keeps batches in order
+
+
+def anonymize(value):
+    if value is None:
+        return None
+    key = (settings.CHAT_EVENT_LOG_SALT or settings.SECRET_KEY).encode()
+    return hmac.new(key, str(value).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def emit(event, **fields):
+    if settings.CHAT_EVENT_LOG is None:
+        return
+    if len(_buffer) >= settings.CHAT_EVENT_LOG_BUFFER:
+        _buffer.popleft()
+        EVENTS.inc(result="dropped")
+    _buffer.append({"ts": time.time(), "event": event, **fields})
+    start()
+
+
+def start():
+    global _flusher
+    loop = asyncio.get_running_loop()
+    if _flusher is None or _flusher.done() or _flusher.get_loop() is not loop:
+        _flusher = loop.create_task(_flush_loop())
+
+
+async def flush():
+    """Write out everything buffered so far. Returns how many events were written."""
+    if not _buffer:
+        return 0
+    batch = list(_buffer)
+    _buffer.clear()
+    try:
+        await asyncio.get_running_loop().run_in_executor(_writer, get_event_sink().write, batch)
+    except Exception:
+        # back in front of whatever came in meanwhile; if that filled the buffer, the oldest give way
+        room = max(settings.CHAT_EVENT_LOG_BUFFER - len(_buffer), 0)
+        kept = batch[len(batch) - room:] if room else []
+        _buffer.extendleft(reversed(kept))
+        if len(kept) < len(batch):
+            EVENTS.inc(len(batch) - len(kept), result="dropped")
+        EVENTS.inc(len(batch), result="failed")
+        raise
+    EVENTS.inc(len(batch), result="written")
+    return len(batch)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(settings.CHAT_EVENT_LOG_INTERVAL)
+        try:
+            await flush()
+        except Exception:
+            logger.exception("Writing %d chat events failed, retrying next round", len(_buffer))
+
+
+class FileEventSink:
+    def __init__(self, path, keep_hours=24 * 30, **config):
+        self.path = Path(path)
+        self.keep_hours = keep_hours
+        self.pruned_hour = None
+
+    def _file(self, hour):
+        return self.path / f"events-{datetime.fromtimestamp(hour * 3600, timezone.utc):%Y%m%d%H}.jsonl.gz"
+
+    def write(self, events):
+        self.path.mkdir(parents=True, exist_ok=True)
+        for hour, chunk in groupby(events, key=lambda e: int(e["ts"] // 3600)):
+            lines = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in chunk)
+            # every batch is one more gzip member; concatenated members read back as one stream
+            with gzip.open(self._file(hour), "at", encoding="utf-8") as f:
+                f.write(lines)
+        self.prune(int(time.time() // 3600))
+
+    def prune(self, hour):
+        if hour == self.pruned_hour:
+            return
+        self.pruned_hour = hour
+        oldest = self._file(hour - self.keep_hours).name
+        for file in self.path.glob("events-*.jsonl.gz"):
+            if file.name < oldest:
+                file.unlink(missing_ok=True)
+
+    def read(self, since=0):
+        first = self._file(int(since // 3600)).name
+        for file in sorted(self.path.glob("events-*.jsonl.gz")):
+            if file.name < first:
+                continue
+            try:
+                with gzip.open(file, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        event = json.loads(line)
+                        if event["ts"] >= since:
+                            yield event
+            except (EOFError, zlib.error):
+                continue  # the member being appended right now; it is complete on the next run
+
+
+class DatabaseEventSink:
+    def __init__(self, batch_size=1000, **config):
+        self.batch_size = batch_size
+
+    def write(self, events):
+        from .models import ChatEvent
+
+        # the writer thread lives outside any request: drop dead or expired connections like a request would
+        close_old_connections()
+        try:
+            ChatEvent.objects.bulk_create(
+                [
+                    ChatEvent(
+                        at=datetime.fromtimestamp(e["ts"], timezone.utc),
+                        event=e["event"],
+                        data={k: v for k, v in e.items() if k not in ("ts", "event")},
+                    )
+                    for e in events
+                ],
+                batch_size=self.batch_size,
+            )
+        finally:
+            close_old_connections()
+
+    def read(self, since=0):
+        from .models import ChatEvent
+
+        rows = ChatEvent.objects.filter(at__gte=datetime.fromtimestamp(since, timezone.utc)).order_by("at", "id")
+        for at, event, data in rows.values_list("at", "event", "data").iterator(chunk_size=self.batch_size):
+            yield {"ts": at.timestamp(), "event": event, **data}
+
+
+_sink = None
+
+
+def get_event_sink():
+    global _sink
+    if _sink is None:
+        _sink = load_backend(settings.CHAT_EVENT_LOG)
+    return _sink
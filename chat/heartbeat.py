@@ -0,0 +1,81 @@
+"""
+Application-level heartbeat and the stale-socket reaper.
+
+A half-open TCP connection (a phone that went into a tunnel) never makes
+daphne call disconnect(), so its consumer would keep its place in the
+waiting queue, in presence and in its groups. One sweeper task per
+process goes over this process's chat sockets every
+CHAT_HEARTBEAT_INTERVAL seconds:
+
+- a socket silent for an interval gets a PING, which chat.js answers
+  with PONG (any inbound frame counts as a sign of life);
+- a socket silent for CHAT_HEARTBEAT_TIMEOUT seconds is reaped: cleaned
+  up as if it had dropped (a partnered one is parked for resume) and
+  closed with REAPED_CLOSE_CODE, on which chat.js reconnects.
+
+What was reclaimed is counted in chat_reaped_total and returned by sweep().
+"""
+import asyncio
+import logging
+import time
+import weakref
+from collections import Counter
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+REAPED_CLOSE_CODE = 4408
+
+REAPED = metrics.Counter("chat_reaped", "Stale chat sockets reaped and the entries they held, by entry.")
+
+_live = weakref.WeakSet()  # admitted ChatConsumers of this process
+_sweeper = None
+
+
+def register(consumer):
+    _live.add(consumer)
+    start()
+
+
+def unregister(consumer):
+    _live.discard(consumer)
+
+
+def start():
+    global _sweeper
+    loop = asyncio.get_running_loop()
+    if _sweeper is None or _sweeper.done() or _sweeper.get_loop() is not loop:
+        _sweeper = loop.create_task(_sweep_loop())
+
+
+async def sweep():
+    """PING quiet sockets and reap dead ones. Returns {entry: count} of what was reclaimed."""
+    now = time.monotonic()
+    reclaimed = Counter()
+    for consumer in list(_live):
+        silent = now - consumer.last_seen
+        try:
+            if silent > settings.CHAT_HEARTBEAT_TIMEOUT:
+                held = await consumer.reap()
+                reclaimed["socket"] += 1
+                reclaimed.update(held)
+            elif silent >= settings.CHAT_HEARTBEAT_INTERVAL:
+                await consumer.send_frame("PING")
+        except Exception:
+            # one broken socket must not keep the rest from being swept
+            logger.exception("Heartbeat sweep failed for %s", consumer.channel_name)
+    for entry, count in reclaimed.items():
+        REAPED.inc(count, entry=entry)
+    return dict(reclaimed)
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(settings.CHAT_HEARTBEAT_INTERVAL)
+        try:
+            await sweep()
+        except Exception:
+            logger.exception("Heartbeat sweep failed")
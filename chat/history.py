@@ -0,0 +1,84 @@
+"""
+Recent messages of each room, kept so a socket that drops can resume.
+
+Every room has a ring buffer of its last `size` messages, each cut to
+`max_chars`, that expires `ttl` seconds after the last message. When a
+client reattaches within CHAT_RESUME_GRACE, ChatConsumer replays the buffer
+after the MATCH frame. Pick the backend with settings.ROOM_HISTORY.
+"""
+import json
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from .backends import get_redis, load_backend
+
+
+class MemoryRoomHistory:
+    def __init__(self, size=50, max_chars=2000, ttl=600, **config):
+        self.size = size
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self.rooms = OrderedDict()  # room -> (deque of (nickname, message), expires_at), least recent first
+
+    async def append(self, room, nickname, message):
+        now = time.time()
+        entry = self.rooms.pop(room, None)
+        buffer = entry[0] if entry else deque(maxlen=self.size)
+        buffer.append((nickname, message[:self.max_chars]))
+        self.rooms[room] = (buffer, now + self.ttl)
+        # rooms nobody wrote to for ttl seconds sit at the front
+        while self.rooms:
+            oldest = next(iter(self.rooms))
+            if self.rooms[oldest][1] > now:
+                break
+            del self.rooms[oldest]
+
+    async def recent(self, room):
+        entry = self.rooms.get(room)
+        if not entry or entry[1] <= time.time():
+            return []
+        return list(entry[0])
+
+    async def discard(self, room):
+        self.rooms.pop(room, None)
+
+
+class RedisRoomHistory:
+    def __init__(self, url=None, prefix="vibeconnect:history", size=50, max_chars=2000, ttl=600, client=None,
+                 **config):
+        if client is None:
+            client = get_redis(url)
+        self.redis = client
+        self.prefix = prefix
+        self.size = size
+        self.max_chars = max_chars
+        self.ttl = ttl
+
+    def _key(self, room):
+        return f"{self.prefix}:{room}"
+
+    async def append(self, room, nickname, message):
+        key = self._key(room)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, json.dumps([nickname, message[:self.max_chars]]))
+            pipe.ltrim(key, -self.size, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def recent(self, room):
+        return [tuple(json.loads(item)) for item in await self.redis.lrange(self._key(room), 0, -1)]
+
+    async def discard(self, room):
+        await self.redis.delete(self._key(room))
+
+
+_history = None
+
+
+def get_room_history():
+    global _history
+    if _history is None:
+        _history = load_backend(settings.ROOM_HISTORY)
+    return _history
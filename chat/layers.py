@@ -0,0 +1,76 @@
+"""
+Channel layers tuned for 1:1 rooms.
+
+With CHAT_RELAY = "direct" a room is just two channel names: every chat
+event is one send() to the partner's channel, so send() is the hot path.
+
+- RedisChannelLayer: send() is one Lua script instead of four round trips
+  (trim expired, check capacity, add, refresh TTL), called by its SHA.
+- InMemoryChannelLayer: the stock layer sweeps every channel and every
+  group membership for expired entries on each receive() and group_send(),
+  O(sockets) per message. This one sweeps at most every `clean_interval`
+  seconds.
+"""
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer as BaseInMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer as BaseRedisChannelLayer
+
+# KEYS: channel zset; ARGV: drop scores up to, capacity, message, score, ttl
+_SEND = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+class RedisChannelLayer(BaseRedisChannelLayer):
+    _send_script = None
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        # same key and server choice as channels_redis, so receive() is unchanged
+        non_local_name = channel
+        if "!" in channel:
+            message = dict(message.items())
+            message["__asgi_channel__"] = channel
+            non_local_name = self.non_local_name(channel)
+            index = self.consistent_hash(channel)
+        else:
+            index = next(self._send_index_generator)
+        connection = self.connection(index)
+
+        if self._send_script is None:
+            # EVALSHA on every send; redis-py loads the script on a server that doesn't have it yet
+            self._send_script = connection.register_script(_SEND)
+        now = time.time()
+        accepted = await self._send_script(
+            keys=[self.prefix + non_local_name],
+            args=[
+                int(now) - int(self.expiry), self.get_capacity(channel), self.serialize(message), now, int(self.expiry),
+            ],
+            client=connection,
+        )
+        if not accepted:
+            raise ChannelFull()
+
+
+class InMemoryChannelLayer(BaseInMemoryChannelLayer):
+    def __init__(self, clean_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.clean_interval = clean_interval
+        self._next_clean = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now < self._next_clean:
+            return
+        self._next_clean = now + self.clean_interval
+        super()._clean_expired()
@@ -0,0 +1,322 @@
+"""
+Load generator for the chat socket.
+
+Simulated clients connect, wait for a MATCH, exchange a few messages with
+their partner and hang up. Two transports are supported:
+
+- "inprocess": clients talk to ChatConsumer through the channels testing
+  communicator, in this process. Memory per connection is this process's
+  RSS growth, so it includes the simulated clients as well.
+- "ws": clients open real WebSockets against a running
+  vibeconnect.asgi:application (e.g. daphne on localhost), authenticated
+  with sessions created directly in the database.
+
+run_load() returns a plain dict so results can be saved as JSON and
+compared between runs.
+"""
+import asyncio
+import os
+import statistics
+import time
+from urllib.parse import urlparse
+
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+
+
+class ServerBusy(ConnectionError):
+    """The server turned the socket away (admission control)."""
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ms = sorted(s * 1000 for s in samples)
+    if len(ms) == 1:
+        cuts = [ms[0]] * 99
+    else:
+        cuts = statistics.quantiles(ms, n=100, method="inclusive")
+    return {
+        "count": len(ms),
+        "p50": round(cuts[49], 3),
+        "p95": round(cuts[94], 3),
+        "p99": round(cuts[98], 3),
+        "max": round(ms[-1], 3),
+    }
+
+
+class InProcessTransport:
+    def __init__(self, spec):
+        from .consumers import ChatConsumer
+
+        self.communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        if spec["guest"]:
+            self.communicator.scope["session"] = {"guest": True, "guest_nickname": spec["nickname"]}
+            self.communicator.scope["user"] = AnonymousUser()
+        else:
+            self.communicator.scope["session"] = {"nickname": spec["nickname"]}
+            self.communicator.scope["user"] = User(id=spec["user_id"], username=spec["nickname"])
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise ConnectionError("socket rejected")
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def recv(self, timeout):
+        from .admission import BUSY_CLOSE_CODE
+
+        message = await self.communicator.receive_output(timeout)
+        if message["type"] == "websocket.close":
+            raise ServerBusy() if message.get("code") == BUSY_CLOSE_CODE else ConnectionError("socket closed")
+        return message.get("text") or message.get("bytes")
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class WsTransport:
+    def __init__(self, spec, url):
+        self.spec = spec
+        self.url = url
+        self.inbox = asyncio.Queue()
+
+    async def connect(self):
+        from autobahn.asyncio.websocket import WebSocketClientFactory, WebSocketClientProtocol
+
+        inbox = self.inbox
+        opened = asyncio.get_running_loop().create_future()
+
+        class Protocol(WebSocketClientProtocol):
+            def onOpen(self):
+                if not opened.done():
+                    opened.set_result(self)
+
+            def onMessage(self, payload, is_binary):
+                inbox.put_nowait(payload.decode())
+
+            def onClose(self, was_clean, code, reason):
+                if not opened.done():
+                    opened.set_exception(ConnectionError(reason or f"closed with {code}"))
+                inbox.put_nowait(code or 0)
+
+        target = urlparse(self.url)
+        factory = WebSocketClientFactory(self.url, headers={"Cookie": self.spec["cookie"]})
+        factory.protocol = Protocol
+        port = target.port or (443 if target.scheme == "wss" else 80)
+        await asyncio.get_running_loop().create_connection(
+            factory, target.hostname, port, ssl=target.scheme == "wss" or None
+        )
+        self.protocol = await asyncio.wait_for(opened, 30)
+
+    async def send(self, text):
+        self.protocol.sendMessage(text.encode())
+
+    async def recv(self, timeout):
+        from .admission import BUSY_CLOSE_CODE
+
+        data = await asyncio.wait_for(self.inbox.get(), timeout)
+        if isinstance(data, int):
+            raise ServerBusy() if data == BUSY_CLOSE_CODE else ConnectionError("socket closed")
+        return data
+
+    async def close(self):
+        self.protocol.sendClose()
+
+
+class SimClient:
+    def __init__(self, transport, spec, messages, interval, timeout, typing=0):
+        self.transport = transport
+        self.spec = spec
+        self.messages = messages
+        self.interval = interval
+        self.timeout = timeout
+        self.typing = typing  # TYPING frames before each message, one per keystroke
+
+        self.match_latency = None
+        self.rtts = []  # send -> own echo through the room group
+        self.deliveries = []  # partner send -> receive here
+        self.sent = {}
+        self.error = None
+
+    async def frames(self, timeout):
+        for frame in (await self.transport.recv(timeout)).split("\n"):
+            yield frame.split("|", 2)
+
+    async def run(self, done):
+        try:
+            start = time.perf_counter()
+            await self.transport.connect()
+            await self.wait_for_match(start)
+            await self.chat()
+        except (asyncio.TimeoutError, ConnectionError) as exc:
+            self.error = type(exc).__name__
+        finally:
+            done.release()
+
+    async def wait_for_match(self, start):
+        while self.match_latency is None:
+            async for parts in self.frames(self.timeout):
+                if parts[0] == "MATCH":
+                    self.match_latency = time.perf_counter() - start
+
+    async def chat(self):
+        nickname = self.spec["nickname"]
+        sender = asyncio.ensure_future(self.send_messages())
+        deadline = time.perf_counter() + self.messages * self.interval + self.timeout
+        try:
+            while len(self.rtts) < self.messages or len(self.deliveries) < self.messages:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                async for parts in self.frames(remaining):
+                    if parts[0] != "MSG" or len(parts) < 3:
+                        continue
+                    tag, _, stamp = parts[2].partition("@")
+                    now = time.perf_counter()
+                    if parts[1] == nickname and tag in self.sent:
+                        self.rtts.append(now - self.sent.pop(tag))
+                    elif stamp:
+                        self.deliveries.append(now - float(stamp))
+        except asyncio.TimeoutError:
+            # a partner that gave up early only costs us deliveries, not our own echoes
+            if len(self.rtts) < self.messages:
+                raise
+        finally:
+            sender.cancel()
+
+    async def send_messages(self):
+        pause = self.interval / (self.typing + 1)
+        for seq in range(self.messages):
+            if seq:
+                await asyncio.sleep(pause)
+            for _ in range(self.typing):
+                await self.transport.send("TYPING|1")
+                await asyncio.sleep(pause)
+            tag = f"{self.spec['nickname']}.{seq}"
+            self.sent[tag] = now = time.perf_counter()
+            await self.transport.send(f"MSG|{tag}@{now}")
+
+
+def make_specs(clients, guest_ratio, prefix="lt"):
+    specs = []
+    guests = int(round(clients * guest_ratio))
+    for i in range(clients):
+        guest = i < guests
+        specs.append({"guest": guest, "nickname": f"{prefix}{i}", "user_id": None if guest else 10_000_000 + i})
+    # interleave so guests and users arrive mixed, like real traffic
+    return specs[::2] + specs[1::2]
+
+
+def prepare_ws_sessions(specs, prefix="lt"):
+    """Create sessions (and users) in the database for the "ws" transport. Returns cleanup callable."""
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.sessions.backends.db import SessionStore
+
+    stores = []
+    for spec in specs:
+        store = SessionStore()
+        if spec["guest"]:
+            store["guest"] = True
+            store["guest_nickname"] = spec["nickname"]
+        else:
+            user, created = User.objects.get_or_create(username=f"{prefix}_{spec['nickname']}")
+            if created:
+                user.set_unusable_password()
+                user.save()
+            spec["user_id"] = user.id
+            store[SESSION_KEY] = str(user.pk)
+            store[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            store["nickname"] = spec["nickname"]
+        store.create()
+        spec["session_key"] = store.session_key
+        spec["cookie"] = f"{settings.SESSION_COOKIE_NAME}={store.session_key}"
+        stores.append(store)
+
+    def cleanup():
+        for store in stores:
+            store.delete()
+
+    return cleanup
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+def relay_counts():
+    """Events this process handed to the channel layer: room relays (messages, notices) and typing changes."""
+    from . import metrics
+
+    samples = metrics.snapshot()
+    return {
+        "room_events": sum(v for (name, _), v in samples.items() if name == "chat_group_send_seconds_count"),
+        "typing": samples.get(("chat_typing_total", (("kind", "relayed"),)), 0),
+        "typing_received": samples.get(("chat_typing_total", (("kind", "received"),)), 0),
+    }
+
+
+async def run_load(specs, transport="inprocess", url=None, messages=5, interval=0.4, timeout=10.0,
+                   ramp=1.0, server_pid=None, typing=0):
+    loop = asyncio.get_running_loop()
+    clients = []
+    for spec in specs:
+        conn = InProcessTransport(spec) if transport == "inprocess" else WsTransport(spec, url)
+        clients.append(SimClient(conn, spec, messages, interval, timeout, typing))
+
+    pid = os.getpid() if transport == "inprocess" else server_pid
+    mem_before = rss_kb(pid) if pid else None
+    relays_before = relay_counts() if transport == "inprocess" else None
+
+    # everyone stays connected until the whole crowd is done, so partners don't vanish mid-chat
+    done = asyncio.Semaphore(0)
+    tasks = []
+    started = time.perf_counter()
+    for i, client in enumerate(clients):
+        tasks.append(loop.create_task(client.run(done)))
+        if ramp and i % 50 == 49:
+            await asyncio.sleep(ramp * 50 / len(clients))
+
+    for _ in clients:
+        await done.acquire()
+    elapsed = time.perf_counter() - started
+    # everyone is still connected here
+    mem_after = rss_kb(pid) if pid else None
+
+    await asyncio.gather(*(c.transport.close() for c in clients), return_exceptions=True)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    memory_per_connection = None
+    if mem_before is not None and mem_after is not None:
+        memory_per_connection = round((mem_after - mem_before) / len(clients), 2)
+    relayed = None
+    if relays_before is not None:
+        relayed = {key: value - relays_before[key] for key, value in relay_counts().items()}
+
+    return {
+        "transport": transport,
+        "clients": len(clients),
+        "guests": sum(1 for s in specs if s["guest"]),
+        "messages_per_client": messages,
+        "duration_s": round(elapsed, 3),
+        "matched": sum(1 for c in clients if c.match_latency is not None),
+        "errors": sum(1 for c in clients if c.error and c.error != "ServerBusy"),
+        "shed": sum(1 for c in clients if c.error == "ServerBusy"),
+        # clients that got all their messages through, per second: the number that should hold up past capacity
+        "completed_per_s": round(sum(1 for c in clients if c.match_latency and not c.error) / elapsed, 2),
+        "match_latency_ms": percentiles([c.match_latency for c in clients if c.match_latency is not None]),
+        "rtt_ms": percentiles([r for c in clients for r in c.rtts]),
+        "delivery_ms": percentiles([d for c in clients for d in c.deliveries]),
+        "memory_per_connection_kb": memory_per_connection,
+        "typing_per_message": typing,
+        # in-process only: what went through the channel layer, to weigh features like TYPING against
+        "relayed": relayed,
+    }
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import platform
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.loadtest import make_specs, prepare_ws_sessions, run_load
+
+
+class Command(BaseCommand):
+    help = "Run simulated chatters against ChatConsumer and report match latency, message latency and memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=1000)
+        parser.add_argument("--guest-ratio", type=float, default=0.5)
+        parser.add_argument("--messages", type=int, default=5, help="Messages each client sends once matched.")
+        parser.add_argument("--interval", type=float, default=0.4, help="Seconds between a client's messages.")
+        parser.add_argument("--timeout", type=float, default=10.0)
+        parser.add_argument("--typing", type=int, default=0, help="TYPING frames each client sends per message.")
+        parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which clients connect.")
+        parser.add_argument("--transport", choices=["inprocess", "ws"], default="inprocess")
+        parser.add_argument("--url", default="ws://127.0.0.1:8000/ws/chat/", help="Target for --transport ws.")
+        parser.add_argument("--server-pid", type=int, help="daphne pid, to report its memory per connection.")
+        parser.add_argument("--no-rate-limit", action="store_true", help="In-process only: disable CHAT_RATE_LIMITS.")
+        parser.add_argument(
+            "--max-connections", type=int, help="In-process only: CHAT_MAX_CONNECTIONS (0 turns the ceiling off)."
+        )
+        parser.add_argument("--max-loop-lag", type=float, help="In-process only: CHAT_MAX_LOOP_LAG (0 turns it off).")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        if options["clients"] < 2:
+            raise CommandError("--clients must be at least 2")
+
+        specs = make_specs(options["clients"], options["guest_ratio"])
+        cleanup = None
+        if options["transport"] == "ws":
+            cleanup = prepare_ws_sessions(specs)
+        else:
+            if options["no_rate_limit"]:
+                settings.CHAT_RATE_LIMITS = {}
+            if options["max_connections"] is not None:
+                settings.CHAT_MAX_CONNECTIONS = options["max_connections"]
+            if options["max_loop_lag"] is not None:
+                settings.CHAT_MAX_LOOP_LAG = options["max_loop_lag"]
+
+        try:
+            results = asyncio.run(run_load(
+                specs,
+                transport=options["transport"],
+                url=options["url"],
+                messages=options["messages"],
+                interval=options["interval"],
+                timeout=options["timeout"],
+                ramp=options["ramp"],
+                server_pid=options["server_pid"],
+                typing=options["typing"],
+            ))
+        finally:
+            if cleanup:
+                cleanup()
+
+        results["timestamp"] = int(time.time())
+        results["python"] = platform.python_version()
+        results["channel_layer"] = settings.CHANNEL_LAYERS["default"]["BACKEND"]
+
+        report = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as out:
+                out.write(report + "\n")
+        self.stdout.write(report)
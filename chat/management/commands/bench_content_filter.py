@@ -0,0 +1,64 @@
+import random
+import re
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.contentfilter import ContentFilter
+
+
+def word(rng):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+
+
+class Command(BaseCommand):
+    help = "Per-message cost of the blocklist automaton against regex baselines, at a given blocklist size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patterns", type=int, default=10_000)
+        parser.add_argument("--messages", type=int, default=20_000)
+        parser.add_argument("--words", type=int, default=20, help="Words per message.")
+        parser.add_argument("--hit-rate", type=float, default=0.05, help="Share of messages with a blocked word.")
+        parser.add_argument("--baseline-messages", type=int, default=200, help="Messages for the slow baselines.")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        patterns = list({word(rng) for _ in range(options["patterns"])})
+        vocabulary = [word(rng) for _ in range(5000)]
+        messages = []
+        for _ in range(options["messages"]):
+            words = rng.choices(vocabulary, k=options["words"])
+            if rng.random() < options["hit_rate"]:
+                words[rng.randrange(len(words))] = rng.choice(patterns).upper()
+            messages.append(" ".join(words))
+        chars = sum(map(len, messages)) / len(messages)
+        self.stdout.write(f"{len(patterns)} patterns, {len(messages)} messages of {chars:.0f} chars")
+
+        started = time.perf_counter()
+        blocklist = ContentFilter(patterns)
+        self.stdout.write(
+            f"{'compile':>26}: {time.perf_counter() - started:.3f}s, {blocklist.automaton.states} states"
+        )
+        self.report("automaton mask", messages, blocklist.apply)
+        self.report("automaton reject", messages, lambda m: blocklist.apply(m, "reject"))
+
+        few = messages[:options["baseline_messages"]]
+        alternation = re.compile(r"\b(?:" + "|".join(map(re.escape, patterns)) + r")\b", re.IGNORECASE)
+        self.report("one regex alternation", few, lambda m: alternation.sub(lambda x: "*" * len(x[0]), m))
+        per_word = [re.compile(rf"\b{re.escape(p)}\b", re.IGNORECASE) for p in patterns]
+
+        def regex_loop(message):
+            for pattern in per_word:
+                message = pattern.sub(lambda x: "*" * len(x[0]), message)
+            return message
+
+        self.report("regex per word", few, regex_loop)
+
+    def report(self, name, messages, screen):
+        started = time.perf_counter()
+        for message in messages:
+            screen(message)
+        per_message = (time.perf_counter() - started) / len(messages) * 1e6
+        self.stdout.write(f"{name:>26}: {per_message:9.1f} us/message")
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from chat.loadtest import make_specs, percentiles, prepare_ws_sessions
+
+PREFIX = "dbpool"
+
+ACTIVE_CONNECTIONS = """
+SELECT count(*) FROM pg_stat_activity
+WHERE datname = current_database() AND backend_type = 'client backend' AND pid <> pg_backend_pid()
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent requests through Django's ASGI handler (a thread per request, like daphne) and sample "
+        "how many Postgres connections are open. Run it with and without DB_POOL=True."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=1000)
+        parser.add_argument("--path", default="/connections/", help="Page to request, as a logged-in user.")
+        parser.add_argument("--sample-every", type=float, default=0.05, help="Seconds between connection counts.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("needs Postgres: set DATABASE_URL")
+
+        specs = make_specs(1, 0.0, prefix=PREFIX)
+        cleanup = prepare_ws_sessions(specs, prefix=PREFIX)
+        connection.close()  # the sampler counts every connection but its own
+        try:
+            results = asyncio.run(self.stress(specs[0]["cookie"], options))
+        finally:
+            cleanup()
+            User.objects.filter(username__startswith=f"{PREFIX}_").delete()
+
+        pool = connections["default"].pool if settings.DB_POOL else None
+        results["db_pool"] = settings.DATABASES["default"]["OPTIONS"].get("pool")
+        results["pool_stats"] = pool.get_stats() if pool else None
+        self.stdout.write(json.dumps(results, indent=2, default=str))
+
+    async def stress(self, cookie, options):
+        import psycopg
+
+        db = settings.DATABASES["default"]
+        sampler = await psycopg.AsyncConnection.connect(
+            dbname=db["NAME"], user=db["USER"], password=db["PASSWORD"], host=db["HOST"], port=db["PORT"] or None,
+            autocommit=True,
+        )
+        counts = []
+        stop = asyncio.Event()
+
+        async def sample():
+            while not stop.is_set():
+                counts.append((await (await sampler.execute(ACTIVE_CONNECTIONS)).fetchone())[0])
+                await asyncio.sleep(options["sample_every"])
+
+        app = get_asgi_application()
+        gate = asyncio.Semaphore(options["concurrency"])
+        latencies, statuses = [], {}
+        headers = [(b"cookie", cookie.encode()), (b"host", b"localhost")]
+
+        async def one():
+            async with gate:
+                start = time.perf_counter()
+                try:
+                    response = await HttpCommunicator(app, "GET", options["path"], headers=headers).get_response(60)
+                    status = response["status"]
+                except Exception as exc:
+                    status = type(exc).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        sampling = asyncio.ensure_future(sample())
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(options["requests"])))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(options["sample_every"] * 2)  # connections left open after the burst
+        stop.set()
+        await sampling
+        await sampler.close()
+
+        return {
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "duration_s": round(elapsed, 3),
+            "statuses": statuses,
+            "latency_ms": percentiles(latencies),
+            "connections_max": max(counts, default=0),
+            "connections_after": counts[-1] if counts else 0,
+            "connections_samples": len(counts),
+        }
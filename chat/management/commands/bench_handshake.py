@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from channels.auth import AuthMiddlewareStack
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from chat.auth import GUEST_COOKIE, ChatAuthMiddlewareStack, auth_cache_key, make_guest_token
+from chat.consumers import ChatConsumer
+from chat.loadtest import make_specs, prepare_ws_sessions
+
+
+async def handshakes_per_second(app, cookies):
+    start = time.perf_counter()
+    for cookie in cookies:
+        communicator = WebsocketCommunicator(app, "/ws/chat/", headers=[(b"cookie", cookie.encode())])
+        await communicator.connect()
+        await communicator.receive_from()
+        await communicator.disconnect()
+    return len(cookies) / (time.perf_counter() - start)
+
+
+class Command(BaseCommand):
+    help = "Measure socket handshakes/sec with the DB-backed auth stack versus the cached/stateless one."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--handshakes", type=int, default=500)
+
+    def handle(self, *args, **options):
+        n = options["handshakes"]
+        guests = make_specs(n, 1.0, prefix="hsg")
+        users = make_specs(n, 0.0, prefix="hsu")
+        cleanup = prepare_ws_sessions(guests + users, prefix="hs")
+        tokens = [f"{GUEST_COOKIE}={make_guest_token(spec['nickname'])}" for spec in guests]
+
+        before = AuthMiddlewareStack(ChatConsumer.as_asgi())
+        after = ChatAuthMiddlewareStack(ChatConsumer.as_asgi())
+        user_cookies = [spec["cookie"] for spec in users]
+        # only our own entries: the cache may be the Redis that live pools and sessions use
+        auth_keys = [auth_cache_key(spec["session_key"]) for spec in users]
+
+        try:
+            cache.delete_many(auth_keys)
+            rows = [
+                ("guest, db session (before)", before, [spec["cookie"] for spec in guests]),
+                ("guest, signed token (after)", after, tokens),
+                ("user, db session (before)", before, user_cookies),
+                ("user, cache cold (after)", after, user_cookies),
+                ("user, cache warm (after)", after, user_cookies),
+            ]
+            self.stdout.write(f"{'path':<30} {'handshakes/s':>12}")
+            for label, app, cookies in rows:
+                rate = asyncio.run(handshakes_per_second(app, cookies))
+                self.stdout.write(f"{label:<30} {rate:>12.0f}")
+        finally:
+            cache.delete_many(auth_keys)
+            cleanup()
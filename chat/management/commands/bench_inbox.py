@@ -0,0 +1,94 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from chat.loadtest import percentiles
+from chat.management.commands.purge_reconnect_requests import purge
+from chat.models import ReconnectRequest
+
+
+class Command(BaseCommand):
+    help = "Fill ReconnectRequest with synthetic rows and time the inbox query and the purge."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--active-ratio", type=float, default=0.1, help="Share of rows still unanswered.")
+        parser.add_argument("--queries", type=int, default=2000)
+        parser.add_argument("--keep", action="store_true", help="Leave the synthetic users and rows in place.")
+
+    def handle(self, *args, **options):
+        rows, n_users = options["rows"], options["users"]
+        prefix = "bench_inbox_"
+
+        self.stdout.write(f"creating {n_users} users and {rows} requests...")
+        User.objects.bulk_create(
+            [User(username=f"{prefix}{i}") for i in range(n_users)], batch_size=5000, ignore_conflicts=True
+        )
+        ids = list(User.objects.filter(username__startswith=prefix).values_list("id", flat=True))
+        started = time.perf_counter()
+        self.fill(ids, rows, options["active_ratio"])
+        self.stdout.write(f"inserted in {time.perf_counter() - started:.1f}s")
+
+        try:
+            self.bench_inbox(ids, options["queries"])
+            started = time.perf_counter()
+            purged = purge(ReconnectRequest.objects.filter(is_active=False), 5000, 0)
+            self.stdout.write(f"purged {purged} answered rows in {time.perf_counter() - started:.1f}s")
+        finally:
+            if not options["keep"]:
+                # purge in batches first so deleting the users doesn't cascade over every row at once
+                purge(ReconnectRequest.objects.filter(from_user__username__startswith=prefix), 5000, 0)
+                User.objects.filter(username__startswith=prefix).delete()
+
+    def fill(self, ids, rows, active_ratio):
+        now = timezone.now()
+        rng = random.Random(42)
+        seen = set()
+        batch = []
+        low = (ReconnectRequest.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+        for _ in range(rows):
+            from_id, to_id = rng.sample(ids, 2)
+            active = rng.random() < active_ratio and (from_id, to_id) not in seen
+            if active:
+                seen.add((from_id, to_id))
+            batch.append(ReconnectRequest(from_user_id=from_id, to_user_id=to_id, is_active=active))
+            if len(batch) == 10_000:
+                ReconnectRequest.objects.bulk_create(batch)
+                batch = []
+        ReconnectRequest.objects.bulk_create(batch)
+        # auto_now_add stamped everything "now"; spread it over two days so some rows are expired
+        high = ReconnectRequest.objects.aggregate(Max("id"))["id__max"]
+        step = timedelta(days=2) / max(high - low, 1)
+        for first in range(low, high + 1, 10_000):
+            ReconnectRequest.objects.filter(id__gte=first, id__lt=first + 10_000).update(
+                created_at=now - step * (high - first)
+            )
+
+    def bench_inbox(self, ids, queries):
+        rng = random.Random(7)
+        samples = []
+        for _ in range(queries):
+            user_id = rng.choice(ids)
+            start = time.perf_counter()
+            list(
+                ReconnectRequest.objects.filter(
+                    to_user_id=user_id, is_active=True, created_at__gte=ReconnectRequest.cutoff()
+                )
+                .select_related("from_user")
+                .order_by("-created_at")
+            )
+            samples.append(time.perf_counter() - start)
+        self.stdout.write(f"inbox latency ms: {percentiles(samples)}")
+
+        query = (
+            ReconnectRequest.objects.filter(
+                to_user_id=ids[0], is_active=True, created_at__gte=ReconnectRequest.cutoff()
+            ).order_by("-created_at")
+        )
+        self.stdout.write("plan:\n" + query.explain())
@@ -0,0 +1,46 @@
+import time
+
+import msgpack
+from django.core.management.base import BaseCommand
+
+from chat.protocol import MsgpackCodec, TextCodec
+
+SAMPLE_FRAMES = [
+    ("SYS", "✅ Connected! Start chatting."),
+    ("MATCH", "nightowl", 48213),
+    ("MSG", "nightowl", "hey, where are you from?"),
+    ("MSG", "sunny_day", "Berlin | you?"),
+    ("MSG", "nightowl", "lol " * 40),
+    ("PINTEREST",),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode cost and frame size of the text and msgpack wire formats."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=50000)
+
+    def handle(self, *args, **options):
+        rounds = options["rounds"]
+        self.stdout.write(f"{'format':>8} {'encode ns':>10} {'decode ns':>10} {'avg bytes':>10}")
+        self.bench("text", TextCodec(), "text_data", lambda data: data.split("|"), rounds)
+        self.bench("msgpack", MsgpackCodec(), "bytes_data", msgpack.unpackb, rounds)
+
+    def bench(self, name, codec, key, decode, rounds):
+        frames = [codec.encode(*f)[key] for f in SAMPLE_FRAMES]
+        size = sum(len(f.encode() if isinstance(f, str) else f) for f in frames) / len(frames)
+
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            for frame in SAMPLE_FRAMES:
+                codec.encode(*frame)
+        encode_ns = (time.perf_counter_ns() - start) / (rounds * len(SAMPLE_FRAMES))
+
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            for frame in frames:
+                decode(frame)
+        decode_ns = (time.perf_counter_ns() - start) / (rounds * len(frames))
+
+        self.stdout.write(f"{name:>8} {encode_ns:>10.0f} {decode_ns:>10.0f} {size:>10.1f}")
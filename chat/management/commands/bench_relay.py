@@ -0,0 +1,79 @@
+import asyncio
+import time
+import uuid
+
+from channels.layers import InMemoryChannelLayer as StockInMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer as StockRedisChannelLayer
+from django.core.management.base import BaseCommand
+
+from chat.layers import InMemoryChannelLayer, RedisChannelLayer
+
+EVENT = {"type": "broadcast_message", "nickname": "bench", "message": "x" * 40, "sender": "bench"}
+
+
+async def group_room(layer, a, b, messages):
+    """The old flow: a group per room, group_send per message, both members receive."""
+    room = f"room_{uuid.uuid4().hex[:10]}"
+    await layer.group_add(room, a)
+    await layer.group_add(room, b)
+    for _ in range(messages):
+        await layer.group_send(room, EVENT)
+        await layer.receive(a)
+        await layer.receive(b)
+    await layer.group_discard(room, a)
+    await layer.group_discard(room, b)
+
+
+async def direct_room(layer, a, b, messages):
+    """CHAT_RELAY = "direct": one send to the partner, the sender handles its own copy in process."""
+    for _ in range(messages):
+        await layer.send(b, EVENT)
+        await layer.receive(b)
+
+
+class Command(BaseCommand):
+    help = "Messages/s through the channel layer for the group-per-room and direct relays, InMemory and Redis."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=500)
+        parser.add_argument("--messages", type=int, default=20, help="Messages per room.")
+        parser.add_argument("--concurrency", type=int, default=100, help="Rooms chatting at once.")
+        parser.add_argument("--idle", type=int, default=5000, help="Other sockets, each in a group (user groups).")
+        parser.add_argument("--redis-url", help="Also run against this (throwaway) Redis.")
+
+    def handle(self, *args, **options):
+        layers = [
+            ("InMemory (channels)", lambda: StockInMemoryChannelLayer(capacity=1000)),
+            ("InMemory (chat)", lambda: InMemoryChannelLayer(capacity=1000)),
+        ]
+        if options["redis_url"]:
+            hosts = [options["redis_url"]]
+            layers += [
+                ("Redis (channels_redis)", lambda: StockRedisChannelLayer(hosts=hosts, prefix="bench_relay")),
+                ("Redis (chat)", lambda: RedisChannelLayer(hosts=hosts, prefix="bench_relay")),
+            ]
+        for name, make_layer in layers:
+            for flow_name, flow in (("group", group_room), ("direct", direct_room)):
+                rate = asyncio.run(self.bench(make_layer(), flow, options))
+                self.stdout.write(f"{name:>24} {flow_name:>6}: {rate:9.0f} messages/s")
+
+    async def bench(self, layer, flow, options):
+        idle = [await layer.new_channel() for _ in range(options["idle"])]
+        for i, channel in enumerate(idle):
+            await layer.group_add(f"user_{i}", channel)
+
+        gate = asyncio.Semaphore(options["concurrency"])
+
+        async def room():
+            async with gate:
+                a, b = await layer.new_channel(), await layer.new_channel()
+                await flow(layer, a, b, options["messages"])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(room() for _ in range(options["rooms"])))
+        elapsed = time.perf_counter() - started
+
+        for i, channel in enumerate(idle):
+            await layer.group_discard(f"user_{i}", channel)
+        await layer.flush()
+        return options["rooms"] * options["messages"] / elapsed
@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.loadtest import percentiles
+from chat.matchmaking import GUEST_POOL, RedisMatchmaker, WaitingPool, make_ticket
+
+
+def scan_match(pool, tags):
+    """The obvious alternative to the tag index: walk the queue until someone shares a tag."""
+    wanted = set(tags)
+    for channel, ticket in pool.tickets.items():
+        if wanted:
+            if wanted.intersection(ticket["tags"]):
+                return pool.remove(channel)
+        elif not ticket["tags"]:
+            return pool.remove(channel)
+    return None
+
+
+class Command(BaseCommand):
+    help = "Time tag matching against a pool of waiters, with the inverted index and with a linear scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--waiters", type=int, default=50_000)
+        parser.add_argument("--tags", type=int, default=1000, help="Distinct tags, popularity is Zipf-like.")
+        parser.add_argument("--max-tags", type=int, default=3, help="Tags per waiter, 1..N.")
+        parser.add_argument("--untagged", type=float, default=0.2, help="Share of waiters with no tags.")
+        parser.add_argument("--arrivals", type=int, default=5000)
+        parser.add_argument("--scan-arrivals", type=int, default=200, help="Arrivals for the (slow) linear scan.")
+        parser.add_argument("--redis-url", help="Also time RedisMatchmaker against this (throwaway) Redis.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        names = [f"t{i}" for i in range(options["tags"])]
+        weights = [1 / (rank + 1) for rank in range(len(names))]
+
+        def tags():
+            if rng.random() < options["untagged"]:
+                return []
+            return list(set(rng.choices(names, weights, k=rng.randint(1, options["max_tags"]))))
+
+        n = options["waiters"]
+        waiters = [make_ticket(f"w.{i}", "x", tags=tags()) for i in range(n)]
+        arrivals = [make_ticket(f"a.{i}", "x", tags=tags()) for i in range(options["arrivals"])]
+        refills = [make_ticket(f"r.{i}", "x", tags=tags()) for i in range(options["arrivals"])]
+
+        self.stdout.write(f"{n} waiters, {len(names)} tags, {len(arrivals)} arrivals")
+        self.report("index", *self.bench_pool(waiters, arrivals, refills, WaitingPool.pop_match))
+        scan = options["scan_arrivals"]
+        self.report("scan", *self.bench_pool(waiters, arrivals[:scan], refills, scan_match))
+        if options["redis_url"]:
+            self.report("redis", *asyncio.run(self.bench_redis(options["redis_url"], waiters, arrivals, refills)))
+
+    def report(self, impl, samples, matched):
+        stats = percentiles(samples)
+        self.stdout.write(
+            f"{impl:>6}: matched {matched}/{stats['count']}  "
+            f"p50 {stats['p50'] * 1000:.1f}us  p99 {stats['p99'] * 1000:.1f}us  max {stats['max'] * 1000:.1f}us"
+        )
+
+    def bench_pool(self, waiters, arrivals, refills, match):
+        pool = WaitingPool()
+        for ticket in waiters:
+            pool.push(ticket)
+        samples, matched = [], 0
+        for arrival, refill in zip(arrivals, refills):
+            start = time.perf_counter()
+            partner = match(pool, arrival["tags"])
+            if partner is None:
+                pool.push(arrival)
+            samples.append(time.perf_counter() - start)
+            if partner:
+                matched += 1
+                pool.push(refill)  # keep the pool at its size
+        return samples, matched
+
+    async def bench_redis(self, url, waiters, arrivals, refills):
+        mm = RedisMatchmaker(url=url, prefix="bench:tags")
+        try:
+            for i in range(0, len(waiters), 1000):
+                await asyncio.gather(*(mm.enqueue(GUEST_POOL, t) for t in waiters[i:i + 1000]))
+            samples, matched = [], 0
+            for arrival, refill in zip(arrivals, refills):
+                start = time.perf_counter()
+                partner = await mm.pair_or_wait(GUEST_POOL, arrival)
+                samples.append(time.perf_counter() - start)
+                if partner:
+                    matched += 1
+                    await mm.enqueue(GUEST_POOL, refill)
+            return samples, matched
+        finally:
+            keys = [key async for key in mm.redis.scan_iter("bench:tags*")]
+            if keys:
+                await mm.redis.delete(*keys)
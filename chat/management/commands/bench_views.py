@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+
+from chat.loadtest import percentiles
+from chat.models import Connection, UserProfile
+
+PREFIX = "bench_views_"
+PASSWORD = "bench-password"
+
+
+class Command(BaseCommand):
+    help = "Requests/s and latency of the landing, login and connections views through the ASGI handler."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000, help="Requests per landing/connections run.")
+        parser.add_argument("--logins", type=int, default=40, help="Requests per login run.")
+        parser.add_argument("--concurrency", type=int, default=50)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=f"{PREFIX}user").first()
+        if user is None:
+            user = User.objects.create_user(f"{PREFIX}user", password=PASSWORD)
+            UserProfile.objects.create(user=user, nickname="bench")
+            others = [User.objects.create_user(f"{PREFIX}{i}") for i in range(10)]
+            Connection.objects.bulk_create(
+                [Connection(owner=user, connected_user_id=o.id, connected_nickname=o.username) for o in others]
+            )
+        try:
+            asyncio.run(self.bench(user, options))
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    async def bench(self, user, options):
+        n, logins, concurrency = options["requests"], options["logins"], options["concurrency"]
+        anonymous = AsyncClient()
+        member = AsyncClient()
+        await member.aforce_login(user)
+
+        await self.report("landing", n, concurrency, lambda: anonymous.get("/"))
+        await self.report("connections", n, concurrency, lambda: member.get("/connections/"))
+        await self.report("login", logins, concurrency, lambda: AsyncClient().post(
+            "/login/", {"identity": user.username, "password": PASSWORD}
+        ))
+
+        # the landing page while a login burst hashes passwords
+        burst = asyncio.ensure_future(self.run(logins, concurrency, lambda: AsyncClient().post(
+            "/login/", {"identity": user.username, "password": PASSWORD}
+        )))
+        await asyncio.sleep(0.05)
+        await self.report("landing during logins", n // 4, concurrency, lambda: anonymous.get("/"))
+        await burst
+
+    async def run(self, n, concurrency, request):
+        gate = asyncio.Semaphore(concurrency)
+        samples = []
+
+        async def one():
+            async with gate:
+                start = time.perf_counter()
+                response = await request()
+                samples.append(time.perf_counter() - start)
+                assert response.status_code in (200, 302), response.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n)))
+        return n / (time.perf_counter() - started), samples
+
+    async def report(self, name, n, concurrency, request):
+        rate, samples = await self.run(n, concurrency, request)
+        stats = percentiles(samples)
+        self.stdout.write(
+            f"{name:>22}: {rate:8.1f} req/s  p50 {stats['p50']:.1f}ms  p99 {stats['p99']:.1f}ms  (n={n}, c={concurrency})"
+        )
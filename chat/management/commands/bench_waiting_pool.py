@@ -0,0 +1,74 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.matchmaking import WaitingPool, make_ticket
+
+
+def per_op_ns(fn, ops):
+    start = time.perf_counter_ns()
+    fn(ops)
+    return (time.perf_counter_ns() - start) / ops
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark WaitingPool against the old list-based queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="100,1000,10000,100000")
+        parser.add_argument("--ops", type=int, default=2000)
+        parser.add_argument("--skip-list", action="store_true", help="Only measure WaitingPool.")
+
+    def handle(self, *args, **options):
+        sizes = [int(x) for x in options["sizes"].split(",")]
+        ops = options["ops"]
+
+        self.stdout.write(f"{'waiters':>8} {'impl':>6} {'match ns':>10} {'remove ns':>10}")
+        for n in sizes:
+            self.report(n, "pool", self.bench_pool(n, ops))
+            if not options["skip_list"]:
+                self.report(n, "list", self.bench_list(n, ops))
+
+    def report(self, n, impl, timings):
+        match, remove = timings
+        self.stdout.write(f"{n:>8} {impl:>6} {match:>10.0f} {remove:>10.0f}")
+
+    def bench_pool(self, n, ops):
+        pool = WaitingPool()
+        for i in range(n):
+            pool.push(make_ticket(f"ch.{i}", "x", i))
+        victims = random.sample(range(n), min(ops, n))
+
+        def match(k):
+            # match the head, the next arrival takes its place at the tail
+            for i in range(k):
+                pool.push(make_ticket(f"new.{i}", "x", n + i))
+                pool.pop_match([])
+
+        def remove(k):
+            for i in victims[:k]:
+                ticket = pool.remove(f"ch.{i}")
+                if ticket:
+                    pool.push(ticket)
+
+        return per_op_ns(match, ops), per_op_ns(remove, len(victims))
+
+    def bench_list(self, n, ops):
+        queue = [make_ticket(f"ch.{i}", "x", i) for i in range(n)]
+        victims = random.sample(range(n), min(ops, n))
+
+        def match(k):
+            for i in range(k):
+                queue.append(make_ticket(f"new.{i}", "x", n + i))
+                queue.pop(0)
+
+        def remove(k):
+            for i in victims[:k]:
+                for ticket in queue:
+                    if ticket["channel"] == f"ch.{i}":
+                        queue.remove(ticket)
+                        queue.append(ticket)
+                        break
+
+        return per_op_ns(match, ops), per_op_ns(remove, len(victims))
@@ -0,0 +1,88 @@
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.events import get_event_sink
+
+
+def quantile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def hourly_stats(events, quick=10):
+    """Aggregate chat events into {hour start (epoch): stats}. A skip is a Next out of a room."""
+    hours = defaultdict(lambda: {"events": defaultdict(int), "rooms": set(), "waits": [], "skips": [], "messages": 0})
+    for event in events:
+        hour = hours[int(event["ts"] // 3600) * 3600]
+        hour["events"][event["event"]] += 1
+        if event["event"] == "match":
+            hour["rooms"].add(event["room"])
+            hour["waits"].append(event["wait"])
+        elif event["event"] == "next" and event.get("room"):
+            hour["skips"].append(event.get("duration"))
+        elif event["event"] == "disconnect":
+            hour["messages"] += event.get("messages", 0)
+
+    stats = {}
+    for start, hour in sorted(hours.items()):
+        rooms, skips = len(hour["rooms"]), hour["skips"]
+        durations = [d for d in skips if d is not None]
+        stats[start] = {
+            "connects": hour["events"]["connect"],
+            "disconnects": hour["events"]["disconnect"],
+            "rooms": rooms,
+            "wait_p50_s": quantile(hour["waits"], 0.5),
+            "wait_p90_s": quantile(hour["waits"], 0.9),
+            "nexts": hour["events"]["next"],
+            "skips": len(skips),
+            "skip_rate": round(len(skips) / rooms, 3) if rooms else None,
+            "quick_skips": sum(d < quick for d in durations),
+            "skipped_room_p50_s": quantile(durations, 0.5),
+            "interests": hour["events"]["interest"],
+            "messages": hour["messages"],
+        }
+    return stats
+
+
+class Command(BaseCommand):
+    help = "Hourly chat stats from the event log: rooms, match wait times, skip rates, messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="How far back to look.")
+        parser.add_argument("--quick", type=float, default=10, help="Skips within this many seconds count as quick.")
+        parser.add_argument("--json", action="store_true")
+
+    def handle(self, *args, **options):
+        if settings.CHAT_EVENT_LOG is None:
+            raise CommandError("the event log is off: set CHAT_EVENT_LOG=file or CHAT_EVENT_LOG=db")
+        since = (int(time.time() // 3600) - options["hours"] + 1) * 3600
+        stats = hourly_stats(get_event_sink().read(since), quick=options["quick"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps({str(start): hour for start, hour in stats.items()}, indent=2))
+            return
+        self.stdout.write(
+            f"{'hour (UTC)':<16} {'conn':>6} {'rooms':>6} {'wait p50':>9} {'wait p90':>9} "
+            f"{'skips':>6} {'rate':>6} {'quick':>6} {'msgs':>7}"
+        )
+        for start, hour in stats.items():
+            self.stdout.write(
+                f"{datetime.fromtimestamp(start, timezone.utc):%Y-%m-%d %H:00} {hour['connects']:>6} {hour['rooms']:>6} "
+                f"{_seconds(hour['wait_p50_s']):>9} {_seconds(hour['wait_p90_s']):>9} {hour['skips']:>6} "
+                f"{_rate(hour['skip_rate']):>6} {hour['quick_skips']:>6} {hour['messages']:>7}"
+            )
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def _rate(value):
+    return "-" if value is None else f"{value:.0%}"
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.models import ReconnectRequest
+
+
+def purge(queryset, batch, pause):
+    """Delete matching rows a batch of primary keys at a time, so no statement holds locks for long."""
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list("id", flat=True)[:batch])
+        if not ids:
+            return deleted
+        deleted += ReconnectRequest.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = "Delete answered and expired reconnect requests in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches.")
+        parser.add_argument("--every", type=float, help="Keep running, purging every N seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            answered = purge(ReconnectRequest.objects.filter(is_active=False), options["batch"], options["pause"])
+            expired = purge(
+                ReconnectRequest.objects.filter(is_active=True, created_at__lt=ReconnectRequest.cutoff()),
+                options["batch"],
+                options["pause"],
+            )
+            self.stdout.write(f"purged {answered} answered and {expired} expired reconnect requests")
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
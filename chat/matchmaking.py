@@ -0,0 +1,223 @@
+"""
+Matchmaking backends for the random chat pools.
+
+A waiter is described by a small "ticket" dict (channel name, nickname,
+user id) instead of a consumer object, so the Redis backend can hand it to
+any daphne worker. Pick the backend with settings.MATCHMAKING, the same way
+CHANNEL_LAYERS is configured.
+
+Tickets may carry interest tags. A tagged waiter is only paired with
+someone sharing a tag; untagged waiters are paired with each other. Each
+pool keeps an inverted index tag -> waiters (oldest first), so a match is
+found by looking at the head of a few tag lists, never by scanning the
+pool. ChatConsumer re-enters a tagged waiter untagged after
+CHAT_TAG_WAIT seconds, so nobody waits forever for a rare interest.
+"""
+import json
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .backends import get_redis, load_backend
+
+GUEST_POOL = "guest"
+USER_POOL = "user"
+
+TAGS_COOKIE = "vc_tags"
+RANDOM = "*"  # index key of untagged waiters; can't collide with a cleaned tag
+MAX_TAGS = 5
+_TAG = re.compile(r"[a-z0-9-]{1,24}")
+
+
+def parse_tags(raw):
+    """"Music, games,,music" -> ["music", "games"]: lowercased, deduplicated, at most MAX_TAGS."""
+    tags = []
+    for tag in re.split(r"[\s,]+", (raw or "").lower()):
+        if _TAG.fullmatch(tag) and tag not in tags:
+            tags.append(tag)
+    return tags[:MAX_TAGS]
+
+
+def make_ticket(channel_name, nickname, user_id=None, tags=()):
+    return {"channel": channel_name, "nickname": nickname, "user_id": user_id, "tags": list(tags)}
+
+
+def index_keys(ticket):
+    return ticket.get("tags") or [RANDOM]
+
+
+class WaitingPool:
+    """
+    FIFO of tickets with O(1) push, match and removal by channel.
+
+    Tickets are kept in an OrderedDict keyed by channel name; a second index
+    maps tag -> channels (insertion ordered, so oldest first).
+    """
+
+    def __init__(self):
+        self.tickets = OrderedDict()  # channel -> ticket, oldest first
+        self.by_tag = {}  # tag (or RANDOM) -> {channel: arrival}
+        self.arrival = 0
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, channel_name):
+        return channel_name in self.tickets
+
+    def push(self, ticket):
+        self.tickets[ticket["channel"]] = ticket
+        self.arrival += 1
+        for tag in index_keys(ticket):
+            self.by_tag.setdefault(tag, {})[ticket["channel"]] = self.arrival
+
+    def pop_match(self, tags, exclude=None):
+        """Take the oldest waiter sharing one of `tags` (untagged waiters if `tags` is empty)."""
+        best, best_arrival = None, None
+        for tag in tags or [RANDOM]:
+            for channel, arrival in (self.by_tag.get(tag) or {}).items():
+                if channel != exclude:
+                    if best is None or arrival < best_arrival:
+                        best, best_arrival = channel, arrival
+                    break
+        return self.remove(best) if best else None
+
+    def remove(self, channel_name):
+        ticket = self.tickets.pop(channel_name, None)
+        if ticket:
+            self._unindex(ticket)
+        return ticket
+
+    def _unindex(self, ticket):
+        for tag in index_keys(ticket):
+            channels = self.by_tag.get(tag)
+            if channels is not None:
+                channels.pop(ticket["channel"], None)
+                if not channels:
+                    del self.by_tag[tag]
+
+
+class MemoryMatchmaker:
+    """Process-local pools. Only sockets on the same worker can be paired."""
+
+    def __init__(self, **config):
+        self.pools = {GUEST_POOL: WaitingPool(), USER_POOL: WaitingPool()}
+
+    async def pair_or_wait(self, pool, ticket):
+        waiting = self.pools[pool]
+        partner = waiting.pop_match(ticket.get("tags"))
+        if partner is None:
+            waiting.push(ticket)
+        return partner
+
+    async def enqueue(self, pool, ticket):
+        self.pools[pool].push(ticket)
+
+    async def remove(self, pool, channel_name):
+        return self.pools[pool].remove(channel_name) is not None
+
+    async def size(self, pool):
+        return len(self.pools[pool])
+
+
+# KEYS: queue zset (channel scored by arrival), tickets hash, seq, tag index key prefix
+# ARGV: channel, ticket json, index keys of the ticket (its tags, or "*")
+# Tag index zsets are named KEYS[4] .. tag, so they are not declared up front (no Redis Cluster).
+_ENQUEUE = """
+local seq = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[1], seq, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+for i = 3, #ARGV do
+  redis.call('ZADD', KEYS[4] .. ARGV[i], seq, ARGV[1])
+end
+"""
+
+_FORGET = """
+local function forget(ch)
+  local t = redis.call('HGET', KEYS[2], ch)
+  redis.call('ZREM', KEYS[1], ch)
+  redis.call('HDEL', KEYS[2], ch)
+  if t then
+    local tags = cjson.decode(t)['tags']
+    if type(tags) ~= 'table' or #tags == 0 then
+      tags = {'*'}
+    end
+    for _, tag in ipairs(tags) do
+      redis.call('ZREM', KEYS[4] .. tag, ch)
+    end
+  end
+  return t
+end
+"""
+
+_PAIR_OR_WAIT = _FORGET + """
+local best, best_seq
+for i = 3, #ARGV do
+  local head = redis.call('ZRANGE', KEYS[4] .. ARGV[i], 0, 0, 'WITHSCORES')
+  if head[1] and (not best or tonumber(head[2]) < best_seq) then
+    best, best_seq = head[1], tonumber(head[2])
+  end
+end
+if best then
+  return forget(best)
+end
+""" + _ENQUEUE + """
+return false
+"""
+
+_REMOVE = _FORGET + """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+  forget(ARGV[1])
+  return 1
+end
+return 0
+"""
+
+
+class RedisMatchmaker:
+    """
+    Pools shared by every worker through Redis.
+
+    Each pop-and-pair runs as a single Lua script, so two workers can never
+    hand the same waiter to two different sockets.
+    """
+
+    def __init__(self, url=None, prefix="vibeconnect:mm", client=None, **config):
+        if client is None:
+            client = get_redis(url)
+        self.redis = client
+        self.prefix = prefix
+        self._pair_or_wait = client.register_script(_PAIR_OR_WAIT)
+        self._enqueue = client.register_script(_ENQUEUE)
+        self._remove = client.register_script(_REMOVE)
+
+    def _keys(self, pool):
+        base = f"{self.prefix}:{pool}"
+        return [f"{base}:queue", f"{base}:tickets", f"{self.prefix}:seq", f"{base}:tag:"]
+
+    def _args(self, ticket):
+        return [ticket["channel"], json.dumps(ticket), *index_keys(ticket)]
+
+    async def pair_or_wait(self, pool, ticket):
+        found = await self._pair_or_wait(keys=self._keys(pool), args=self._args(ticket))
+        return json.loads(found) if found else None
+
+    async def enqueue(self, pool, ticket):
+        await self._enqueue(keys=self._keys(pool), args=self._args(ticket))
+
+    async def remove(self, pool, channel_name):
+        return bool(await self._remove(keys=self._keys(pool), args=[channel_name]))
+
+    async def size(self, pool):
+        return await self.redis.zcard(self._keys(pool)[0])
+
+
+_matchmaker = None
+
+
+def get_matchmaker():
+    global _matchmaker
+    if _matchmaker is None:
+        _matchmaker = load_backend(settings.MATCHMAKING)
+    return _matchmaker
@@ -0,0 +1,318 @@
+"""
+Counters, gauges and histograms with a Prometheus text endpoint.
+
+Recording is a locked dict update in this process, cheap enough for the
+socket hot path. /metrics renders the samples of METRICS["BACKEND"]:
+
+- MemoryMetrics: this process only.
+- RedisMetrics: every worker adds its deltas to one shared Redis hash
+  every few seconds, so counters and histograms are summed across
+  processes.
+
+Gauges are read when /metrics is scraped, from state that is already
+shared (queue lengths come from the matchmaker).
+
+Scrapers send METRICS_TOKEN as a bearer token. With no token set,
+/metrics answers 404 unless DEBUG is on.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .backends import get_redis, load_backend
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_samples = defaultdict(float)  # (series name, ((label, value), ...)) -> value
+_registry = []  # every metric, in the order it was declared
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = (self.name + "_total", tuple(labels.items()))
+        with _lock:
+            _samples[key] += amount
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        labels = tuple(labels.items())
+        i = bisect_left(self.buckets, value)
+        le = str(self.buckets[i]) if i < len(self.buckets) else "+Inf"
+        # buckets are stored per bucket and made cumulative in render()
+        with _lock:
+            _samples[(self.name + "_bucket", labels + (("le", le),))] += 1
+            _samples[(self.name + "_sum", labels)] += value
+            _samples[(self.name + "_count", labels)] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Gauge:
+    """Read at scrape time: `collect` is an async callable returning {labels tuple: value}."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        _registry.append(self)
+
+
+def snapshot():
+    with _lock:
+        return dict(_samples)
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+CONNECTS = Counter("chat_connects", "Chat sockets accepted.")
+DISCONNECTS = Counter("chat_disconnects", "Chat sockets closed.")
+MESSAGES = Counter("chat_messages", "Chat messages relayed; rate() gives messages per second.")
+MATCHES = Counter("chat_matches", "Rooms started.")
+RESUMES = Counter("chat_resumes", "Reconnects with a resume token, by result (resumed / ended).")
+TYPING = Counter("chat_typing", "TYPING commands received, and typing starts/stops relayed to partners, by kind.")
+TAG_FALLBACKS = Counter("chat_tag_fallbacks", "Tagged waiters re-entered untagged after CHAT_TAG_WAIT.")
+MATCH_WAIT = Histogram("chat_match_wait_seconds", "Time from connect or Next until a room starts.", WAIT_BUCKETS)
+GROUP_SEND = Histogram(
+    "chat_group_send_seconds", "Relay latency: group_send, or the send to the partner with CHAT_RELAY=direct.",
+    LATENCY_BUCKETS,
+)
+VIEW_LATENCY = Histogram("http_view_seconds", "Django view latency, by URL name.", LATENCY_BUCKETS)
+
+
+async def _queue_lengths():
+    from .matchmaking import GUEST_POOL, USER_POOL, get_matchmaker
+
+    if settings.MATCHMAKING_WORKER:
+        # the pools live in the matchmaking worker, which publishes their sizes every tick
+        from django.core.cache import cache
+        from .workers import POOL_SIZES_KEY
+
+        sizes = await cache.aget(POOL_SIZES_KEY) or {}
+        return {(("pool", pool),): sizes.get(pool, 0) for pool in (GUEST_POOL, USER_POOL)}
+
+    matchmaker = get_matchmaker()
+    return {(("pool", pool),): await matchmaker.size(pool) for pool in (GUEST_POOL, USER_POOL)}
+
+
+QUEUE_LENGTH = Gauge("chat_queue_length", "Sockets waiting for a match.", _queue_lengths)
+
+# pool_* and requests_waiting are current; the rest are totals since the pool opened
+DB_POOL_STATS = (
+    "pool_size", "pool_available", "requests_waiting",
+    "requests_num", "requests_queued", "requests_wait_ms", "requests_errors", "connections_lost",
+)
+
+
+async def _db_pool_stats():
+    pool = connections["default"].pool if settings.DATABASES["default"].get("OPTIONS", {}).get("pool") else None
+    if pool is None:
+        return {}
+    stats = pool.get_stats()
+    return {(("stat", name),): stats.get(name, 0) for name in DB_POOL_STATS}
+
+
+DB_POOL = Gauge(
+    "db_pool",
+    "psycopg pool of the process serving /metrics. requests_wait_ms / requests_queued is the mean wait for "
+    "a connection; requests_errors counts DB_POOL_TIMEOUT expiries.",
+    _db_pool_stats,
+)
+
+
+class MemoryMetrics:
+    def __init__(self, **config):
+        pass
+
+    def start(self):
+        pass
+
+    async def collect(self):
+        return snapshot()
+
+
+class RedisMetrics:
+    def __init__(self, url=None, prefix="vibeconnect:metrics", interval=5, client=None, **config):
+        if client is None:
+            client = get_redis(url)
+        self.redis = client
+        self.key = prefix
+        self.interval = interval
+        self.flushed = {}  # what this process already added to the hash
+        self._flusher = None
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def flush(self):
+        current = snapshot()
+        deltas = {key: value - self.flushed.get(key, 0) for key, value in current.items()}
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for (name, labels), delta in deltas.items():
+                pipe.hincrbyfloat(self.key, json.dumps([name, labels]), delta)
+            await pipe.execute()
+        for key, delta in deltas.items():
+            self.flushed[key] = self.flushed.get(key, 0) + delta
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Flushing metrics to Redis failed")
+
+    async def collect(self):
+        await self.flush()
+        samples = {}
+        for field, value in (await self.redis.hgetall(self.key)).items():
+            name, labels = json.loads(field)
+            samples[(name, tuple(tuple(pair) for pair in labels))] = float(value)
+        return samples
+
+
+def _format(name, labels, value):
+    if labels:
+        text = ",".join(f'{k}="{str(v)}"' for k, v in labels)
+        name = f"{name}{{{text}}}"
+    return f"{name} {value:g}"
+
+
+async def render(samples):
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        if metric.type == "gauge":
+            for labels, value in (await metric.collect()).items():
+                lines.append(_format(metric.name, labels, value))
+        elif metric.type == "counter":
+            for (name, labels), value in sorted(samples.items()):
+                if name == metric.name + "_total":
+                    lines.append(_format(name, labels, value))
+        else:
+            buckets = defaultdict(dict)
+            for (name, labels), value in samples.items():
+                if name == metric.name + "_bucket":
+                    buckets[labels[:-1]][labels[-1][1]] = value
+            for labels in sorted(buckets):
+                total = 0
+                for le in [*map(str, metric.buckets), "+Inf"]:
+                    total += buckets[labels].get(le, 0)
+                    lines.append(_format(metric.name + "_bucket", labels + (("le", le),), total))
+                for suffix in ("_sum", "_count"):
+                    lines.append(_format(metric.name + suffix, labels, samples.get((metric.name + suffix, labels), 0)))
+    return "\n".join(lines) + "\n"
+
+
+_metrics = None
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = load_backend(settings.METRICS)
+    return _metrics
+
+
+class MetricsEndpoint:
+    """ASGI wrapper that answers GET <METRICS_PATH> itself and hands every other request to `inner`."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        backend = get_metrics()
+        backend.start()
+        if scope["type"] != "http" or scope["path"] != settings.METRICS_PATH:
+            return await self.inner(scope, receive, send)
+
+        headers = dict(scope.get("headers", []))
+        token = settings.METRICS_TOKEN
+        if not token and not settings.DEBUG:
+            status, body = 404, b"not found\n"  # without a token, only served in development
+        elif token and headers.get(b"authorization", b"").decode() != f"Bearer {token}":
+            status, body = 403, b"forbidden\n"
+        else:
+            status, body = 200, (await render(await backend.collect())).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class ViewLatencyMiddleware:
+    """Times every Django view, labelled by URL name."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, start)
+        return response
+
+    def observe(self, request, start):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else "unmatched"
+        VIEW_LATENCY.observe(time.perf_counter() - start, view=view)
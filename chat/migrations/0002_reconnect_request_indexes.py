@@ -0,0 +1,43 @@
+# Generated by Django 5.2.10 on 2026-10-18 16:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def deactivate_duplicates(apps, schema_editor):
+    # keep only the newest active request of each (from_user, to_user) pair
+    ReconnectRequest = apps.get_model('chat', 'ReconnectRequest')
+    seen = set()
+    stale = []
+    active = ReconnectRequest.objects.filter(is_active=True).order_by('-created_at', '-id')
+    for pk, pair in ((r[0], r[1:]) for r in active.values_list('id', 'from_user_id', 'to_user_id').iterator()):
+        if pair in seen:
+            stale.append(pk)
+        else:
+            seen.add(pair)
+    for i in range(0, len(stale), 1000):
+        ReconnectRequest.objects.filter(id__in=stale[i:i + 1000]).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deactivate_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reconnectrequest',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['to_user', '-created_at'], name='chat_rr_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reconnectrequest',
+            index=models.Index(fields=['is_active', 'created_at'], name='chat_rr_purge_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reconnectrequest',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('from_user', 'to_user'), name='chat_rr_one_active_pair'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.10 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_reconnect_request_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('at', models.DateTimeField()),
+                ('event', models.CharField(max_length=16)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['at'], name='chat_event_at_idx')],
+            },
+        ),
+    ]
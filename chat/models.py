@@ -1,8 +1,11 @@
 from django.db import models
 
 # Create your models here.
+from datetime import timedelta
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 User = settings.AUTH_USER_MODEL
 
@@ -30,3 +33,38 @@ class ReconnectRequest(models.Model):
     to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="received_requests")
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            # inbox: active requests to a user, newest first
+            models.Index(
+                fields=["to_user", "-created_at"],
+                condition=models.Q(is_active=True),
+                name="chat_rr_inbox_idx",
+            ),
+            # purge_reconnect_requests: answered rows, then expired ones
+            models.Index(fields=["is_active", "created_at"], name="chat_rr_purge_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["from_user", "to_user"],
+                condition=models.Q(is_active=True),
+                name="chat_rr_one_active_pair",
+            ),
+        ]
+
+    @staticmethod
+    def cutoff():
+        """Requests created before this have expired."""
+        return timezone.now() - timedelta(seconds=settings.RECONNECT_REQUEST_TTL)
+
+
+class ChatEvent(models.Model):
+    """One chat event written by chat.events.DatabaseEventSink; ids in `data` are anonymized."""
+
+    at = models.DateTimeField()
+    event = models.CharField(max_length=16)
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [models.Index(fields=["at"], name="chat_event_at_idx")]
@@ -0,0 +1,111 @@
+"""
+Bounded outbound queue for one socket.
+
+Handlers put encoded frames here instead of awaiting send() themselves. A
+writer task drains the queue and coalesces whatever piled up into a single
+WebSocket message, so a slow client never stalls the handler that is
+relaying to it. When the queue is full the configured policy decides what
+to give up. Sent, dropped and evicted counts and the queue depth are on
+/metrics.
+"""
+import asyncio
+import weakref
+from collections import deque
+
+from . import metrics
+
+DROP_OLDEST = "drop_oldest"  # keep the newest frames
+NOTIFY = "notify"  # reject the new frame, the caller tells the sender
+DISCONNECT = "disconnect"  # reject new frames, close the socket after a grace period
+
+_live = weakref.WeakSet()
+
+
+class Outbox:
+    def __init__(self, send, join, maxsize=256, policy=DROP_OLDEST, grace=10.0, max_batch=32, on_evict=None):
+        self.send = send
+        self.join = join
+        self.maxsize = maxsize
+        self.policy = policy
+        self.grace = grace
+        self.max_batch = max_batch
+        self.on_evict = on_evict
+
+        self.frames = deque()
+        self.dropped = 0
+        self.overflow_drops = 0  # drops since the queue last became full
+        self.full_since = None
+        self.evicted = False
+        self._ready = asyncio.Event()
+        self._writer = asyncio.ensure_future(self._drain())
+        _live.add(self)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame):
+        """Queue a frame. Returns False if this frame was rejected."""
+        if self.evicted:
+            return False
+
+        if len(self.frames) >= self.maxsize:
+            self.dropped += 1
+            FRAMES.inc(result="dropped")
+            loop = asyncio.get_running_loop()
+            if self.full_since is None:
+                self.full_since = loop.time()
+                self.overflow_drops = 0
+            self.overflow_drops += 1
+
+            if self.policy == DROP_OLDEST:
+                self.frames.popleft()
+            elif self.policy == DISCONNECT and loop.time() - self.full_since >= self.grace:
+                self.evict()
+                return False
+            else:
+                return False
+
+        self.frames.append(frame)
+        self._ready.set()
+        return True
+
+    def evict(self):
+        self.evicted = True
+        self.frames.clear()
+        EVICTED.inc()
+        if self.on_evict:
+            self.on_evict()
+
+    async def _drain(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.frames:
+                n = min(len(self.frames), self.max_batch)
+                batch = [self.frames.popleft() for _ in range(n)]
+                if len(self.frames) < self.maxsize:
+                    self.full_since = None
+                FRAMES.inc(n, result="sent")
+                WRITES.inc()
+                await self.send(**self.join(batch))
+
+    def close(self):
+        self._writer.cancel()
+        _live.discard(self)
+
+
+async def _depth():
+    live = list(_live)
+    return {
+        (("state", "sockets"),): len(live),
+        (("state", "queued"),): sum(len(o) for o in live),
+        (("state", "max_queued"),): max((len(o) for o in live), default=0),
+    }
+
+
+FRAMES = metrics.Counter("chat_outbox_frames", "Outbound frames, by result: sent, or dropped by a full queue.")
+WRITES = metrics.Counter("chat_outbox_writes", "WebSocket messages written; frames sent / writes is the coalescing.")
+EVICTED = metrics.Counter("chat_outbox_evicted", "Sockets closed for not keeping up with their outbox.")
+DEPTH = metrics.Gauge(
+    "chat_outbox", "Open outboxes and queued frames (total, deepest) of the process serving /metrics.", _depth
+)
@@ -0,0 +1,65 @@
+"""
+Password hashing off the event loop.
+
+PBKDF2 is deliberately slow. Run through sync_to_async it would occupy the
+one thread that every other sync call of the process queues behind, so
+a burst of logins stalls unrelated requests. Hashing runs on its own
+pool of PASSWORD_HASH_WORKERS threads instead (hashlib releases the GIL);
+a burst then only queues other logins.
+
+PasswordPoolBackend is ModelBackend with its password work moved there;
+django.contrib.auth still picks the backend, annotates the user and
+sends user_login_failed.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+
+_executor = None
+
+
+def _run(func, *args):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def ahash_password(raw_password):
+    return await _run(make_password, raw_password)
+
+
+def _check(raw_password, encoded):
+    # hashers call the setter when the stored hash uses outdated parameters
+    upgraded = []
+    ok = check_password(raw_password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return ok, upgraded[0] if upgraded else None
+
+
+class PasswordPoolBackend(ModelBackend):
+    """ModelBackend whose async path checks and upgrades passwords on the password pool."""
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # same cost as a real check, so response time doesn't reveal which accounts exist
+            await ahash_password(password)
+            return None
+
+        ok, upgraded = await _run(_check, password, user.password)
+        if not ok:
+            return None
+        if upgraded:
+            user.password = upgraded
+            await user.asave(update_fields=["password"])
+        return user if self.user_can_authenticate(user) else None
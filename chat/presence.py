@@ -0,0 +1,114 @@
+"""
+Who is online, counted per connection.
+
+Every socket of a logged-in user holds one presence entry, so closing one
+of two tabs keeps the user online. The Redis backend shares presence across
+workers; entries expire unless the owning worker keeps refreshing them, so a
+crashed worker cannot leave users online forever.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+from .backends import get_redis, load_backend
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryPresence:
+    """Process-local presence: user id -> set of open channels."""
+
+    def __init__(self, **config):
+        self.channels = {}
+
+    async def connect(self, user_id, channel_name):
+        self.channels.setdefault(user_id, set()).add(channel_name)
+
+    async def disconnect(self, user_id, channel_name):
+        channels = self.channels.get(user_id)
+        if channels is not None:
+            channels.discard(channel_name)
+            if not channels:
+                del self.channels[user_id]
+
+    async def is_online(self, user_id):
+        return user_id in self.channels
+
+    async def online_among(self, user_ids):
+        return {uid for uid in user_ids if uid in self.channels}
+
+
+class RedisPresence:
+    """
+    Presence shared through Redis.
+
+    Each user has a sorted set of channel names scored by expiry time. A
+    single task per worker re-scores all local channels every ttl/3 seconds.
+    """
+
+    def __init__(self, url=None, prefix="vibeconnect:presence", ttl=60, client=None, **config):
+        if client is None:
+            client = get_redis(url)
+        self.redis = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = {}  # channel -> user_id, sockets owned by this worker
+        self._refresher = None
+
+    def _key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    async def connect(self, user_id, channel_name):
+        self.local[channel_name] = user_id
+        await self.refresh({channel_name: user_id})
+        if self._refresher is None:
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+
+    async def disconnect(self, user_id, channel_name):
+        self.local.pop(channel_name, None)
+        await self.redis.zrem(self._key(user_id), channel_name)
+        if not self.local and self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    async def refresh(self, entries=None):
+        entries = self.local if entries is None else entries
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for channel_name, user_id in entries.items():
+                pipe.zremrangebyscore(self._key(user_id), "-inf", now)
+                pipe.zadd(self._key(user_id), {channel_name: now + self.ttl})
+                pipe.expire(self._key(user_id), self.ttl)
+            await pipe.execute()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.refresh(dict(self.local))
+            except Exception:
+                logger.exception("Refreshing presence failed")
+
+    async def is_online(self, user_id):
+        return bool(await self.online_among([user_id]))
+
+    async def online_among(self, user_ids):
+        user_ids = list(user_ids)
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(self._key(user_id), now, "+inf")
+            counts = await pipe.execute()
+        return {uid for uid, count in zip(user_ids, counts) if count}
+
+
+_presence = None
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        _presence = load_backend(settings.PRESENCE)
+    return _presence
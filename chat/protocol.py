@@ -0,0 +1,80 @@
+"""
+Wire formats for the chat socket.
+
+The text protocol is the original pipe-delimited one ("MSG|nick|text").
+Clients that offer the "vibe.msgpack" WebSocket subprotocol get binary
+frames instead: a msgpack array of [opcode, *fields] with no escaping, so
+message content goes through unchanged.
+
+Several frames may share one WebSocket message: text frames are separated
+by newlines, msgpack frames are simply concatenated.
+"""
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "vibe.msgpack"
+
+# opcodes used by the binary format, shared with chat.js
+OPCODES = {
+    "SYS": 1,
+    "MSG": 2,
+    "MATCH": 3,
+    "PINTEREST": 4,
+    "NEXT": 5,
+    "INTEREST": 6,
+    "REQUEST": 7,
+    "RESUME": 8,
+    "PING": 9,
+    "PONG": 10,
+    "TYPING": 11,
+}
+COMMANDS = {code: name for name, code in OPCODES.items()}
+
+
+def clean(text: str) -> str:
+    return (text or "").replace("|", " ").replace("\n", " ").replace("\r", " ").strip()
+
+
+class TextCodec:
+    subprotocol = None
+
+    def encode(self, kind, *fields):
+        if not fields:
+            return {"text_data": f"{kind}|"}
+        fields = ["" if f is None else clean(str(f)) for f in fields]
+        return {"text_data": "|".join([kind, *fields])}
+
+    def join(self, frames):
+        return {"text_data": "\n".join(f["text_data"] for f in frames)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if not text_data:
+            return None, ""
+        parts = text_data.split("|", 1)
+        return parts[0].upper().strip(), parts[1] if len(parts) > 1 else ""
+
+
+class MsgpackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, kind, *fields):
+        return {"bytes_data": msgpack.packb([OPCODES[kind], *fields])}
+
+    def join(self, frames):
+        return {"bytes_data": b"".join(f["bytes_data"] for f in frames)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if not bytes_data:
+            return None, ""
+        try:
+            frame = msgpack.unpackb(bytes_data)
+            cmd = COMMANDS.get(frame[0])
+            arg = frame[1] if len(frame) > 1 else ""
+        except (ValueError, TypeError, IndexError, KeyError, msgpack.UnpackException):
+            return None, ""
+        return cmd, arg if isinstance(arg, str) else ""
+
+
+def negotiate(subprotocols):
+    if MSGPACK_SUBPROTOCOL in (subprotocols or []):
+        return MsgpackCodec()
+    return TextCodec()
@@ -0,0 +1,128 @@
+"""
+Token-bucket rate limiting for socket commands.
+
+Each socket has one bucket per command, and all sockets of the same user
+(or guest session) in this worker share a second, more generous bucket.
+Both checks are a dict lookup plus a bit of arithmetic. With Redis, the
+commands listed in the counter config are also counted in a shared
+fixed-window counter, so a user cannot get around the limit by opening
+sockets on several workers.
+"""
+import time
+
+from django.conf import settings
+
+from .backends import get_redis, load_backend
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now):
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+
+_user_buckets = {}  # (user key, command) -> TokenBucket
+_user_sockets = {}  # user key -> number of open sockets using the buckets
+
+
+class RedisRateCounter:
+    """Fixed-window counter shared by all workers."""
+
+    def __init__(self, url=None, prefix="vibeconnect:rl", window=10, commands=("NEXT",), client=None, **config):
+        if client is None:
+            client = get_redis(url)
+        self.redis = client
+        self.prefix = prefix
+        self.window = window
+        self.commands = set(commands)
+
+    async def allow(self, key, cmd, rate, burst):
+        slot = int(time.time() // self.window)
+        name = f"{self.prefix}:{key}:{cmd}:{slot}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.incr(name)
+            pipe.expire(name, self.window * 2)
+            count, _ = await pipe.execute()
+        return count <= rate * self.window + burst
+
+
+_counter = None
+
+
+def get_shared_counter():
+    global _counter
+    config = settings.RATE_LIMIT_COUNTER
+    if config and _counter is None:
+        _counter = load_backend(config)
+    return _counter
+
+
+class RateLimiter:
+    def __init__(self, user_key=None, limits=None, user_factor=None, counter=None):
+        self.limits = settings.CHAT_RATE_LIMITS if limits is None else limits
+        self.user_factor = settings.CHAT_USER_RATE_FACTOR if user_factor is None else user_factor
+        self.counter = counter
+        self.user_key = user_key
+        self.buckets = {}
+        self.last_notice = 0.0
+        if user_key is not None:
+            _user_sockets[user_key] = _user_sockets.get(user_key, 0) + 1
+
+    async def allow(self, cmd):
+        limit = self.limits.get(cmd)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic()
+
+        bucket = self.buckets.get(cmd)
+        if bucket is None:
+            bucket = self.buckets[cmd] = TokenBucket(rate, burst, now)
+        if not bucket.take(now):
+            return False
+
+        if self.user_key is None:
+            return True
+
+        rate, burst = rate * self.user_factor, burst * self.user_factor
+        shared = _user_buckets.get((self.user_key, cmd))
+        if shared is None:
+            shared = _user_buckets[(self.user_key, cmd)] = TokenBucket(rate, burst, now)
+        if not shared.take(now):
+            return False
+
+        if self.counter is not None and cmd in self.counter.commands:
+            return await self.counter.allow(self.user_key, cmd, rate, burst)
+        return True
+
+    def should_notify(self, interval=1.0):
+        """Throttle notices are throttled too: at most one per interval."""
+        now = time.monotonic()
+        if now - self.last_notice < interval:
+            return False
+        self.last_notice = now
+        return True
+
+    def close(self):
+        if self.user_key is None:
+            return
+        left = _user_sockets.get(self.user_key, 1) - 1
+        if left > 0:
+            _user_sockets[self.user_key] = left
+            return
+        _user_sockets.pop(self.user_key, None)
+        for cmd in self.limits:
+            _user_buckets.pop((self.user_key, cmd), None)
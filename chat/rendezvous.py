@@ -0,0 +1,127 @@
+"""
+Meeting points for accepted reconnect requests.
+
+When a reconnect request is accepted, whichever of the two users reaches
+the chat socket first leaves a ticket here, keyed by the other user's id,
+instead of joining the random pool. The second arrival claims it in O(1)
+and the pair is started. Tickets expire after a timeout so nobody waits
+forever for a partner who never shows up.
+"""
+import json
+import time
+
+from django.conf import settings
+
+from .backends import get_redis, load_backend
+
+
+class MemoryRendezvous:
+    def __init__(self, **config):
+        self.waiting = {}  # target user_id -> {owner user_id: (ticket, expires_at)}
+
+    async def arrive(self, user_id, partner_id, ticket, ttl):
+        """Claim the partner's ticket if they are already waiting, otherwise leave ours."""
+        found = await self.claim(user_id, partner_id)
+        if found:
+            return found
+        self.waiting.setdefault(partner_id, {})[user_id] = (ticket, time.time() + ttl)
+        return None
+
+    async def claim(self, user_id, partner_id):
+        entries = self.waiting.get(user_id)
+        entry = entries.pop(partner_id, None) if entries else None
+        if entries is not None and not entries:
+            del self.waiting[user_id]
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    async def leave(self, user_id, partner_id, ticket):
+        entries = self.waiting.get(partner_id) or {}
+        entry = entries.get(user_id)
+        if not entry or entry[0]["channel"] != ticket["channel"]:
+            return False
+        del entries[user_id]
+        if not entries:
+            del self.waiting[partner_id]
+        return True
+
+    async def pending(self, user_id):
+        now = time.time()
+        return [owner for owner, (_, expires) in (self.waiting.get(user_id) or {}).items() if expires > now]
+
+
+# KEYS: waiting-for-me hash, waiting-for-partner hash
+# ARGV: partner id, my id, now, "expires:ticket" ("" to only claim), ttl
+_ARRIVE = """
+local v = redis.call('HGET', KEYS[1], ARGV[1])
+if v then
+  redis.call('HDEL', KEYS[1], ARGV[1])
+  local sep = string.find(v, ':', 1, true)
+  if tonumber(string.sub(v, 1, sep - 1)) > tonumber(ARGV[3]) then
+    return string.sub(v, sep + 1)
+  end
+end
+if ARGV[4] == '' then
+  return false
+end
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return false
+"""
+
+# KEYS: waiting-for-partner hash; ARGV: my id, my ticket json
+_LEAVE = """
+local v = redis.call('HGET', KEYS[1], ARGV[1])
+if v and string.sub(v, string.find(v, ':', 1, true) + 1) == ARGV[2] then
+  redis.call('HDEL', KEYS[1], ARGV[1])
+  return 1
+end
+return 0
+"""
+
+
+class RedisRendezvous:
+    def __init__(self, url=None, prefix="vibeconnect:rv", client=None, **config):
+        if client is None:
+            client = get_redis(url)
+        self.redis = client
+        self.prefix = prefix
+        self._arrive = client.register_script(_ARRIVE)
+        self._leave = client.register_script(_LEAVE)
+
+    def _key(self, user_id):
+        return f"{self.prefix}:to:{user_id}"
+
+    async def arrive(self, user_id, partner_id, ticket, ttl):
+        value = f"{time.time() + ttl}:{json.dumps(ticket)}"
+        found = await self._arrive(
+            keys=[self._key(user_id), self._key(partner_id)],
+            args=[partner_id, user_id, time.time(), value, int(ttl) + 1],
+        )
+        return json.loads(found) if found else None
+
+    async def claim(self, user_id, partner_id):
+        found = await self._arrive(
+            keys=[self._key(user_id), self._key(partner_id)],
+            args=[partner_id, user_id, time.time(), "", 0],
+        )
+        return json.loads(found) if found else None
+
+    async def leave(self, user_id, partner_id, ticket):
+        return bool(await self._leave(keys=[self._key(partner_id)], args=[user_id, json.dumps(ticket)]))
+
+    async def pending(self, user_id):
+        now = time.time()
+        entries = await self.redis.hgetall(self._key(user_id))
+        return [int(owner) for owner, value in entries.items() if float(value.split(b":", 1)[0]) > now]
+
+
+_rendezvous = None
+
+
+def get_rendezvous():
+    global _rendezvous
+    if _rendezvous is None:
+        _rendezvous = load_backend(settings.RENDEZVOUS)
+    return _rendezvous
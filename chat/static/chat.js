@@ -1,8 +1,26 @@
 let socket;
 
+// ✅ binary frames: msgpack [opcode, ...fields], same opcodes as chat/protocol.py
+const MSGPACK = "vibe.msgpack";
+const OP = { SYS: 1, MSG: 2, MATCH: 3, PINTEREST: 4, NEXT: 5, INTEREST: 6, REQUEST: 7, RESUME: 8, PING: 9, PONG: 10, TYPING: 11 };
+const OP_NAMES = Object.fromEntries(Object.entries(OP).map(([name, code]) => [code, name]));
+const utf8Encoder = new TextEncoder();
+const utf8Decoder = new TextDecoder();
+
+// ✅ resume token of this connection: a dropped socket reconnects into the same room
+let resumeToken = null;
+let reconnectAttempt = 0;
+const RECONNECT_MAX_DELAY = 5000;
+const BUSY_CLOSE_CODE = 4503; // chat/admission.py
+const REAPED_CLOSE_CODE = 4408; // chat/heartbeat.py: we missed PINGs, but the room may still be waiting
+
 let partnerNickname = null;
 let partnerUserId = null;
 
+// ✅ "typing...": one TYPING frame per refresh while typing; the server relays at most one change per interval
+const TYPING_REFRESH = 1500; // ms, below CHAT_TYPING_TIMEOUT
+let typingSentAt = 0;
+
 let msgCount = 0;
 let iClicked = false;
 let partnerClicked = false;
@@ -21,10 +39,13 @@ const saveForm = document.getElementById("saveForm");
 const saveUserId = document.getElementById("saveUserId");
 const saveNick = document.getElementById("saveNick");
 
-function addMessage(name, text) {
+function addMessage(name, text, ...extra) {
+  // ✅ names and text are other people's input: text nodes only, never HTML
   const div = document.createElement("div");
   div.className = "msg";
-  div.innerHTML = `<b>${name}:</b> ${text}`;
+  const b = document.createElement("b");
+  b.textContent = `${name}:`;
+  div.append(b, ` ${text}`, ...extra);
   messages.appendChild(div);
 
   // ✅ keep last 5 visible
@@ -35,8 +56,27 @@ function addMessage(name, text) {
   messages.scrollTop = messages.scrollHeight;
 }
 
-function systemMessage(text) {
-  addMessage("System", text);
+function systemMessage(text, ...extra) {
+  addMessage("System", text, ...extra);
+}
+
+function link(href, label) {
+  const a = document.createElement("a");
+  a.href = href;
+  a.textContent = label;
+  return a;
+}
+
+function showPartner(typing = false) {
+  partnerInfo.textContent = `Matched with: ${partnerNickname}${typing ? " · typing..." : ""}`;
+}
+
+function sendTyping(active) {
+  if (!socket || socket.readyState !== WebSocket.OPEN) return;
+  const now = Date.now();
+  if (active && now - typingSentAt < TYPING_REFRESH) return;
+  typingSentAt = active ? now : 0;
+  sendFrame("TYPING", active ? "1" : "0");
 }
 
 function resetChatUI() {
@@ -59,69 +99,208 @@ function saveConnection() {
   saveForm.submit();
 }
 
+// Minimal msgpack: only the types our frames use (small ints, nil, bools, strings, arrays)
+function msgpackEncode(values) {
+  const out = [0x90 | values.length];
+  for (const value of values) {
+    if (typeof value === "number") {
+      out.push(value & 0x7f);
+      continue;
+    }
+    const bytes = utf8Encoder.encode(value);
+    const n = bytes.length;
+    if (n < 32) out.push(0xa0 | n);
+    else if (n < 256) out.push(0xd9, n);
+    else if (n < 65536) out.push(0xda, n >> 8, n & 0xff);
+    else out.push(0xdb, (n >>> 24) & 0xff, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff);
+    for (const b of bytes) out.push(b);
+  }
+  return new Uint8Array(out);
+}
+
+// Decodes every object in the buffer: the server may coalesce several frames
+function msgpackDecodeAll(buffer) {
+  const view = new DataView(buffer);
+  let pos = 0;
+
+  const str = (n) => {
+    const s = utf8Decoder.decode(new Uint8Array(buffer, pos, n));
+    pos += n;
+    return s;
+  };
+  const arr = (n) => {
+    const items = [];
+    for (let i = 0; i < n; i++) items.push(read());
+    return items;
+  };
+  const u8 = () => view.getUint8(pos++);
+  const u16 = () => { pos += 2; return view.getUint16(pos - 2); };
+  const u32 = () => { pos += 4; return view.getUint32(pos - 4); };
+
+  function read() {
+    const b = u8();
+    if (b < 0x80) return b;
+    if ((b & 0xf0) === 0x90) return arr(b & 0x0f);
+    if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+    switch (b) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xcc: return u8();
+      case 0xcd: return u16();
+      case 0xce: return u32();
+      case 0xcf: pos += 8; return Number(view.getBigUint64(pos - 8));
+      case 0xd9: return str(u8());
+      case 0xda: return str(u16());
+      case 0xdb: return str(u32());
+      case 0xdc: return arr(u16());
+    }
+    throw new Error(`unsupported msgpack type 0x${b.toString(16)}`);
+  }
+
+  const values = [];
+  while (pos < buffer.byteLength) values.push(read());
+  return values;
+}
+
+// Both formats end up as a list of ["TYPE", field, ...] string arrays
+function parseFrames(data) {
+  if (typeof data === "string") return data.split("\n").map((line) => line.split("|"));
+
+  return msgpackDecodeAll(data).map((frame) => {
+    const fields = frame.slice(1).map((v) => (v === null ? "" : String(v)));
+    return [OP_NAMES[frame[0]] || "", ...fields];
+  });
+}
+
+function sendFrame(type, text = "") {
+  if (socket.protocol === MSGPACK) {
+    socket.send(msgpackEncode([OP[type], text]));
+  } else {
+    socket.send(`${type}|${text}`);
+  }
+}
+
 function connectSocket() {
   // socket = new WebSocket(`ws://${window.location.host}/ws/chat/`);
   const protocol = window.location.protocol === "https:" ? "wss" : "ws";
-  socket = new WebSocket(`${protocol}://${window.location.host}/ws/chat/`);
+  const query = resumeToken ? `?resume=${encodeURIComponent(resumeToken)}` : "";
+  socket = new WebSocket(`${protocol}://${window.location.host}/ws/chat/${query}`, [MSGPACK]);
+  socket.binaryType = "arraybuffer";
 
   socket.onopen = () => {
+    reconnectAttempt = 0;
     statusEl.textContent = "Connected ✅";
-    partnerInfo.textContent = "Finding match...";
+    if (!resumeToken) partnerInfo.textContent = "Finding match...";
   };
 
   socket.onmessage = (event) => {
-    const raw = (event.data || "").toString();
-    const parts = raw.split("|");
-    const type = (parts[0] || "").trim();
+    for (const parts of parseFrames(event.data || "")) handleFrame(parts);
+  };
 
-    if (type === "SYS") {
-      systemMessage(parts.slice(1).join("|"));
+  socket.onclose = (event) => {
+    if (event.code === BUSY_CLOSE_CODE) {
+      // server is shedding load: come back after its retry hint, spread out so we don't all return at once
+      const retry = Number((event.reason || "").replace("retry=", "")) || 5;
+      const delay = retry * 1000 * (0.5 + Math.random());
+      statusEl.textContent = `Server busy, retrying in ${Math.round(delay / 1000)} s...`;
+      setTimeout(connectSocket, delay);
       return;
     }
+    // 1000 = we closed on purpose, other 4xxx = the server sent us away: don't come back
+    if (event.code === 1000 || (event.code >= 4000 && event.code !== REAPED_CLOSE_CODE)) {
+      statusEl.textContent = "Disconnected ❌ (refresh page)";
+      partnerInfo.textContent = "";
+      return;
+    }
+    // network blip: reconnect with the resume token, full jitter backoff
+    const delay = Math.random() * Math.min(RECONNECT_MAX_DELAY, 500 * 2 ** reconnectAttempt++);
+    statusEl.textContent = "Reconnecting...";
+    setTimeout(connectSocket, delay);
+  };
+}
 
-    if (type === "MATCH") {
-      resetChatUI();
-      messages.innerHTML = "";
+// leaving the page ends the chat right away instead of holding the room for the grace period
+window.addEventListener("pagehide", () => socket && socket.close(1000));
 
-      partnerNickname = parts[1] || "Unknown";
-      partnerUserId = parts[2] || "";
+function handleFrame(parts) {
+  const type = (parts[0] || "").trim();
 
-      partnerInfo.textContent = `Matched with: ${partnerNickname}`;
-      systemMessage(`You are chatting with ${partnerNickname}.`);
-      return;
-    }
+  if (type === "PING") {
+    sendFrame("PONG");
+    return;
+  }
 
-    if (type === "MSG") {
-      const nickname = parts[1] || "Unknown";
-      const message = parts.slice(2).join("|");
+  if (type === "RESUME") {
+    resumeToken = parts[1];
+    return;
+  }
 
-      addMessage(nickname, message);
+  if (type === "SYS") {
+    systemMessage(parts.slice(1).join("|"));
+    return;
+  }
 
-      msgCount++;
+  if (type === "TYPING") {
+    if (partnerNickname) showPartner(parts[1] === "1");
+    return;
+  }
 
-      if (!window.IS_GUEST && interestedBtn && msgCount >= 5) {
-        interestedBtn.disabled = false;
-        interestedBtn.textContent = "Interested";
-      }
-      return;
+  if (type === "MATCH") {
+    resetChatUI();
+    messages.innerHTML = "";
+
+    partnerNickname = parts[1] || "Unknown";
+    partnerUserId = parts[2] || "";
+
+    showPartner();
+    systemMessage(`You are chatting with ${partnerNickname}.`);
+    return;
+  }
+
+  if (type === "MSG") {
+    const nickname = parts[1] || "Unknown";
+    const message = parts.slice(2).join("|");
+
+    addMessage(nickname, message);
+    if (partnerNickname && nickname === partnerNickname) showPartner();
+
+    msgCount++;
+
+    if (!window.IS_GUEST && interestedBtn && msgCount >= 5) {
+      interestedBtn.disabled = false;
+      interestedBtn.textContent = "Interested";
     }
+    return;
+  }
 
-    if (type === "PINTEREST") {
-      partnerClicked = true;
-      systemMessage("Partner clicked Interested.");
+  if (type === "PINTEREST") {
+    partnerClicked = true;
+    systemMessage("Partner clicked Interested.");
 
-      if (!window.IS_GUEST && iClicked && partnerClicked) {
-        systemMessage("✅ Mutual Interested! Saving connection...");
-        saveConnection();
-      }
-      return;
+    if (!window.IS_GUEST && iClicked && partnerClicked) {
+      systemMessage("✅ Mutual Interested! Saving connection...");
+      saveConnection();
     }
-  };
+    return;
+  }
 
-  socket.onclose = () => {
-    statusEl.textContent = "Disconnected ❌ (refresh page)";
-    partnerInfo.textContent = "";
-  };
+  if (type === "REQUEST") {
+    // ✅ reconnect requests pushed by the server, no need to reload /requests/
+    const [, event, nickname, requestId] = parts;
+    if (event === "new") {
+      const id = encodeURIComponent(requestId);
+      systemMessage(
+        `${nickname} wants to reconnect. `,
+        link(`/requests/accept/${id}/`, "Accept"), " · ", link(`/requests/reject/${id}/`, "Reject")
+      );
+    } else if (event === "accepted") {
+      systemMessage(`✅ ${nickname} accepted your reconnect request.`);
+    } else if (event === "rejected") {
+      systemMessage(`${nickname} declined your reconnect request.`);
+    }
+    return;
+  }
 }
 
 // Send message
@@ -129,10 +308,13 @@ sendBtn.addEventListener("click", () => {
   const msg = msgInput.value.trim();
   if (!msg) return;
 
-  socket.send(`MSG|${msg}`);
+  sendFrame("MSG", msg);
   msgInput.value = "";
+  typingSentAt = 0; // the message ends our typing on the partner's side
 });
 
+msgInput.addEventListener("input", () => sendTyping(msgInput.value.trim() !== ""));
+
 msgInput.addEventListener("keydown", (e) => {
   if (e.key === "Enter") sendBtn.click();
 });
@@ -143,7 +325,7 @@ skipBtn.addEventListener("click", () => {
   resetChatUI();
   messages.innerHTML = "";
   partnerInfo.textContent = "Finding match...";
-  socket.send("NEXT|");
+  sendFrame("NEXT");
 });
 
 if (interestedBtn) {
@@ -154,7 +336,7 @@ if (interestedBtn) {
     interestedBtn.disabled = true;
     interestedBtn.textContent = "Interested ✓";
 
-    socket.send("INTEREST|");
+    sendFrame("INTEREST");
 
     // if other already clicked
     if (partnerClicked) {
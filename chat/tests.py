@@ -1,3 +1,1524 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from collections import deque
+from datetime import timedelta
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer as BaseInMemoryChannelLayer, get_channel_layer
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.contrib.sessions.models import Session
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    admission, backends, contentfilter, events, heartbeat, history, matchmaking, metrics, outbox, passwords, presence,
+    rendezvous,
+)
+from .backends import load_backend
+from .auth import GUEST_COOKIE, ChatAuthMiddlewareStack, force_match_key, make_guest_token
+from .consumers import ChatConsumer, user_group
+from .contentfilter import REJECT, Automaton, ContentFilter
+from .history import MemoryRoomHistory, RedisRoomHistory
+from .events import DatabaseEventSink, FileEventSink
+from .layers import InMemoryChannelLayer, RedisChannelLayer
+from .loadtest import make_specs, percentiles, run_load
+from .management.commands.chat_stats import hourly_stats
+from .models import ReconnectRequest, UserProfile
+from .metrics import MetricsEndpoint
+from .matchmaking import (
+    GUEST_POOL, MAX_TAGS, TAGS_COOKIE, USER_POOL, MemoryMatchmaker, RedisMatchmaker, WaitingPool, make_ticket, parse_tags,
+)
+from .outbox import DISCONNECT, DROP_OLDEST, NOTIFY, Outbox
+from .presence import MemoryPresence, RedisPresence
+from .ratelimit import RateLimiter, RedisRateCounter, TokenBucket
+from .rendezvous import MemoryRendezvous, RedisRendezvous
+from .typingindicator import TypingIndicator
+from .workers import MatchmakingWorker
+from .protocol import MSGPACK_SUBPROTOCOL, OPCODES, MsgpackCodec, TextCodec
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover - optional test dependency
+    fakeredis = None
+else:
+    class InterleavedFakeRedis(fakeredis.FakeAsyncRedis):
+        """Yields to the event loop before every command, as a round trip to a real server does."""
+
+        async def execute_command(self, *args, **options):
+            await asyncio.sleep(0)
+            return await super().execute_command(*args, **options)
+
+
+class WaitingPoolTests(SimpleTestCase):
+    def test_fifo_with_removal(self):
+        pool = WaitingPool()
+        for i in range(5):
+            pool.push(make_ticket(f"ch.{i}", str(i), i))
+        self.assertEqual(pool.remove("ch.2")["user_id"], 2)
+        self.assertIsNone(pool.remove("ch.2"))
+        self.assertNotIn("ch.2", pool)
+        self.assertEqual([pool.pop_match([])["channel"] for _ in range(4)], ["ch.0", "ch.1", "ch.3", "ch.4"])
+        self.assertIsNone(pool.pop_match([]))
+        self.assertEqual((len(pool), pool.by_tag), (0, {}))
+
+
+class TagIndexTests(SimpleTestCase):
+    def test_parse_tags(self):
+        self.assertEqual(parse_tags(" Music, games,,music  k-pop ! *"), ["music", "games", "k-pop"])
+        self.assertEqual(len(parse_tags(",".join(f"t{i}" for i in range(20)))), MAX_TAGS)
+        self.assertEqual(parse_tags(None), [])
+
+    def test_pop_match_takes_oldest_overlap(self):
+        pool = WaitingPool()
+        pool.push(make_ticket("ch.plain", "p"))
+        pool.push(make_ticket("ch.music", "m", tags=["music"]))
+        pool.push(make_ticket("ch.both", "b", tags=["games", "music"]))
+        pool.push(make_ticket("ch.games", "g", tags=["games"]))
+
+        self.assertEqual(pool.pop_match(["games", "chess"])["channel"], "ch.both")
+        self.assertEqual(pool.by_tag["music"], {"ch.music": 2})
+        self.assertIsNone(pool.pop_match(["chess"]))
+        self.assertEqual(pool.pop_match([], exclude="ch.x")["channel"], "ch.plain")
+        self.assertIsNone(pool.pop_match([]))
+        self.assertIsNone(pool.pop_match(["games"], exclude="ch.games"))
+        self.assertEqual(set(pool.by_tag), {"music", "games"})
+
+
+class BackendCases:
+    """Contract tests run against every implementation of a backend; `backend` is the class under test."""
+
+    backend = None
+
+    def make(self, **config):
+        return self.backend(**config)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is not installed")
+class RedisVariant:
+    """Runs the cases of a Redis backend against fakeredis. Listed before the cases it extends."""
+
+    def redis_client(self):
+        return fakeredis.FakeAsyncRedis()
+
+    def make(self, **config):
+        return super().make(client=self.redis_client(), **config)
+
+
+class MatchmakerCases(BackendCases):
+    def setUp(self):
+        self.mm = self.make()
+
+    async def test_first_waits_second_pairs(self):
+        a = make_ticket("ch.a", "A")
+        b = make_ticket("ch.b", "B")
+        self.assertIsNone(await self.mm.pair_or_wait(GUEST_POOL, a))
+        self.assertEqual(await self.mm.pair_or_wait(GUEST_POOL, b), a)
+        self.assertEqual(await self.mm.size(GUEST_POOL), 0)
+
+    async def test_pools_are_separate(self):
+        await self.mm.pair_or_wait(GUEST_POOL, make_ticket("ch.g", "G"))
+        self.assertIsNone(await self.mm.pair_or_wait(USER_POOL, make_ticket("ch.u", "U", 1)))
+        self.assertEqual(await self.mm.size(GUEST_POOL), 1)
+        self.assertEqual(await self.mm.size(USER_POOL), 1)
+
+    async def test_fifo_order(self):
+        for name in "abc":
+            await self.mm.enqueue(USER_POOL, make_ticket(f"ch.{name}", name))
+        popped = [(await self.mm.pair_or_wait(USER_POOL, make_ticket("ch.x", "x")))["channel"] for _ in range(3)]
+        self.assertEqual(popped, ["ch.a", "ch.b", "ch.c"])
+
+    async def test_remove(self):
+        await self.mm.enqueue(GUEST_POOL, make_ticket("ch.a", "A"))
+        self.assertTrue(await self.mm.remove(GUEST_POOL, "ch.a"))
+        self.assertFalse(await self.mm.remove(GUEST_POOL, "ch.a"))
+        self.assertEqual(await self.mm.size(GUEST_POOL), 0)
+
+    async def test_tags_pair_on_overlap_only(self):
+        music = make_ticket("ch.m", "m", tags=["music"])
+        games = make_ticket("ch.g", "g", tags=["games", "chess"])
+        self.assertIsNone(await self.mm.pair_or_wait(GUEST_POOL, music))
+        self.assertIsNone(await self.mm.pair_or_wait(GUEST_POOL, games))
+        self.assertIsNone(await self.mm.pair_or_wait(GUEST_POOL, make_ticket("ch.r", "r")))
+        self.assertEqual(await self.mm.pair_or_wait(GUEST_POOL, make_ticket("ch.c", "c", tags=["chess"])), games)
+        self.assertTrue(await self.mm.remove(GUEST_POOL, "ch.m"))
+        self.assertEqual(await self.mm.pair_or_wait(GUEST_POOL, make_ticket("ch.x", "x")), make_ticket("ch.r", "r"))
+        self.assertIsNone(await self.mm.pair_or_wait(GUEST_POOL, make_ticket("ch.y", "y", tags=["music"])))
+        self.assertEqual(await self.mm.size(GUEST_POOL), 1)
+
+    async def test_concurrent_arrivals_pair_exactly_once(self):
+        tickets = [make_ticket(f"ch.{i}", str(i)) for i in range(200)]
+        results = await asyncio.gather(*(self.mm.pair_or_wait(GUEST_POOL, t) for t in tickets))
+        paired = [r["channel"] for r in results if r]
+        self.assertEqual(len(paired), len(set(paired)))
+        self.assertEqual(len(paired) * 2 + await self.mm.size(GUEST_POOL), len(tickets))
+
+
+class MemoryMatchmakerTests(MatchmakerCases, SimpleTestCase):
+    backend = MemoryMatchmaker
+
+
+class RedisMatchmakerTests(RedisVariant, MatchmakerCases, SimpleTestCase):
+    backend = RedisMatchmaker
+
+    async def test_workers_share_pools(self):
+        server = fakeredis.FakeServer()
+        worker_a = RedisMatchmaker(client=fakeredis.FakeAsyncRedis(server=server))
+        worker_b = RedisMatchmaker(client=fakeredis.FakeAsyncRedis(server=server))
+        a = make_ticket("ch.a", "A", 1)
+        self.assertIsNone(await worker_a.pair_or_wait(USER_POOL, a))
+        self.assertEqual(await worker_b.pair_or_wait(USER_POOL, make_ticket("ch.b", "B", 2)), a)
+        self.assertEqual(await worker_a.size(USER_POOL), 0)
+
+
+class PresenceCases(BackendCases):
+    def setUp(self):
+        self.presence = self.make()
+
+    async def test_counts_connections_per_user(self):
+        await self.presence.connect(1, "tab.1")
+        await self.presence.connect(1, "tab.2")
+        await self.presence.disconnect(1, "tab.1")
+        self.assertTrue(await self.presence.is_online(1))
+        await self.presence.disconnect(1, "tab.2")
+        self.assertFalse(await self.presence.is_online(1))
+
+    async def test_online_among(self):
+        for uid in (1, 3, 5):
+            await self.presence.connect(uid, f"ch.{uid}")
+        self.assertEqual(await self.presence.online_among(range(1, 7)), {1, 3, 5})
+        for uid in (1, 3, 5):
+            await self.presence.disconnect(uid, f"ch.{uid}")
+
+
+class MemoryPresenceTests(PresenceCases, SimpleTestCase):
+    backend = MemoryPresence
+
+
+class RedisPresenceTests(RedisVariant, PresenceCases, SimpleTestCase):
+    backend = RedisPresence
+
+    async def test_entries_expire_without_heartbeat(self):
+        presence = self.make(ttl=-1)
+        await presence.refresh({"ch.dead": 9})
+        self.assertFalse(await presence.is_online(9))
+
+    async def test_shared_between_workers(self):
+        server = fakeredis.FakeServer()
+        worker_a = RedisPresence(client=fakeredis.FakeAsyncRedis(server=server))
+        worker_b = RedisPresence(client=fakeredis.FakeAsyncRedis(server=server))
+        await worker_a.connect(1, "ch.a")
+        self.assertTrue(await worker_b.is_online(1))
+        await worker_a.disconnect(1, "ch.a")
+        self.assertFalse(await worker_b.is_online(1))
+
+
+class RendezvousCases(BackendCases):
+    def setUp(self):
+        self.rv = self.make()
+
+    async def test_second_arrival_claims_the_first(self):
+        a = make_ticket("ch.a", "A", 1)
+        self.assertIsNone(await self.rv.arrive(1, 2, a, ttl=30))
+        self.assertEqual(await self.rv.pending(2), [1])
+        self.assertEqual(await self.rv.arrive(2, 1, make_ticket("ch.b", "B", 2), ttl=30), a)
+        self.assertEqual(await self.rv.pending(2), [])
+
+    async def test_strangers_cannot_claim(self):
+        await self.rv.arrive(1, 2, make_ticket("ch.a", "A", 1), ttl=30)
+        self.assertIsNone(await self.rv.claim(3, 1))
+        self.assertIsNone(await self.rv.claim(3, 2))
+        self.assertEqual(await self.rv.pending(2), [1])
+
+    async def test_expired_ticket_is_not_claimed(self):
+        await self.rv.arrive(1, 2, make_ticket("ch.a", "A", 1), ttl=-1)
+        self.assertEqual(await self.rv.pending(2), [])
+        self.assertIsNone(await self.rv.claim(2, 1))
+
+    async def test_leave_only_removes_own_ticket(self):
+        a = make_ticket("ch.a", "A", 1)
+        await self.rv.arrive(1, 2, a, ttl=30)
+        self.assertFalse(await self.rv.leave(1, 2, make_ticket("ch.other-tab", "A", 1)))
+        self.assertTrue(await self.rv.leave(1, 2, a))
+        self.assertFalse(await self.rv.leave(1, 2, a))
+
+    async def test_simultaneous_arrivals_pair_once(self):
+        rng = random.Random(1)
+
+        async def arrive(user_id, partner_id):
+            for _ in range(rng.randrange(4)):
+                await asyncio.sleep(0)  # shuffle who of a pair gets in first
+            return await self.rv.arrive(user_id, partner_id, make_ticket(f"ch.{user_id}", "x", user_id), ttl=30)
+
+        pairs = [(i, i + 1000) for i in range(100)]
+        arrivals = []
+        for a, b in pairs:
+            arrivals += [arrive(a, b), arrive(b, a)]
+        results = await asyncio.gather(*arrivals)
+        for i in range(len(pairs)):
+            self.assertEqual(sum(1 for r in results[2 * i:2 * i + 2] if r), 1)
+
+
+class MemoryRendezvousTests(RendezvousCases, SimpleTestCase):
+    backend = MemoryRendezvous
+
+
+class RedisRendezvousTests(RedisVariant, RendezvousCases, SimpleTestCase):
+    backend = RedisRendezvous
+
+    def redis_client(self):
+        # every command yields, so concurrent arrivals interleave between round trips
+        return InterleavedFakeRedis()
+
+
+class RoomHistoryCases(BackendCases):
+    async def test_keeps_the_last_messages_cut_to_size(self):
+        rooms = self.make(size=3, max_chars=5)
+        for i in range(5):
+            await rooms.append("r1", "a", f"message {i}")
+        await rooms.append("r2", "b", "hi")
+        self.assertEqual(await rooms.recent("r1"), [("a", "messa")] * 3)
+        self.assertEqual(await rooms.recent("r2"), [("b", "hi")])
+
+    async def test_discard_and_expiry(self):
+        rooms = self.make()
+        await rooms.append("r1", "a", "hi")
+        await rooms.discard("r1")
+        self.assertEqual(await rooms.recent("r1"), [])
+        self.assertEqual(await rooms.recent("never"), [])
+
+
+class MemoryRoomHistoryTests(RoomHistoryCases, SimpleTestCase):
+    backend = MemoryRoomHistory
+
+    async def test_idle_rooms_are_evicted(self):
+        rooms = self.make(ttl=-1)
+        await rooms.append("r1", "a", "hi")
+        await rooms.append("r2", "a", "hi")
+        self.assertEqual(await rooms.recent("r2"), [])
+        self.assertNotIn("r1", rooms.rooms)
+
+
+class RedisRoomHistoryTests(RedisVariant, RoomHistoryCases, SimpleTestCase):
+    backend = RedisRoomHistory
+
+
+class BackendLoadingTests(SimpleTestCase):
+    def test_redis_backends_share_one_client_per_url(self):
+        url = "redis://backend-loading-test:6379/0"
+        self.addCleanup(backends._clients.pop, url, None)
+        mm = load_backend({"BACKEND": "chat.matchmaking.RedisMatchmaker", "CONFIG": {"url": url}})
+        rv = RedisRendezvous(url=url)
+        self.assertIs(mm.redis, rv.redis)
+        self.assertIsNot(RedisRendezvous(url=url + "1").redis, rv.redis)
+        backends._clients.pop(url + "1")
+
+
+class InMemoryChannelLayerTests(SimpleTestCase):
+    async def test_expiry_sweep_is_throttled(self):
+        layer = InMemoryChannelLayer(clean_interval=60)
+        with mock.patch.object(BaseInMemoryChannelLayer, "_clean_expired") as sweep:
+            for i in range(10):
+                await layer.send("test.channel", {"type": "x", "i": i})
+                await layer.receive("test.channel")
+        self.assertEqual(sweep.call_count, 1)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is not installed")
+class RedisChannelLayerTests(SimpleTestCase):
+    def make_layer(self, **config):
+        layer = RedisChannelLayer(hosts=["redis://unused"], **config)
+        client = fakeredis.FakeAsyncRedis()
+        layer.connection = lambda index: client
+        return layer, client
+
+    async def test_scripted_send_round_trips(self):
+        layer, client = self.make_layer(expiry=30)
+        channel = await layer.new_channel()
+        with mock.patch.object(client, "eval", side_effect=AssertionError("full script sent")):
+            for _ in range(2):
+                await layer.send(channel, {"type": "chat.message", "text": "hi"})
+        self.assertGreater(await client.ttl(layer.prefix + layer.non_local_name(channel)), 0)
+        for _ in range(2):
+            self.assertEqual(await layer.receive(channel), {"type": "chat.message", "text": "hi"})
+
+    async def test_capacity(self):
+        layer, _ = self.make_layer(capacity=2)
+        for i in range(2):
+            await layer.send("test.channel", {"type": "x", "i": i})
+        with self.assertRaises(ChannelFull):
+            await layer.send("test.channel", {"type": "x", "i": 2})
+        self.assertEqual((await layer.receive("test.channel"))["i"], 0)
+
+
+class ProtocolTests(SimpleTestCase):
+    def test_text_codec_matches_original_format(self):
+        codec = TextCodec()
+        self.assertEqual(codec.encode("MSG", "a|b", "x|y"), {"text_data": "MSG|a b|x y"})
+        self.assertEqual(codec.encode("MATCH", "bob", None), {"text_data": "MATCH|bob|"})
+        self.assertEqual(codec.encode("PINTEREST"), {"text_data": "PINTEREST|"})
+        self.assertEqual(codec.decode("msg|hi|there"), ("MSG", "hi|there"))
+
+    def test_msgpack_codec_is_lossless(self):
+        codec = MsgpackCodec()
+        frame = codec.encode("MSG", "a|b", "x|y")["bytes_data"]
+        self.assertEqual(msgpack.unpackb(frame), [OPCODES["MSG"], "a|b", "x|y"])
+        self.assertEqual(codec.decode(bytes_data=msgpack.packb([OPCODES["MSG"], "1|2"])), ("MSG", "1|2"))
+        self.assertEqual(codec.decode(bytes_data=b"\xc1garbage"), (None, ""))
+
+
+class OutboxTests(SimpleTestCase):
+    def make_outbox(self, **kwargs):
+        self.sent = []
+        self.unblock = asyncio.Event()
+        self.unblock.set()
+
+        async def send(text_data):
+            await self.unblock.wait()
+            self.sent.append(text_data)
+
+        return Outbox(send, TextCodec().join, **kwargs)
+
+    async def test_burst_is_coalesced(self):
+        box = self.make_outbox(max_batch=3)
+        for i in range(5):
+            box.put({"text_data": f"SYS|{i}"})
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        self.assertEqual(self.sent, ["SYS|0\nSYS|1\nSYS|2", "SYS|3\nSYS|4"])
+        box.close()
+
+    async def test_drop_oldest_when_full(self):
+        dropped = ("chat_outbox_frames_total", (("result", "dropped"),))
+        before = metrics.snapshot().get(dropped, 0)
+        box = self.make_outbox(maxsize=2, policy=DROP_OLDEST)
+        self.unblock.clear()
+        for i in range(4):
+            self.assertTrue(box.put({"text_data": str(i)}))
+        self.assertEqual(list(box.frames), [{"text_data": "2"}, {"text_data": "3"}])
+        self.assertEqual(box.dropped, 2)
+        self.assertEqual(metrics.snapshot()[dropped] - before, 2)
+        self.assertEqual((await outbox.DEPTH.collect())[(("state", "max_queued"),)], 2)
+        box.close()
+
+    async def test_notify_rejects_new_frames(self):
+        box = self.make_outbox(maxsize=1, policy=NOTIFY)
+        self.unblock.clear()
+        self.assertTrue(box.put({"text_data": "a"}))
+        self.assertFalse(box.put({"text_data": "b"}))
+        self.assertFalse(box.put({"text_data": "c"}))
+        self.assertEqual(box.overflow_drops, 2)
+        box.close()
+
+    async def test_disconnect_after_grace(self):
+        evicted = []
+        box = self.make_outbox(maxsize=1, policy=DISCONNECT, grace=0, on_evict=lambda: evicted.append(True))
+        self.unblock.clear()
+        box.put({"text_data": "a"})
+        self.assertFalse(box.put({"text_data": "b"}))
+        self.assertEqual(evicted, [True])
+        self.assertFalse(box.put({"text_data": "c"}))
+        box.close()
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_token_bucket_refills(self):
+        bucket = TokenBucket(rate=1, burst=2, now=0)
+        self.assertTrue(bucket.take(0))
+        self.assertTrue(bucket.take(0))
+        self.assertFalse(bucket.take(0.5))
+        self.assertTrue(bucket.take(1.0))
+
+    async def test_sockets_of_one_user_share_a_bucket(self):
+        limits = {"NEXT": (0.001, 2)}
+        tab_1 = RateLimiter("rl-test", limits=limits, user_factor=1.5)
+        tab_2 = RateLimiter("rl-test", limits=limits, user_factor=1.5)
+        self.assertTrue(await tab_1.allow("NEXT"))
+        self.assertTrue(await tab_1.allow("NEXT"))
+        self.assertTrue(await tab_2.allow("NEXT"))
+        self.assertFalse(await tab_2.allow("NEXT"))  # user bucket (3) is empty
+        self.assertTrue(await tab_1.allow("MSG"))  # unlimited command
+        tab_1.close()
+        tab_2.close()
+        self.assertTrue(await RateLimiter("rl-test", limits=limits).allow("NEXT"))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis[lua] is not installed")
+    async def test_shared_counter_spans_workers(self):
+        server = fakeredis.FakeServer()
+        limits = {"NEXT": (0.01, 1)}
+        workers = [
+            RateLimiter("u9", limits=limits, user_factor=1, counter=RedisRateCounter(
+                client=fakeredis.FakeAsyncRedis(server=server), window=10))
+            for _ in range(3)
+        ]
+        # each worker's local bucket allows one, the shared counter allows 0.01 * 10 + 1
+        allowed = [await worker.allow("NEXT") for worker in workers]
+        self.assertEqual(allowed, [True, False, False])
+
+
+class ChatClient(WebsocketCommunicator):
+    """Hands out one frame at a time, even when the server coalesced several into one message."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = deque()
+        self.resume_token = None
+
+    async def receive_frame(self, timeout=1):
+        while True:
+            if not self.pending:
+                data = await self.receive_from(timeout)
+                if isinstance(data, str):
+                    self.pending.extend(data.split("\n"))
+                else:
+                    self.pending.extend(msgpack.Unpacker(io.BytesIO(data)))
+            frame = self.pending.popleft()
+            # the resume token comes first on every socket; keep it aside
+            if isinstance(frame, str) and frame.startswith("RESUME|"):
+                self.resume_token = frame.split("|", 1)[1]
+            elif isinstance(frame, list) and frame[0] == OPCODES["RESUME"]:
+                self.resume_token = frame[1]
+            else:
+                return frame
+
+
+async def connect_guest(nickname, subprotocols=None, tags=None, path="/ws/chat/"):
+    communicator = ChatClient(ChatConsumer.as_asgi(), path, subprotocols=subprotocols)
+    communicator.scope["session"] = {"guest": True, "guest_nickname": nickname}
+    communicator.scope["cookies"] = {TAGS_COOKIE: tags} if tags else {}
+    communicator.scope["user"] = AnonymousUser()
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def connect_user(user_id, nickname, force_match_user_id=None):
+    if force_match_user_id:
+        await cache.aset(force_match_key(user_id), force_match_user_id)
+    communicator = ChatClient(ChatConsumer.as_asgi(), "/ws/chat/")
+    communicator.scope["session"] = {"nickname": nickname}
+    communicator.scope["user"] = User(id=user_id, username=nickname)
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def matched_guests():
+    alice = await connect_guest("alice")
+    await alice.receive_frame()
+    bob = await connect_guest("bob")
+    for communicator in (alice, bob):
+        await communicator.receive_frame()  # MATCH
+        await communicator.receive_frame()  # Connected!
+    return alice, bob
+
+
+class ChatConsumerTests(SimpleTestCase):
+    def setUp(self):
+        matchmaking._matchmaker = None
+        presence._presence = None
+        rendezvous._rendezvous = None
+        history._history = None
+        admission._active = 0
+        heartbeat._live.clear()
+
+    async def test_two_guests_are_matched_and_chat(self):
+        alice = await connect_guest("alice")
+        self.assertEqual(await alice.receive_frame(), "SYS|Waiting for another guest...")
+
+        bob = await connect_guest("bob")
+        self.assertEqual(await bob.receive_frame(), "MATCH|alice|")
+        self.assertEqual(await alice.receive_frame(), "MATCH|bob|")
+        self.assertEqual(await alice.receive_frame(), "SYS|✅ Connected! Start chatting.")
+        self.assertEqual(await bob.receive_frame(), "SYS|✅ Connected! Start chatting.")
+
+        await alice.send_to(text_data="MSG|hi bob")
+        self.assertEqual(await bob.receive_frame(), "MSG|alice|hi bob")
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_direct_relay_uses_no_room_groups(self):
+        alice, bob = await matched_guests()
+        await alice.send_to(text_data="MSG|hi")
+        self.assertEqual(await alice.receive_frame(), "MSG|alice|hi")
+        self.assertEqual(await bob.receive_frame(), "MSG|alice|hi")
+        self.assertFalse([g for g in get_channel_layer().groups if g.startswith("room_")])
+        for communicator in (alice, bob):
+            await communicator.disconnect()
+
+    @override_settings(CHAT_RELAY="group")
+    async def test_group_relay(self):
+        alice, bob = await matched_guests()
+        await bob.send_to(text_data="MSG|hey")
+        self.assertEqual(await alice.receive_frame(), "MSG|bob|hey")
+        self.assertEqual(await bob.receive_frame(), "MSG|bob|hey")
+        await bob.send_to(text_data="NEXT|")
+        self.assertEqual(await alice.receive_frame(), "SYS|Partner skipped. Chat ended.")
+        for communicator in (alice, bob):
+            await communicator.disconnect()
+        self.assertFalse([g for g in get_channel_layer().groups if g.startswith("room_")])
+
+    async def test_disconnect_leaves_pool(self):
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        await alice.disconnect()
+        self.assertEqual(await matchmaking.get_matchmaker().size(GUEST_POOL), 0)
+
+    async def test_skip_notifies_partner_by_channel(self):
+        alice, bob = await matched_guests()
+        await bob.send_to(text_data="INTEREST|")
+        self.assertEqual(await alice.receive_frame(), "PINTEREST|")
+
+        await bob.send_to(text_data="NEXT|")
+        self.assertEqual(await alice.receive_frame(), "SYS|Partner skipped. Chat ended.")
+        self.assertEqual(await bob.receive_frame(), "SYS|Waiting for another guest...")
+
+        # alice left the room, so her messages no longer reach bob
+        await alice.send_to(text_data="MSG|still there?")
+        self.assertTrue(await bob.receive_nothing())
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_disconnect_notifies_partner(self):
+        alice, bob = await matched_guests()
+        await alice.disconnect()
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner disconnected. Click Next.")
+        await bob.disconnect()
+
+    async def test_msgpack_and_text_clients_chat(self):
+        alice = await connect_guest("alice", subprotocols=[MSGPACK_SUBPROTOCOL])
+        self.assertEqual(await alice.receive_frame(), [OPCODES["SYS"], "Waiting for another guest..."])
+        bob = await connect_guest("bob")
+        await bob.receive_frame()
+        await bob.receive_frame()
+        self.assertEqual(await alice.receive_frame(), [OPCODES["MATCH"], "bob", None])
+        await alice.receive_frame()
+
+        await bob.send_to(text_data="MSG|a|b")
+        self.assertEqual(await alice.receive_frame(), [OPCODES["MSG"], "bob", "a|b"])
+        self.assertEqual(await bob.receive_frame(), "MSG|bob|a b")  # own echo
+        await alice.send_to(bytes_data=msgpack.packb([OPCODES["MSG"], "c|d"]))
+        self.assertEqual(await bob.receive_frame(), "MSG|alice|c d")
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_spamming_next_is_throttled(self):
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        for _ in range(10):
+            await alice.send_to(text_data="NEXT|")
+        frames = [await alice.receive_frame() for _ in range(6)]
+        self.assertEqual(frames.count("SYS|You're going too fast. Slow down a bit."), 1)
+        self.assertEqual(frames.count("SYS|Waiting for another guest..."), 5)
+        self.assertFalse(alice.pending)
+        self.assertTrue(await alice.receive_nothing())
+        await alice.disconnect()
+
+    async def test_accepted_reconnect_meets_requester_not_strangers(self):
+        requester = await connect_user(1, "req")
+        self.assertEqual(await requester.receive_frame(), "SYS|Searching for a match...")
+
+        accepter = await connect_user(2, "acc", force_match_user_id=1)
+        self.assertEqual(await accepter.receive_frame(), "SYS|Reconnect requested... waiting for user...")
+        # the requester is told live and claims the rendezvous
+        self.assertEqual(await requester.receive_frame(), "MATCH|acc|2")
+        self.assertEqual(await accepter.receive_frame(), "MATCH|req|1")
+
+        # a stranger arriving now is not paired with either of them
+        stranger = await connect_user(3, "str")
+        self.assertEqual(await stranger.receive_frame(), "SYS|Searching for a match...")
+
+        for communicator in (requester, accepter, stranger):
+            await communicator.disconnect()
+
+    async def test_requester_in_a_chat_joins_with_next(self):
+        busy = await connect_user(1, "req")
+        other = await connect_user(4, "other")
+        await busy.receive_frame()
+        await busy.receive_frame()  # MATCH|other
+        await busy.receive_frame()  # Connected
+
+        accepter = await connect_user(2, "acc", force_match_user_id=1)
+        self.assertEqual(await accepter.receive_frame(), "SYS|Reconnect requested... waiting for user...")
+        self.assertEqual(await busy.receive_frame(), "SYS|acc accepted your reconnect request. Click Next to join them.")
+
+        await busy.send_to(text_data="NEXT|")
+        self.assertEqual(await busy.receive_frame(), "MATCH|acc|2")
+        self.assertEqual(await accepter.receive_frame(), "MATCH|req|1")
+
+        for communicator in (busy, other, accepter):
+            await communicator.disconnect()
+
+    @override_settings(CHAT_TAG_WAIT=0.1)
+    async def test_tagged_guests_match_on_overlap_then_fall_back(self):
+        music = await connect_guest("m", tags="music")
+        games = await connect_guest("g", tags="Games,chess")
+        self.assertEqual(await music.receive_frame(), "SYS|Looking for someone into music...")
+        self.assertEqual(await games.receive_frame(), "SYS|Looking for someone into games, chess...")
+
+        chess = await connect_guest("c", tags="chess")
+        self.assertEqual(await chess.receive_frame(), "MATCH|g|")
+        self.assertEqual(await games.receive_frame(), "MATCH|c|")
+
+        plain = await connect_guest("p")
+        self.assertEqual(await plain.receive_frame(), "SYS|Waiting for another guest...")
+        # music gives up on its tags and takes the untagged waiter
+        self.assertEqual(await music.receive_frame(), "MATCH|p|")
+        self.assertEqual(await plain.receive_frame(), "MATCH|m|")
+        for communicator in (music, games, chess, plain):
+            await communicator.disconnect()
+
+    async def test_dropped_socket_resumes_its_room(self):
+        alice, bob = await matched_guests()
+        await alice.send_to(text_data="MSG|hi")
+        await alice.receive_frame()
+        await bob.receive_frame()
+
+        await alice.disconnect(code=1006)
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner's connection dropped. Waiting for them to come back...")
+        await bob.send_to(text_data="MSG|still there?")
+        self.assertEqual(await bob.receive_frame(), "MSG|bob|still there?")
+
+        again = await connect_guest("alice", path=f"/ws/chat/?resume={alice.resume_token}")
+        self.assertEqual(await again.receive_frame(), "MATCH|bob|")
+        self.assertEqual(await again.receive_frame(), "MSG|alice|hi")
+        self.assertEqual(await again.receive_frame(), "MSG|bob|still there?")
+        self.assertEqual(await again.receive_frame(), "SYS|Reconnected ✅")
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner is back ✅")
+
+        await again.send_to(text_data="MSG|back")
+        self.assertEqual(await bob.receive_frame(), "MSG|alice|back")
+        await again.disconnect()
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner disconnected. Click Next.")
+        await bob.disconnect()
+
+    @override_settings(CHAT_RESUME_GRACE=0.05)
+    async def test_resume_after_the_grace_window_starts_over(self):
+        alice, bob = await matched_guests()
+        await alice.disconnect(code=1006)
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner's connection dropped. Waiting for them to come back...")
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner disconnected. Click Next.")
+
+        again = await connect_guest("alice", path=f"/ws/chat/?resume={alice.resume_token}")
+        self.assertEqual(await again.receive_frame(), "SYS|Your last chat has ended.")
+        self.assertEqual(await again.receive_frame(), "SYS|Waiting for another guest...")
+        for communicator in (again, bob):
+            await communicator.disconnect()
+
+    async def test_partner_leaving_voids_the_resume_token(self):
+        alice, bob = await matched_guests()
+        await alice.disconnect(code=1006)
+        await bob.receive_frame()  # dropped, waiting
+        await bob.send_to(text_data="NEXT|")
+        await bob.receive_frame()  # Searching...
+
+        again = await connect_guest("alice", path=f"/ws/chat/?resume={alice.resume_token}")
+        self.assertEqual(await again.receive_frame(), "SYS|Your last chat has ended.")
+        for communicator in (again, bob):
+            await communicator.disconnect()
+
+    @override_settings(CHAT_MAX_CONNECTIONS=1, CHAT_BUSY_RETRY=7)
+    async def test_sockets_over_the_ceiling_are_told_to_retry(self):
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        bob = await connect_guest("bob")
+        closed = await bob.receive_output()
+        self.assertEqual((closed["type"], closed["code"], closed["reason"]), ("websocket.close", 4503, "retry=7"))
+        await bob.disconnect(code=4503)
+
+        await alice.disconnect()
+        carol = await connect_guest("carol")
+        self.assertEqual(await carol.receive_frame(), "SYS|Waiting for another guest...")
+        await carol.disconnect()
+
+    async def test_lagging_loop_sheds_new_sockets(self):
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        admission.lag_monitor.lag = settings.CHAT_MAX_LOOP_LAG + 1
+        bob = await connect_guest("bob")
+        self.assertEqual((await bob.receive_output())["code"], admission.BUSY_CLOSE_CODE)
+        await bob.disconnect(code=4503)
+        admission.lag_monitor.lag = 0.0
+        await alice.disconnect()
+        self.assertEqual(admission._active, 0)
+
+    @override_settings(CHAT_HEARTBEAT_INTERVAL=0)
+    async def test_quiet_sockets_are_pinged(self):
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        self.assertEqual(await heartbeat.sweep(), {})
+        self.assertEqual(await alice.receive_frame(), "PING|")
+        await alice.send_to(text_data="PONG|")
+        await alice.disconnect()
+
+    @override_settings(CHAT_HEARTBEAT_TIMEOUT=-1)
+    async def test_reaper_frees_the_queue_entry_of_a_dead_waiter(self):
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        self.assertEqual(await heartbeat.sweep(), {"socket": 1, "queue": 1, "presence": 0, "group": 0})
+        self.assertEqual((await alice.receive_output())["code"], heartbeat.REAPED_CLOSE_CODE)
+        self.assertEqual(await matchmaking.get_matchmaker().size(GUEST_POOL), 0)
+        self.assertEqual(admission._active, 0)
+        await alice.disconnect(code=1006)  # daphne notices much later; nothing left to clean up
+
+        bob = await connect_guest("bob")
+        self.assertEqual(await bob.receive_frame(), "SYS|Waiting for another guest...")
+        await bob.disconnect()
+
+    @override_settings(CHAT_HEARTBEAT_TIMEOUT=-1)
+    async def test_failed_reap_still_closes_the_socket_and_the_sweep_goes_on(self):
+        broken = mock.Mock(last_seen=0, channel_name="broken", reap=mock.AsyncMock(side_effect=RuntimeError))
+        heartbeat._live.add(broken)
+        alice = await connect_guest("alice")
+        await alice.receive_frame()
+        with mock.patch.object(ChatConsumer, "leave_pool", side_effect=RuntimeError("backend down")):
+            with self.assertLogs("chat.heartbeat", "ERROR") as logs:
+                self.assertEqual(await heartbeat.sweep(), {})
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual((await alice.receive_output())["code"], heartbeat.REAPED_CLOSE_CODE)
+        await alice.disconnect(code=1006)
+
+    @override_settings(CHAT_HEARTBEAT_TIMEOUT=0.05)
+    async def test_reaped_partner_is_parked_for_resume(self):
+        alice, bob = await matched_guests()
+        await asyncio.sleep(0.1)
+        await bob.send_to(text_data="MSG|still there?")  # bob is alive, alice went into a tunnel
+        await bob.receive_frame()
+        self.assertEqual(await heartbeat.sweep(), {"socket": 1, "queue": 0, "presence": 0, "group": 1})
+        self.assertEqual(await bob.receive_frame(), "SYS|Partner's connection dropped. Waiting for them to come back...")
+        await alice.disconnect(code=1006)
+
+        again = await connect_guest("alice", path=f"/ws/chat/?resume={alice.resume_token}")
+        self.assertEqual(await again.receive_frame(), "MATCH|bob|")
+        for communicator in (again, bob):
+            await communicator.disconnect()
+
+    async def test_reconnect_request_events_become_frames(self):
+        bob = await connect_user(2, "bob")
+        await bob.receive_frame()  # Searching...
+        await get_channel_layer().group_send(
+            user_group(2), {"type": "reconnect_request", "event": "new", "nickname": "alice", "request_id": 5}
+        )
+        self.assertEqual(await bob.receive_frame(), "REQUEST|new|alice|5")
+        await bob.disconnect()
+
+    @override_settings(RECONNECT_RENDEZVOUS_TTL=0.05)
+    async def test_rendezvous_times_out_to_random_pool(self):
+        requester = await connect_user(1, "req")
+        requester_partner = await connect_user(5, "p")
+        accepter = await connect_user(2, "acc", force_match_user_id=1)
+        self.assertEqual(await accepter.receive_frame(), "SYS|Reconnect requested... waiting for user...")
+        self.assertEqual(await accepter.receive_frame(), "SYS|User didn't join in time. Finding you a random match...")
+        self.assertEqual(await accepter.receive_frame(), "SYS|Searching for a match...")
+        self.assertEqual(await rendezvous.get_rendezvous().pending(1), [])
+
+        for communicator in (requester, requester_partner, accepter):
+            await communicator.disconnect()
+
+    async def test_offline_partner_falls_back_to_random(self):
+        accepter = await connect_user(2, "acc", force_match_user_id=99)
+        self.assertEqual(await accepter.receive_frame(), "SYS|User is offline. Reconnect works only when user is online.")
+        self.assertEqual(await accepter.receive_frame(), "SYS|Searching for a match...")
+        await accepter.disconnect()
+
+
+class LoadTestHarnessTests(SimpleTestCase):
+    def setUp(self):
+        matchmaking._matchmaker = None
+
+    def test_percentiles(self):
+        stats = percentiles([i / 1000 for i in range(1, 101)])
+        self.assertEqual((stats["count"], stats["p50"], stats["max"]), (100, 50.5, 100.0))
+        self.assertIsNone(percentiles([]))
+
+    async def test_small_inprocess_run(self):
+        results = await run_load(make_specs(8, 0.5), messages=2, interval=0.01, timeout=2, ramp=0)
+        self.assertEqual((results["clients"], results["guests"], results["matched"], results["errors"]), (8, 4, 8, 0))
+        self.assertEqual(results["rtt_ms"]["count"], 16)
+
+    @override_settings(CHAT_TYPING_INTERVAL=10)
+    async def test_typing_adds_one_relay_per_interval(self):
+        results = await run_load(make_specs(4, 1.0), messages=3, interval=0.05, timeout=2, ramp=0, typing=5)
+        self.assertEqual(results["errors"], 0)
+        self.assertEqual(results["relayed"]["typing_received"], 4 * 3 * 5)
+        self.assertEqual(results["relayed"]["typing"], 4)  # each client's first start; later ones wait out the interval
+
+
+class HandshakeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        matchmaking._matchmaker = None
+        presence._presence = None
+
+    async def handshake(self, cookie):
+        app = ChatAuthMiddlewareStack(ChatConsumer.as_asgi())
+        communicator = ChatClient(app, "/ws/chat/", headers=[(b"cookie", cookie.encode())])
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        first = await communicator.receive_frame()
+        await communicator.disconnect()
+        return first
+
+    def test_guest_start_writes_no_session(self):
+        response = self.client.post("/guest/", {"nickname": "neo"})
+        self.assertRedirects(response, "/chat/", fetch_redirect_response=False)
+        self.assertIn(GUEST_COOKIE, response.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertContains(self.client.get("/chat/"), "<b>neo</b>")
+
+    def test_interest_tags_are_kept_in_a_cookie(self):
+        response = self.client.post("/guest/", {"nickname": "neo", "tags": "Music, games"})
+        self.assertEqual(response.cookies[TAGS_COOKIE].value, "music,games")
+        response = self.client.get("/chat/?tags=chess")
+        self.assertRedirects(response, "/chat/", fetch_redirect_response=False)
+        self.assertContains(self.client.get("/chat/"), 'value="chess"')
+
+    def test_guest_token_needs_no_database(self):
+        with self.assertNumQueries(0):
+            first = async_to_sync(self.handshake)(f"{GUEST_COOKIE}={make_guest_token('neo')}")
+        self.assertEqual(first, "SYS|Waiting for another guest...")
+
+    def test_forged_guest_token_is_ignored(self):
+        first = async_to_sync(self.handshake)(f"{GUEST_COOKIE}={make_guest_token('neo')}x")
+        self.assertEqual(first, "SYS|Searching for a match...")
+
+    def test_logged_in_identity_is_cached(self):
+        user = User.objects.create(username="trinity")
+        self.client.force_login(user)
+        session = self.client.session
+        session["nickname"] = "trin"
+        session.save()
+        cookie = f"sessionid={session.session_key}"
+
+        with self.assertNumQueries(2):  # session row + user row, once
+            self.assertEqual(async_to_sync(self.handshake)(cookie), "SYS|Searching for a match...")
+        self.assertEqual(cache.get(f"chat:ws-auth:{session.session_key}"), {
+            "user_id": user.id, "guest": False, "guest_nickname": None, "nickname": "trin",
+        })
+        with self.assertNumQueries(0):
+            async_to_sync(self.handshake)(cookie)
+
+    def test_logout_drops_cached_identity(self):
+        user = User.objects.create(username="trinity")
+        self.client.force_login(user)
+        session_key = self.client.session.session_key
+        async_to_sync(self.handshake)(f"sessionid={session_key}")
+        self.client.get("/logout/")
+        self.assertIsNone(cache.get(f"chat:ws-auth:{session_key}"))
+
+
+@override_settings(PASSWORD_HASHERS=[
+    "django.contrib.auth.hashers.MD5PasswordHasher", "django.contrib.auth.hashers.ScryptPasswordHasher",
+])
+class AccountViewTests(TestCase):
+    def test_register_hashes_and_logs_in(self):
+        response = self.client.post(
+            "/register/", {"name": "Neo", "nickname": "neo", "email": "neo@zion.io", "password": "redpill"}
+        )
+        self.assertRedirects(response, "/chat/", fetch_redirect_response=False)
+        user = User.objects.get(username="neo@zion.io")
+        self.assertTrue(user.check_password("redpill"))
+        self.assertEqual(UserProfile.objects.get(user=user).nickname, "neo")
+        self.assertContains(self.client.get("/chat/"), "<b>neo</b>")
+
+    def test_login(self):
+        user = User.objects.create_user("trinity", password="follow-the-rabbit")
+        UserProfile.objects.create(user=user, nickname="trin")
+        response = self.client.post("/login/", {"identity": "trinity", "password": "nope"})
+        self.assertContains(response, "Invalid credentials.")
+        response = self.client.post("/login/", {"identity": "nobody", "password": "nope"})
+        self.assertContains(response, "Invalid credentials.")
+
+        response = self.client.post("/login/", {"identity": "trinity", "password": "follow-the-rabbit"})
+        self.assertRedirects(response, "/chat/", fetch_redirect_response=False)
+        self.assertEqual(self.client.session["nickname"], "trin")
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], "chat.passwords.PasswordPoolBackend")
+
+    def test_failed_login_is_signalled_and_hashing_runs_off_the_loop(self):
+        User.objects.create_user("trinity", password="follow-the-rabbit")
+        failed, threads = [], []
+        check = passwords._check
+
+        def spy(*args):
+            threads.append(threading.current_thread().name)
+            return check(*args)
+
+        def handler(sender, credentials, **kwargs):
+            failed.append(credentials["username"])
+
+        user_login_failed.connect(handler)
+        self.addCleanup(user_login_failed.disconnect, handler)
+        with mock.patch.object(passwords, "_check", spy):
+            self.client.post("/login/", {"identity": "trinity", "password": "nope"})
+        self.assertEqual(failed, ["trinity"])
+        self.assertTrue(threads[0].startswith("password-hash"))
+
+    def test_login_upgrades_outdated_hashes(self):
+        with self.settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.ScryptPasswordHasher"]):
+            User.objects.create_user("morpheus", password="free-your-mind")
+        self.client.post("/login/", {"identity": "morpheus", "password": "free-your-mind"})
+        self.assertTrue(User.objects.get(username="morpheus").password.startswith("md5$"))
+
+
+class ConnectionViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        presence._presence = None
+        self.owner = User.objects.create(username="owner")
+        self.others = [User.objects.create(username=f"other{i}") for i in range(11)]
+        self.client.force_login(self.owner)
+
+    def save(self, user, nickname="nick"):
+        return self.client.post("/save-connection/", {"other_user_id": user.id, "other_nickname": nickname})
+
+    def test_connections_page_query_count_is_flat(self):
+        self.save(self.others[0])
+        with self.assertNumQueries(3):  # session, user, connection list
+            self.assertContains(self.client.get("/connections/"), f"/requests/send/{self.others[0].id}/")
+        for other in self.others[1:10]:
+            self.save(other)
+        with self.assertNumQueries(3):
+            self.client.get("/connections/")
+        with self.assertNumQueries(2):  # list now cached
+            response = self.client.get("/connections/")
+        self.assertEqual(len(response.context["connections"]), 10)
+
+    def test_save_connection_query_count_and_invalidation(self):
+        self.client.get("/connections/")
+        with self.assertNumQueries(8):  # session, user, target exists, savepoint, lock, count, insert, release
+            self.save(self.others[0], "neo")
+        self.assertContains(self.client.get("/connections/"), "neo")
+
+    def test_cap_and_duplicates(self):
+        for other in self.others[:10]:
+            self.save(other)
+        self.save(self.others[0], "again")
+        self.save(self.others[10])
+        self.assertEqual(self.owner.connections.count(), 10)
+        self.assertFalse(self.owner.connections.filter(connected_user=self.others[10]).exists())
+
+
+class ReconnectRequestTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username="alice")
+        self.bob = User.objects.create(username="bob")
+
+    def test_repeated_clicks_keep_one_active_request(self):
+        self.client.force_login(self.alice)
+        self.client.get(f"/requests/send/{self.bob.id}/")
+        self.client.get(f"/requests/send/{self.bob.id}/")
+        self.assertEqual(ReconnectRequest.objects.filter(is_active=True).count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReconnectRequest.objects.create(from_user=self.alice, to_user=self.bob)
+        # once answered, a new request may be sent
+        ReconnectRequest.objects.update(is_active=False)
+        self.client.get(f"/requests/send/{self.bob.id}/")
+        self.assertEqual(ReconnectRequest.objects.count(), 2)
+
+    def test_inbox_hides_expired_and_loads_senders_in_one_query(self):
+        carol = User.objects.create(username="carol")
+        ReconnectRequest.objects.create(from_user=self.alice, to_user=self.bob)
+        old = ReconnectRequest.objects.create(from_user=carol, to_user=self.bob)
+        ReconnectRequest.objects.filter(id=old.id).update(
+            created_at=timezone.now() - timedelta(seconds=settings.RECONNECT_REQUEST_TTL + 1)
+        )
+        self.client.force_login(self.bob)
+        with self.assertNumQueries(3):  # session, user, inbox joined with senders
+            response = self.client.get("/requests/")
+        self.assertContains(response, "Request from: alice")
+        self.assertNotContains(response, "carol")
+        self.client.get(f"/requests/accept/{old.id}/")
+        self.assertTrue(ReconnectRequest.objects.get(id=old.id).is_active)
+
+    def test_request_events_are_pushed_to_user_groups(self):
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(user_group(self.bob.id), "bob.socket")
+        async_to_sync(layer.group_add)(user_group(self.alice.id), "alice.socket")
+
+        UserProfile.objects.create(user=self.alice, nickname="Al")
+        UserProfile.objects.create(user=self.bob, nickname="Bobby")
+
+        self.client.force_login(self.alice)
+        self.client.get(f"/requests/send/{self.bob.id}/")
+        req = ReconnectRequest.objects.get()
+        event = async_to_sync(layer.receive)("bob.socket")
+        self.assertEqual(
+            event, {"type": "reconnect_request", "event": "new", "nickname": "Al", "request_id": req.id}
+        )
+        # clicking again refreshes the request without pushing it again
+        self.client.get(f"/requests/send/{self.bob.id}/")
+
+        self.client.force_login(self.bob)
+        self.client.get(f"/requests/accept/{req.id}/")
+        event = async_to_sync(layer.receive)("alice.socket")
+        self.assertEqual((event["event"], event["nickname"]), ("accepted", "Bobby"))
+        with self.assertRaises(asyncio.TimeoutError):
+            async_to_sync(asyncio.wait_for)(layer.receive("bob.socket"), 0.05)
+
+    def test_resending_an_expired_request_pushes_it_again(self):
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(user_group(self.bob.id), "bob.socket")
+        req = ReconnectRequest.objects.create(from_user=self.alice, to_user=self.bob)
+        ReconnectRequest.objects.filter(id=req.id).update(
+            created_at=timezone.now() - timedelta(seconds=settings.RECONNECT_REQUEST_TTL + 1)
+        )
+        self.client.force_login(self.alice)
+        self.client.get(f"/requests/send/{self.bob.id}/")
+        event = async_to_sync(layer.receive)("bob.socket")
+        self.assertEqual((event["event"], event["request_id"]), ("new", req.id))
+        self.assertGreater(ReconnectRequest.objects.get(id=req.id).created_at, ReconnectRequest.cutoff())
+
+    def test_purge_removes_answered_and_expired_in_batches(self):
+        users = [User.objects.create(username=f"u{i}") for i in range(5)]
+        for other in users:
+            ReconnectRequest.objects.create(from_user=self.alice, to_user=other, is_active=False)
+            ReconnectRequest.objects.create(from_user=other, to_user=self.alice)
+        ReconnectRequest.objects.filter(from_user=users[0]).update(created_at=timezone.now() - timedelta(days=30))
+        live = ReconnectRequest.objects.create(from_user=self.alice, to_user=self.bob)
+
+        out = io.StringIO()
+        call_command("purge_reconnect_requests", batch=2, pause=0, stdout=out)
+        self.assertIn("purged 5 answered and 1 expired", out.getvalue())
+        self.assertEqual(ReconnectRequest.objects.count(), 5)
+        self.assertTrue(ReconnectRequest.objects.filter(id=live.id).exists())
+
+
+class ContentFilterTests(SimpleTestCase):
+    def setUp(self):
+        contentfilter._filter = contentfilter._failure = None
+        self.addCleanup(setattr, contentfilter, "_filter", None)
+        self.addCleanup(setattr, contentfilter, "_failure", None)
+        blocklist = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False)
+        blocklist.write("# comment\nbad word\nass  # trailing comment\n")
+        blocklist.close()
+        self.path = blocklist.name
+        self.addCleanup(os.unlink, self.path)
+
+    def test_automaton_finds_overlapping_patterns(self):
+        automaton = Automaton(["he", "she", "his", "hers"])
+        self.assertEqual(automaton.spans("ushers"), [(1, 4), (2, 4), (2, 6)])
+        self.assertEqual(automaton.spans("xyz"), [])
+
+    def test_masks_whole_words_ignoring_case(self):
+        blocklist = ContentFilter(["bad word", "ass", "he"])
+        self.assertEqual(blocklist.apply("A BAD Word, class ass!"), "A ********, class ***!")
+        self.assertEqual(blocklist.apply("the hero"), "the hero")
+        self.assertIsNone(blocklist.apply("ass", REJECT))
+        self.assertEqual(ContentFilter(["he"], whole_words=False).apply("the hero"), "t** **ro")
+        self.assertEqual(ContentFilter().apply("anything"), "anything")
+
+    def test_masks_in_place_when_lowercasing_changes_length(self):
+        blocklist = ContentFilter(["ass", "i̇stanbul"])  # "İ".lower() is "i" plus a combining dot
+        self.assertEqual(blocklist.apply("Hello İstanbul ASS Friend"), "Hello ******** *** Friend")
+        self.assertEqual(ContentFilter(["ass"]).apply("Hello İstanbul ASS Friend"), "Hello İstanbul *** Friend")
+
+    async def test_reload_picks_up_file_changes(self):
+        with override_settings(CHAT_BLOCKLIST=self.path):
+            self.assertEqual(contentfilter.screen("you ass"), "you ***")
+            self.assertFalse(await contentfilter.reload())
+            with open(self.path, "a") as f:
+                f.write("newword\n")
+            self.assertTrue(await contentfilter.reload())
+            self.assertEqual(contentfilter.screen("newword ass"), "******* ***")
+            os.unlink(self.path)
+            with self.assertRaises(OSError):
+                await contentfilter.reload()  # the watcher keeps the list it has
+            open(self.path, "w").close()
+        self.assertEqual(contentfilter.screen("newword"), "*******")
+
+    def test_load_failures_are_logged_once_each(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\xff\xfe")
+        with self.assertLogs("chat.contentfilter", "WARNING") as logs:
+            for path in (self.path + ".missing", self.path + ".missing", self.path, self.path):
+                contentfilter._filter = None
+                with override_settings(CHAT_BLOCKLIST=path):
+                    self.assertEqual(contentfilter.screen("ass"), "ass")
+        self.assertEqual(len(logs.records), 2)  # missing, then undecodable
+
+    async def test_consumer_masks_or_rejects(self):
+        matchmaking._matchmaker = None
+        with override_settings(CHAT_BLOCKLIST=self.path):
+            alice, bob = await matched_guests()
+            await alice.send_to(text_data="MSG|what a bad word")
+            self.assertEqual(await bob.receive_frame(), "MSG|alice|what a ********")
+            with override_settings(CHAT_FILTER_ACTION=REJECT):
+                await alice.send_to(text_data="MSG|what a bad word")
+                self.assertEqual(await alice.receive_frame(), "MSG|alice|what a ********")
+                self.assertEqual(await alice.receive_frame(), "SYS|Message not sent: it contains blocked words.")
+                self.assertTrue(await bob.receive_nothing())
+            for communicator in (alice, bob):
+                await communicator.disconnect()
+
+
+class TypingIndicatorTests(SimpleTestCase):
+    async def indicator(self, interval=0.05, timeout=0.2):
+        sent = []
+
+        async def publish(active):
+            sent.append(active)
+
+        return TypingIndicator(publish, interval, timeout), sent
+
+    async def test_keystrokes_coalesce_into_one_start(self):
+        typing, sent = await self.indicator()
+        for _ in range(50):
+            typing.update(True)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        self.assertEqual(sent, [True])
+        typing.update(False)
+        await asyncio.sleep(0.1)
+        self.assertEqual(sent, [True, False])
+        self.assertIsNone(typing.task)
+
+    async def test_flapping_inside_an_interval_sends_only_where_it_ends(self):
+        typing, sent = await self.indicator(interval=0.1)
+        typing.update(True)
+        await asyncio.sleep(0.01)
+        for active in (False, True, False, True, False):
+            typing.update(active)
+        await asyncio.sleep(0.05)
+        self.assertEqual(sent, [True])  # held back until the interval is over
+        await asyncio.sleep(0.1)
+        self.assertEqual(sent, [True, False])
+
+    async def test_stops_by_itself_and_reset_is_silent(self):
+        typing, sent = await self.indicator(timeout=0.05)
+        typing.update(True)
+        await asyncio.sleep(0.15)
+        self.assertEqual(sent, [True, False])
+
+        typing.update(True)
+        await asyncio.sleep(0.01)
+        typing.reset()  # we sent a message
+        await asyncio.sleep(0.1)
+        self.assertEqual(sent, [True, False, True])
+        self.assertIsNone(typing.task)
+
+    @override_settings(CHAT_TYPING_INTERVAL=0.05, CHAT_TYPING_TIMEOUT=1)
+    async def test_partner_sees_one_start_per_burst(self):
+        matchmaking._matchmaker = None
+        alice, bob = await matched_guests()
+        relayed = metrics.snapshot().get(("chat_typing_total", (("kind", "relayed"),)), 0)
+        for _ in range(20):
+            await alice.send_to(text_data="TYPING|1")
+        self.assertEqual(await bob.receive_frame(), "TYPING|1")
+        await alice.send_to(text_data="MSG|hi")
+        self.assertEqual(await bob.receive_frame(), "MSG|alice|hi")
+        self.assertTrue(await bob.receive_nothing(timeout=0.1))
+        self.assertEqual(metrics.snapshot()[("chat_typing_total", (("kind", "relayed"),))], relayed + 1)
+
+        await bob.send_to(text_data="TYPING|1")
+        self.assertEqual(await alice.receive_frame(), "MSG|alice|hi")
+        self.assertEqual(await alice.receive_frame(), "TYPING|1")
+        await bob.send_to(text_data="NEXT|")
+        self.assertEqual(await alice.receive_frame(), "TYPING|0")  # no partner left to finish the word
+        self.assertEqual(await alice.receive_frame(), "SYS|Partner skipped. Chat ended.")
+        for communicator in (alice, bob):
+            await communicator.disconnect()
+
+
+class ChatEventLogTests(SimpleTestCase):
+    def setUp(self):
+        matchmaking._matchmaker = None
+        presence._presence = None
+        rendezvous._rendezvous = None
+        history._history = None
+        events._sink = None
+        events._buffer.clear()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        log = {"BACKEND": "chat.events.FileEventSink", "CONFIG": {"path": self.dir.name}}
+        self.enterContext(override_settings(CHAT_EVENT_LOG=log))
+
+    async def test_consumer_events_are_logged_anonymized(self):
+        alice, bob = await matched_guests()
+        await bob.send_to(text_data="MSG|hi")
+        await bob.receive_frame()
+        await bob.send_to(text_data="INTEREST|")
+        await alice.receive_frame()
+        await bob.send_to(text_data="NEXT|")
+        await bob.receive_frame()
+        await alice.disconnect()
+        await bob.disconnect()
+
+        self.assertEqual(await events.flush(), 8)
+        logged = list(events.get_event_sink().read())
+        self.assertEqual(
+            [e["event"] for e in logged],
+            ["connect", "connect", "match", "match", "interest", "next", "disconnect", "disconnect"],
+        )
+        sockets = {e["socket"] for e in logged}
+        self.assertEqual(len(sockets), 2)
+        self.assertFalse([s for s in sockets if "!" in s or len(s) != 16])
+        bob_match, alice_match = logged[2], logged[3]
+        self.assertEqual((bob_match["partner"], alice_match["partner"]), (alice_match["socket"], bob_match["socket"]))
+        skip = logged[5]
+        self.assertEqual((skip["socket"], skip["room"], skip["messages"]), (bob_match["socket"], bob_match["room"], 1))
+
+        stats = next(iter(hourly_stats(logged).values()))
+        self.assertEqual((stats["connects"], stats["rooms"], stats["skips"], stats["skip_rate"]), (2, 1, 1, 1.0))
+        self.assertEqual((stats["quick_skips"], stats["messages"], stats["interests"]), (1, 1, 1))
+
+    async def test_off_by_default_and_bounded(self):
+        with override_settings(CHAT_EVENT_LOG=None):
+            events.emit("connect")
+        self.assertEqual(len(events._buffer), 0)
+
+        with override_settings(CHAT_EVENT_LOG_BUFFER=2):
+            for i in range(3):
+                events.emit("connect", n=i)
+        self.assertEqual([e["n"] for e in events._buffer], [1, 2])
+
+    async def test_failed_write_is_retried(self):
+        events.emit("connect", n=1)
+        with mock.patch.object(FileEventSink, "write", side_effect=OSError):
+            with self.assertRaises(OSError):
+                await events.flush()
+        events.emit("connect", n=2)
+        self.assertEqual(await events.flush(), 2)
+        self.assertEqual([e["n"] for e in events.get_event_sink().read()], [1, 2])
+
+    def test_files_rotate_hourly_and_expire(self):
+        sink = FileEventSink(self.dir.name, keep_hours=2)
+        now = time.time()
+        sink.write([{"ts": now - 3 * 3600, "event": "connect"}, {"ts": now - 3600, "event": "match"}])
+        sink.write([{"ts": now, "event": "next"}])
+        sink.pruned_hour = None
+        sink.prune(int(now // 3600))
+        self.assertEqual([e["event"] for e in sink.read()], ["match", "next"])
+        self.assertEqual([e["event"] for e in sink.read(since=now)], ["next"])
+
+    def test_chat_stats_command(self):
+        sink = FileEventSink(self.dir.name)
+        events._sink = sink
+        now = time.time()
+        sink.write([
+            {"ts": now, "event": "match", "room": "r1", "wait": 2.0},
+            {"ts": now, "event": "match", "room": "r1", "wait": 4.0},
+            {"ts": now, "event": "next", "room": "r1", "duration": 30.0},
+            {"ts": now, "event": "next", "room": None, "duration": None},
+        ])
+        out = io.StringIO()
+        call_command("chat_stats", "--json", stdout=out)
+        [hour] = json.loads(out.getvalue()).values()
+        self.assertEqual((hour["rooms"], hour["wait_p50_s"], hour["skips"], hour["quick_skips"]), (1, 4.0, 1, 0))
+
+
+class ChatEventDatabaseSinkTests(TestCase):
+    def test_round_trip(self):
+        sink = DatabaseEventSink()
+        now = time.time()
+        sink.write([{"ts": now - 7200, "event": "connect", "socket": "a"}, {"ts": now, "event": "next", "room": "r"}])
+        self.assertEqual([(e["event"], e.get("room")) for e in sink.read(since=now - 60)], [("next", "r")])
+        self.assertEqual(len(list(sink.read())), 2)
+
+
+@override_settings(METRICS_TOKEN="s3cret")
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        matchmaking._matchmaker = None
+        presence._presence = None
+        rendezvous._rendezvous = None
+        metrics._metrics = None
+
+    def sample(self, name, **labels):
+        return metrics.snapshot().get((name, tuple(labels.items())), 0)
+
+    async def scrape(self, headers=((b"authorization", b"Bearer s3cret"),)):
+        communicator = HttpCommunicator(MetricsEndpoint(None), "GET", "/metrics", headers=list(headers))
+        return await communicator.get_response()
+
+    def test_histogram_renders_cumulative_buckets(self):
+        hist = metrics.Histogram("test_seconds", "Test.", (0.1, 1))
+        samples = {
+            ("test_seconds_bucket", (("view", "x"), ("le", "0.1"))): 2,
+            ("test_seconds_bucket", (("view", "x"), ("le", "+Inf"))): 1,
+            ("test_seconds_sum", (("view", "x"),)): 5.5,
+            ("test_seconds_count", (("view", "x"),)): 3,
+        }
+        try:
+            text = async_to_sync(metrics.render)(samples)
+        finally:
+            metrics._registry.remove(hist)
+        self.assertIn('test_seconds_bucket{view="x",le="0.1"} 2\n', text)
+        self.assertIn('test_seconds_bucket{view="x",le="1"} 2\n', text)
+        self.assertIn('test_seconds_bucket{view="x",le="+Inf"} 3\n', text)
+        self.assertIn('test_seconds_count{view="x"} 3\n', text)
+
+    async def test_db_pool_gauge_reads_the_pool_stats(self):
+        self.assertEqual(await metrics._db_pool_stats(), {})  # no pool configured
+        pool = SimpleNamespace(get_stats=lambda: {"pool_size": 4, "requests_queued": 3, "requests_wait_ms": 120})
+        with mock.patch.dict(settings.DATABASES["default"]["OPTIONS"], {"pool": {"max_size": 10}}), \
+                mock.patch.object(metrics, "connections", {"default": SimpleNamespace(pool=pool)}):
+            stats = await metrics._db_pool_stats()
+        self.assertEqual(stats[(("stat", "pool_size"),)], 4)
+        self.assertEqual(stats[(("stat", "requests_wait_ms"),)], 120)
+        self.assertEqual(stats[(("stat", "requests_errors"),)], 0)
+
+    async def test_consumer_hot_path_is_counted(self):
+        connects = self.sample("chat_connects_total", pool=GUEST_POOL)
+        waits = self.sample("chat_match_wait_seconds_count", pool=GUEST_POOL)
+        sent = self.sample("chat_messages_total")
+
+        alice, bob = await matched_guests()
+        await alice.send_to(text_data="MSG|hi")
+        await alice.receive_frame()
+        self.assertEqual(self.sample("chat_connects_total", pool=GUEST_POOL), connects + 2)
+        self.assertEqual(self.sample("chat_match_wait_seconds_count", pool=GUEST_POOL), waits + 2)
+        self.assertEqual(self.sample("chat_messages_total"), sent + 1)
+        self.assertGreater(self.sample("chat_group_send_seconds_count", event="broadcast_message"), 0)
+
+        waiting = await connect_guest("carol")
+        await waiting.receive_frame()
+        response = await self.scrape()
+        self.assertEqual(response["status"], 200)
+        self.assertIn(f'chat_queue_length{{pool="{GUEST_POOL}"}} 1\n', response["body"].decode())
+        for communicator in (alice, bob, waiting):
+            await communicator.disconnect()
+
+    async def test_endpoint_token(self):
+        self.assertEqual((await self.scrape(headers=()))["status"], 403)
+        self.assertEqual((await self.scrape([(b"authorization", b"Bearer guess")]))["status"], 403)
+        self.assertEqual((await self.scrape())["status"], 200)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual((await self.scrape(headers=()))["status"], 404)
+            with override_settings(DEBUG=True):
+                self.assertEqual((await self.scrape(headers=()))["status"], 200)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis[lua] is not installed")
+    async def test_redis_backend_sums_processes(self):
+        client = fakeredis.FakeAsyncRedis()
+        metrics.CONNECTS.inc(pool="metrics-test")
+        flushed = self.sample("chat_connects_total", pool="metrics-test")
+        first, second = metrics.RedisMetrics(client=client), metrics.RedisMetrics(client=client)
+        await first.flush()
+        await second.flush()  # a second worker with the same local counts
+        metrics.CONNECTS.inc(pool="metrics-test")
+        samples = await first.collect()  # adds only the new increment
+        self.assertEqual(samples[("chat_connects_total", (("pool", "metrics-test"),))], 2 * flushed + 1)
+
+
+@override_settings(MATCHMAKING_WORKER=True, MATCHMAKING_TICK=0.01)
+class MatchmakingWorkerTests(SimpleTestCase):
+    def setUp(self):
+        matchmaking._matchmaker = None
+        presence._presence = None
+        rendezvous._rendezvous = None
+
+    def start_worker(self):
+        """What `runworker matchmaking` does: feed the named channel to one worker instance."""
+        worker = ApplicationCommunicator(
+            MatchmakingWorker.as_asgi(), {"type": "channel", "channel": settings.MATCHMAKING_CHANNEL}
+        )
+        layer = get_channel_layer()
+
+        async def pump():
+            while True:
+                await worker.send_input(await layer.receive(settings.MATCHMAKING_CHANNEL))
+
+        pump_task = asyncio.ensure_future(pump())
+
+        def stop():
+            pump_task.cancel()
+            worker.future.cancel()
+
+        return stop
+
+    def test_pair_matches_new_arrivals_through_tags(self):
+        worker = MatchmakingWorker()
+        for ticket in (
+            make_ticket("ch.m", "m", tags=["music"]),
+            make_ticket("ch.g", "g", tags=["games"]),
+            make_ticket("ch.r", "r"),
+            make_ticket("ch.g2", "g2", tags=["chess", "games"]),
+        ):
+            worker.pools[GUEST_POOL].push(ticket)
+            worker.fresh[GUEST_POOL].append(ticket["channel"])
+        pairs = [(a["channel"], b["channel"]) for a, b in worker.pair(GUEST_POOL)]
+        self.assertEqual(pairs, [("ch.g2", "ch.g")])
+        self.assertEqual(list(worker.pools[GUEST_POOL].tickets), ["ch.m", "ch.r"])
+        self.assertEqual(worker.pair(GUEST_POOL), [])
+
+    async def test_waiter_goes_back_in_line_if_the_room_never_starts(self):
+        worker = MatchmakingWorker()
+        worker.channel_layer = mock.AsyncMock()
+        await worker.mm_enqueue({"pool": GUEST_POOL, "ticket": make_ticket("ch.w", "w")})
+        await worker.tick()
+        for name in ("ch.a", "ch.b"):
+            await worker.mm_enqueue({"pool": GUEST_POOL, "ticket": make_ticket(name, name[-1])})
+        await worker.tick()
+        self.assertEqual(set(worker.unconfirmed), {"ch.a"})
+        self.assertIn("ch.b", worker.pools[GUEST_POOL])
+
+        # the arrival left after the tick: its partner is queued again and paired next tick
+        await worker.mm_dequeue({"pool": GUEST_POOL, "channel": "ch.a"})
+        self.assertEqual(worker.unconfirmed, {})
+        await worker.tick()
+        worker.channel_layer.send.assert_called_with(
+            "ch.w", {"type": "mm.matched", "partner": make_ticket("ch.b", "b")}
+        )
+
+        # started rooms are forgotten; silent arrivals time out
+        await worker.mm_started({"channel": "ch.w"})
+        self.assertEqual(worker.unconfirmed, {})
+        await worker.mm_enqueue({"pool": GUEST_POOL, "ticket": make_ticket("ch.c", "c")})
+        await worker.tick()
+        await worker.mm_enqueue({"pool": GUEST_POOL, "ticket": make_ticket("ch.d", "d")})
+        await worker.tick()
+        self.assertNotIn("ch.c", worker.pools[GUEST_POOL])
+        with override_settings(MATCHMAKING_CONFIRM_TIMEOUT=-1):
+            await worker.tick()
+        self.assertIn("ch.c", worker.pools[GUEST_POOL])
+        worker._ticker.cancel()
+
+    async def test_sockets_are_paired_by_the_worker(self):
+        stop = self.start_worker()
+        try:
+            alice = await connect_guest("alice")
+            bob = await connect_guest("bob")
+            for communicator in (alice, bob):
+                self.assertEqual(await communicator.receive_frame(), "SYS|Waiting for another guest...")
+            self.assertEqual(await bob.receive_frame(), "MATCH|alice|")  # the newer waiter starts the room
+            self.assertEqual(await alice.receive_frame(), "MATCH|bob|")
+            for communicator in (alice, bob):
+                self.assertEqual(await communicator.receive_frame(), "SYS|✅ Connected! Start chatting.")
+
+            # Next while waiting dequeues before enqueueing again, so nobody pairs with themselves
+            await bob.send_to(text_data="NEXT|")
+            await bob.send_to(text_data="NEXT|")
+            self.assertEqual(await alice.receive_frame(), "SYS|Partner skipped. Chat ended.")
+            self.assertEqual(await bob.receive_frame(), "SYS|Waiting for another guest...")
+            self.assertEqual(await bob.receive_frame(), "SYS|Waiting for another guest...")
+            self.assertTrue(await bob.receive_nothing(0.1))
+
+            await alice.send_to(text_data="NEXT|")
+            self.assertEqual(await alice.receive_frame(), "SYS|Waiting for another guest...")
+            self.assertEqual(await alice.receive_frame(), "MATCH|bob|")
+            for communicator in (alice, bob):
+                await communicator.disconnect()
+        finally:
+            stop()
@@ -0,0 +1,72 @@
+"""
+"Partner is typing" with a bounded cost per room.
+
+A client may send TYPING|1 on every keystroke and TYPING|0 when it
+clears its input. A socket's TypingIndicator turns that stream into at
+most one start or stop for the partner per `interval` seconds. Changes
+inside an interval are held back, and only the state they end in is
+relayed, so a burst of keystrokes costs one channel-layer send.
+
+With no TYPING for `timeout` seconds the indicator stops by itself,
+because a client that went away mid-word never sends a stop. A MSG ends
+typing on the partner's screen without a frame of its own, which
+reset() records.
+"""
+import asyncio
+import time
+
+
+class TypingIndicator:
+    def __init__(self, publish, interval, timeout):
+        self.publish = publish  # async callable(active): tell the partner
+        self.interval = interval
+        self.timeout = timeout
+        self.wanted = False  # what the client last said
+        self.shown = False  # what the partner was last told
+        self.expires = 0.0
+        self.last_change = float("-inf")
+        self.changed = asyncio.Event()
+        self.task = None
+
+    def update(self, active):
+        """One TYPING command: a dict update, the relaying happens in the indicator's own task."""
+        if active:
+            self.expires = time.monotonic() + self.timeout
+        if active != self.wanted:
+            self.wanted = active
+            self.changed.set()
+        if self.task is None and self.wanted != self.shown:
+            self.task = asyncio.ensure_future(self._run())
+
+    def reset(self):
+        """The partner no longer shows us typing (we sent a message, or the room ended)."""
+        self.wanted = self.shown = False
+        self.changed.set()
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                now = time.monotonic()
+                if self.wanted and now >= self.expires:
+                    self.wanted = False
+                if self.wanted == self.shown:
+                    if not self.shown:
+                        return
+                    wait = self.expires - now  # shown: look again when it would lapse
+                else:
+                    wait = self.last_change + self.interval - now
+                    if wait <= 0:
+                        self.shown, self.last_change = self.wanted, now
+                        await self.publish(self.shown)
+                        continue
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.task = None
@@ -1,33 +1,55 @@
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.shortcuts import render, redirect
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import aauthenticate, alogin, alogout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.http import HttpResponseForbidden
+from django.utils import timezone
 
+from .auth import GUEST_COOKIE, aforget_session, force_match_key, read_guest_token, set_guest_cookie
+from .matchmaking import TAGS_COOKIE, parse_tags
 from .models import Connection, UserProfile, ReconnectRequest
+from .consumers import user_group
+from .passwords import ahash_password
+from .presence import get_presence
 
 
-def landing(request):
+async def landing(request):
     return render(request, "landing.html")
 
 
-def guest_start(request):
+def set_tags_cookie(response, tags):
+    # read by ChatConsumer at connect, see matchmaking.parse_tags
+    if tags:
+        response.set_cookie(TAGS_COOKIE, ",".join(tags), max_age=60 * 60 * 24 * 30, samesite="Lax")
+    else:
+        response.delete_cookie(TAGS_COOKIE)
+
+
+async def guest_start(request):
     if request.method == "POST":
         nickname = request.POST.get("nickname", "").strip()
         if not nickname:
             return render(request, "guest.html", {"error": "Nickname is required."})
 
-        # ✅ Fresh guest session
-        request.session.flush()
-        request.session["guest"] = True
-        request.session["guest_nickname"] = nickname[:30]
+        # ✅ Fresh guest identity: a signed cookie, no session row to write
+        if request.session.session_key:
+            await aforget_session(request)
+            await request.session.aflush()
 
-        return redirect("chat_room")
+        response = redirect("chat_room")
+        set_guest_cookie(response, nickname[:30])
+        set_tags_cookie(response, parse_tags(request.POST.get("tags")))
+        return response
 
     return render(request, "guest.html")
 
 
-def user_register(request):
+async def user_register(request):
     if request.method == "POST":
         name = request.POST.get("name", "").strip()
         nickname = request.POST.get("nickname", "").strip()
@@ -50,135 +72,234 @@ def user_register(request):
 
             identity = custom_id
 
-        if User.objects.filter(username=identity).exists():
+        if await User.objects.filter(username=identity).aexists():
             return render(request, "register.html", {"error": "Account exists. Please login."})
 
-        user = User.objects.create_user(username=identity, password=password, first_name=name)
-        user.email = email
-        user.save()
+        # ✅ what create_user does, with the hashing on the password pool
+        user = User(
+            username=User.normalize_username(identity),
+            email=User.objects.normalize_email(email),
+            first_name=name,
+            password=await ahash_password(password),
+        )
+        await user.asave()
 
-        UserProfile.objects.create(user=user, nickname=nickname[:30])
+        await UserProfile.objects.acreate(user=user, nickname=nickname[:30])
 
         # ✅ IMPORTANT FIX: clear guest session before login
-        if request.session.get("guest"):
-            request.session.flush()
+        if await request.session.aget("guest"):
+            await aforget_session(request)
+            await request.session.aflush()
 
-        login(request, user)
-        request.session["nickname"] = nickname[:30]
+        await alogin(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+        await request.session.aset("nickname", nickname[:30])
 
-        return redirect("chat_room")
+        response = redirect("chat_room")
+        response.delete_cookie(GUEST_COOKIE)
+        return response
 
     return render(request, "register.html")
 
 
-def user_login(request):
+async def user_login(request):
     if request.method == "POST":
         identity = request.POST.get("identity", "").strip()
         password = request.POST.get("password", "")
 
-        user = authenticate(request, username=identity, password=password)
+        user = await aauthenticate(request, username=identity, password=password)
         if not user:
             return render(request, "login.html", {"error": "Invalid credentials."})
 
         # ✅ IMPORTANT FIX: clear guest session before login
-        if request.session.get("guest"):
-            request.session.flush()
+        if await request.session.aget("guest"):
+            await aforget_session(request)
+            await request.session.aflush()
 
-        login(request, user)
+        await alogin(request, user)
 
-        profile = UserProfile.objects.filter(user=user).first()
-        request.session["nickname"] = profile.nickname if profile else "User"
+        profile = await UserProfile.objects.filter(user=user).afirst()
+        await request.session.aset("nickname", profile.nickname if profile else "User")
 
-        return redirect("chat_room")
+        response = redirect("chat_room")
+        response.delete_cookie(GUEST_COOKIE)
+        return response
 
     return render(request, "login.html")
 
 
-def user_logout(request):
-    logout(request)
-    request.session.flush()
-    return redirect("landing")
+async def user_logout(request):
+    await aforget_session(request)
+    await alogout(request)
+    response = redirect("landing")
+    response.delete_cookie(GUEST_COOKIE)
+    return response
 
 
-def chat_room(request):
+async def chat_room(request):
+    # ✅ interests picked on the chat page: remember them, then reload so the socket sees them
+    if "tags" in request.GET:
+        response = redirect("chat_room")
+        set_tags_cookie(response, parse_tags(request.GET["tags"]))
+        return response
+    tags = ", ".join(parse_tags(request.COOKIES.get(TAGS_COOKIE)))
+
     # ✅ Guest chat
-    if request.session.get("guest"):
-        nickname = request.session.get("guest_nickname", "Guest")
-        return render(request, "chat.html", {"nickname": nickname, "is_guest": True})
+    guest = read_guest_token(request.COOKIES.get(GUEST_COOKIE))
+    if guest:
+        return render(request, "chat.html", {"nickname": guest["n"], "is_guest": True, "tags": tags})
+
+    if await request.session.aget("guest"):
+        nickname = await request.session.aget("guest_nickname", "Guest")
+        return render(request, "chat.html", {"nickname": nickname, "is_guest": True, "tags": tags})
 
     # ✅ Logged chat
-    if request.user.is_authenticated:
-        nickname = request.session.get("nickname", "User")
-        return render(request, "chat.html", {"nickname": nickname, "is_guest": False})
+    if (await request.auser()).is_authenticated:
+        nickname = await request.session.aget("nickname", "User")
+        return render(request, "chat.html", {"nickname": nickname, "is_guest": False, "tags": tags})
 
     return redirect("landing")
 
 
+MAX_CONNECTIONS = 10
+
+
+def connections_cache_key(user_id):
+    return f"chat:connections:{user_id}"
+
+
 @login_required
-def connections(request):
-    conns = Connection.objects.filter(owner=request.user).order_by("-created_at")
+async def connections(request):
+    user = await request.auser()
+    # ✅ the saved list only changes in save_connection, which drops this entry
+    key = connections_cache_key(user.id)
+    conns = await cache.aget(key)
+    if conns is None:
+        conns = [
+            c async for c in Connection.objects.filter(owner=user)
+            .order_by("-created_at")
+            .values("connected_user_id", "connected_nickname", "created_at")
+        ]
+        await cache.aset(key, conns, settings.CONNECTIONS_CACHE_TTL)
+
+    # ✅ one presence lookup for every saved connection
+    online = await get_presence().online_among([c["connected_user_id"] for c in conns])
+    for c in conns:
+        c["is_online"] = c["connected_user_id"] in online
+
     return render(request, "connections.html", {"connections": conns})
 
 
+@sync_to_async
+def add_connection(owner_id, other_user_id, other_nickname):
+    # ✅ lock the owner's row so concurrent saves can't both pass the cap
+    # (transactions have no async API yet, so this block runs in a thread)
+    with transaction.atomic():
+        User.objects.select_for_update().only("id").get(id=owner_id)
+        if Connection.objects.filter(owner_id=owner_id).count() < MAX_CONNECTIONS:
+            Connection.objects.bulk_create(
+                [Connection(owner_id=owner_id, connected_user_id=other_user_id, connected_nickname=other_nickname)],
+                ignore_conflicts=True,
+            )
+
+
 @login_required
-def save_connection(request):
+async def save_connection(request):
     if request.method != "POST":
         return HttpResponseForbidden("Invalid method")
 
     other_user_id = request.POST.get("other_user_id", "").strip()
     other_nickname = request.POST.get("other_nickname", "").strip()
 
-    if not other_user_id or not other_nickname:
+    if not other_user_id.isdigit() or not other_nickname:
         return redirect("chat_room")
 
-    if Connection.objects.filter(owner=request.user).count() >= 10:
-        return redirect("connections")
-
-    other_user = User.objects.filter(id=other_user_id).first()
-    if not other_user:
+    if not await User.objects.filter(id=other_user_id).aexists():
         return redirect("chat_room")
 
-    Connection.objects.get_or_create(
-        owner=request.user,
-        connected_user=other_user,
-        defaults={"connected_nickname": other_nickname[:30]},
-    )
+    user = await request.auser()
+    await add_connection(user.id, int(other_user_id), other_nickname[:30])
+    await cache.adelete(connections_cache_key(user.id))
     return redirect("connections")
 
 
+async def profile_nickname(user):
+    # ✅ what the other side sees: the chosen nickname, never the username (often an email)
+    profile = await UserProfile.objects.filter(user=user).afirst()
+    return profile.nickname if profile else "User"
+
+
+async def push_request_event(user_id, event, nickname, request_id=None):
+    # ✅ open chat sockets of this user hear about it without reloading /requests/
+    await get_channel_layer().group_send(
+        user_group(user_id),
+        {"type": "reconnect_request", "event": event, "nickname": nickname, "request_id": request_id},
+    )
+
+
 @login_required
-def send_reconnect_request(request, user_id):
-    to_user = User.objects.filter(id=user_id).first()
+async def send_reconnect_request(request, user_id):
+    to_user = await User.objects.filter(id=user_id).afirst()
     if not to_user:
         return redirect("connections")
 
-    ReconnectRequest.objects.create(from_user=request.user, to_user=to_user)
+    # ✅ one active request per pair: clicking again just refreshes it
+    user = await request.auser()
+    now, cutoff = timezone.now(), ReconnectRequest.cutoff()
+    pending = ReconnectRequest.objects.filter(from_user=user, to_user=to_user, is_active=True)
+    if await pending.filter(created_at__gte=cutoff).aupdate(created_at=now):
+        return redirect("connections")  # still in their inbox, already pushed
+
+    # expired but not purged yet: reviving it is the same as sending a new one
+    expired = pending.filter(created_at__lt=cutoff)
+    req_id = await expired.values_list("id", flat=True).afirst()
+    if req_id and await expired.filter(id=req_id).aupdate(created_at=now):
+        created = True
+    else:
+        # a concurrent click may create it first: get_or_create then returns that row
+        req, created = await ReconnectRequest.objects.aget_or_create(from_user=user, to_user=to_user, is_active=True)
+        req_id = req.id
+    if created:
+        await push_request_event(to_user.id, "new", await profile_nickname(user), req_id)
     return redirect("connections")
 
 
 @login_required
-def requests_inbox(request):
-    inbox = ReconnectRequest.objects.filter(to_user=request.user, is_active=True).order_by("-created_at")
+async def requests_inbox(request):
+    user = await request.auser()
+    inbox = [
+        r async for r in ReconnectRequest.objects.filter(
+            to_user=user, is_active=True, created_at__gte=ReconnectRequest.cutoff()
+        )
+        .select_related("from_user")
+        .order_by("-created_at")
+    ]
     return render(request, "requests.html", {"requests": inbox})
 
 
 @login_required
-def accept_request(request, req_id):
-    req = ReconnectRequest.objects.filter(id=req_id, to_user=request.user, is_active=True).first()
+async def accept_request(request, req_id):
+    user = await request.auser()
+    req = await ReconnectRequest.objects.filter(
+        id=req_id, to_user=user, is_active=True, created_at__gte=ReconnectRequest.cutoff()
+    ).afirst()
     if not req:
         return redirect("requests_inbox")
 
     req.is_active = False
-    req.save()
+    await req.asave()
 
-    request.session["force_match_user_id"] = req.from_user.id
+    # picked up by the next chat socket of this user, see ChatConsumer.connect
+    await cache.aset(force_match_key(user.id), req.from_user_id, settings.RECONNECT_RENDEZVOUS_TTL)
+    await push_request_event(req.from_user_id, "accepted", await profile_nickname(user), req.id)
     return redirect("chat_room")
 
 
 @login_required
-def reject_request(request, req_id):
-    req = ReconnectRequest.objects.filter(id=req_id, to_user=request.user, is_active=True).first()
+async def reject_request(request, req_id):
+    user = await request.auser()
+    req = await ReconnectRequest.objects.filter(id=req_id, to_user=user, is_active=True).afirst()
     if req:
         req.is_active = False
-        req.save()
+        await req.asave()
+        await push_request_event(req.from_user_id, "rejected", await profile_nickname(user), req.id)
     return redirect("requests_inbox")
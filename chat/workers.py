@@ -0,0 +1,122 @@
+"""
+Matchmaking as a background worker.
+
+With MATCHMAKING_WORKER on, chat sockets no longer pair inline: they send
+"mm.enqueue" / "mm.dequeue" to the MATCHMAKING_CHANNEL and get a
+"mm.matched" event back. The waiting pools live in one worker process:
+
+    python manage.py runworker matchmaking
+
+Requests are only queued as they arrive; every MATCHMAKING_TICK seconds the
+worker pairs everything that can be paired in one pass. Pairing cost is
+then paid here instead of on the event loops relaying chat messages, and
+pair() is the place for more expensive pairing logic.
+
+Only the newer socket of a pair hears "mm.matched"; it starts the room
+and answers "mm.started". Until then the worker holds on to the other
+waiter, and puts it back in line if the socket leaves instead
+("mm.dequeue") or doesn't answer within MATCHMAKING_CONFIRM_TIMEOUT.
+"""
+import asyncio
+import logging
+import time
+
+from channels.consumer import AsyncConsumer
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .matchmaking import GUEST_POOL, USER_POOL, WaitingPool
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZES_KEY = "chat:mm:pool-sizes"
+
+TICK = metrics.Histogram(
+    "chat_mm_tick_seconds", "Time the matchmaking worker spends pairing per tick.", metrics.LATENCY_BUCKETS
+)
+
+
+class MatchmakingWorker(AsyncConsumer):
+    """Owns the waiting pools; run exactly one per MATCHMAKING_CHANNEL."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pools = {GUEST_POOL: WaitingPool(), USER_POOL: WaitingPool()}
+        self.fresh = {GUEST_POOL: [], USER_POOL: []}  # channels enqueued since the last tick
+        self.unconfirmed = {}  # matched arrival channel -> (pool, waiter ticket, matched at)
+        self._ticker = None
+
+    async def mm_enqueue(self, event):
+        self.pools[event["pool"]].push(event["ticket"])
+        self.fresh[event["pool"]].append(event["ticket"]["channel"])
+        if self._ticker is None:
+            metrics.get_metrics().start()
+            self._ticker = asyncio.ensure_future(self._tick_loop())
+
+    async def mm_dequeue(self, event):
+        channel = event["channel"]
+        self.pools[event["pool"]].remove(channel)
+        # left before starting its room: the waiter it was matched with goes back in line
+        await self.give_back(channel)
+        # or it was the waiter that left: nothing to give back
+        for arrival, (_, waiter, _) in list(self.unconfirmed.items()):
+            if waiter["channel"] == channel:
+                del self.unconfirmed[arrival]
+
+    async def mm_started(self, event):
+        self.unconfirmed.pop(event["channel"], None)
+
+    async def give_back(self, arrival_channel):
+        entry = self.unconfirmed.pop(arrival_channel, None)
+        if entry:
+            pool, waiter, _ = entry
+            await self.mm_enqueue({"pool": pool, "ticket": waiter})
+
+    async def mm_requeue(self, event):
+        # a tagged waiter whose wait budget ran out, now untagged; skip if already paired
+        if self.pools[event["pool"]].remove(event["ticket"]["channel"]):
+            await self.mm_enqueue(event)
+
+    def pair(self, pool):
+        """
+        Pairs to start from one pool.
+
+        Waiters left over from earlier ticks already had no match among each
+        other, so only this tick's arrivals look for a partner (through the
+        tag index, oldest candidate first).
+        """
+        waiting = self.pools[pool]
+        fresh, self.fresh[pool] = self.fresh[pool], []
+        pairs = []
+        for channel in fresh:
+            ticket = waiting.tickets.get(channel)
+            if ticket is None:
+                continue  # dequeued, or already paired this tick
+            partner = waiting.pop_match(ticket.get("tags"), exclude=channel)
+            if partner:
+                waiting.remove(channel)
+                pairs.append((partner, ticket))
+        return pairs
+
+    async def tick(self):
+        start = time.perf_counter()
+        now = time.monotonic()
+        for arrival, (_, _, matched_at) in list(self.unconfirmed.items()):
+            if now - matched_at > settings.MATCHMAKING_CONFIRM_TIMEOUT:
+                await self.give_back(arrival)  # its worker is gone, or the message was lost
+        for pool in self.pools:
+            for waiter, arrival in self.pair(pool):
+                # the arrival starts the room, like an inline pair_or_wait would
+                self.unconfirmed[arrival["channel"]] = (pool, waiter, now)
+                await self.channel_layer.send(arrival["channel"], {"type": "mm.matched", "partner": waiter})
+        TICK.observe(time.perf_counter() - start)
+        await cache.aset(POOL_SIZES_KEY, {pool: len(waiting) for pool, waiting in self.pools.items()}, 60)
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(settings.MATCHMAKING_TICK)
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Matchmaking tick failed")
@@ -8,20 +8,29 @@ Supports both:
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-
-import chat.routing
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
+from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "vibeconnect.settings")
 
 django_asgi_app = get_asgi_application()
 
+# app code may touch models, so import it only once Django is set up
+import chat.routing  # noqa: E402
+from chat.auth import ChatAuthMiddlewareStack  # noqa: E402
+from chat.metrics import MetricsEndpoint  # noqa: E402
+from chat.workers import MatchmakingWorker  # noqa: E402
+
 application = ProtocolTypeRouter(
     {
-        "http": django_asgi_app,
-        "websocket": AuthMiddlewareStack(
+        # ✅ /metrics is answered before Django; everything else goes to the views
+        "http": MetricsEndpoint(django_asgi_app),
+        "websocket": ChatAuthMiddlewareStack(
             URLRouter(chat.routing.websocket_urlpatterns)
         ),
+        # ✅ background workers: `manage.py runworker matchmaking`
+        "channel": ChannelNameRouter({
+            settings.MATCHMAKING_CHANNEL: MatchmakingWorker.as_asgi(),
+        }),
     }
 )
@@ -58,8 +58,9 @@ INSTALLED_APPS = [
 # MIDDLEWARE
 # ============================
 MIDDLEWARE = [
+    "chat.metrics.ViewLatencyMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "chat.middleware.AsyncWhiteNoiseMiddleware",
 
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -102,14 +103,32 @@ WSGI_APPLICATION = "vibeconnect.wsgi.application"
 # ============================
 # DATABASE
 # ============================
+# DB_POOL=True: one psycopg 3 pool per process shared by all threads, instead of a persistent
+# connection per sync_to_async thread (Postgres only; needs psycopg[pool], see requirements.txt)
+DB_POOL = os.getenv("DB_POOL", "False") == "True"
+
 DATABASES = {
     "default": dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600,
+        conn_max_age=0 if DB_POOL else 600,  # Django refuses persistent connections with a pool
+        # check a reused connection before handing it out (with DB_POOL: psycopg_pool's check on checkout)
+        conn_health_checks=os.getenv("DB_HEALTH_CHECKS", "True") == "True",
         ssl_require=not DEBUG,
     )
 }
 
+if DB_POOL:
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+    DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+        # connections kept open, plus how many more may be opened under load (closed again after max_idle)
+        "min_size": DB_POOL_SIZE,
+        "max_size": DB_POOL_SIZE + int(os.getenv("DB_POOL_MAX_OVERFLOW", "6")),
+        # seconds a query waits for a free connection before failing
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    }
+
 
 # ============================
 # PASSWORD VALIDATORS
@@ -152,22 +171,217 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
 # ============================
-# CHANNELS (WebSockets)
+# CHANNELS (WebSockets) + MATCHMAKING
 # ============================
 REDIS_URL = os.getenv("REDIS_URL", "")
 
+# channel layer: messages queued per channel, seconds an unread message lives, seconds a group membership lives
+CHANNEL_CAPACITY = int(os.getenv("CHANNEL_CAPACITY", "100"))
+CHANNEL_EXPIRY = int(os.getenv("CHANNEL_EXPIRY", "60"))
+CHANNEL_GROUP_EXPIRY = int(os.getenv("CHANNEL_GROUP_EXPIRY", "86400"))
+
 if REDIS_URL:
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "chat.layers.RedisChannelLayer",
             "CONFIG": {
                 "hosts": [REDIS_URL],
+                "capacity": CHANNEL_CAPACITY,
+                "expiry": CHANNEL_EXPIRY,
+                "group_expiry": CHANNEL_GROUP_EXPIRY,
             },
         }
     }
+    MATCHMAKING = {
+        "BACKEND": "chat.matchmaking.RedisMatchmaker",
+        "CONFIG": {
+            "url": REDIS_URL,
+        },
+    }
+    PRESENCE = {
+        "BACKEND": "chat.presence.RedisPresence",
+        "CONFIG": {
+            "url": REDIS_URL,
+            "ttl": int(os.getenv("PRESENCE_TTL", "60")),
+        },
+    }
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+    RENDEZVOUS = {
+        "BACKEND": "chat.rendezvous.RedisRendezvous",
+        "CONFIG": {
+            "url": REDIS_URL,
+        },
+    }
+    RATE_LIMIT_COUNTER = {
+        "BACKEND": "chat.ratelimit.RedisRateCounter",
+        "CONFIG": {
+            "url": REDIS_URL,
+            "commands": os.getenv("CHAT_RATE_LIMIT_SHARED", "NEXT").split(","),
+        },
+    }
+    METRICS = {
+        "BACKEND": "chat.metrics.RedisMetrics",
+        "CONFIG": {
+            "url": REDIS_URL,
+            "interval": float(os.getenv("METRICS_FLUSH_INTERVAL", "5")),
+        },
+    }
+    ROOM_HISTORY = {
+        "BACKEND": "chat.history.RedisRoomHistory",
+        "CONFIG": {
+            "url": REDIS_URL,
+            "size": int(os.getenv("ROOM_HISTORY_SIZE", "50")),
+            "ttl": int(os.getenv("ROOM_HISTORY_TTL", "600")),
+        },
+    }
 else:
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "BACKEND": "chat.layers.InMemoryChannelLayer",
+            "CONFIG": {
+                "capacity": CHANNEL_CAPACITY,
+                "expiry": CHANNEL_EXPIRY,
+                "group_expiry": CHANNEL_GROUP_EXPIRY,
+            },
         }
     }
+    MATCHMAKING = {
+        "BACKEND": "chat.matchmaking.MemoryMatchmaker",
+    }
+    PRESENCE = {
+        "BACKEND": "chat.presence.MemoryPresence",
+    }
+    RENDEZVOUS = {
+        "BACKEND": "chat.rendezvous.MemoryRendezvous",
+    }
+    RATE_LIMIT_COUNTER = None
+    METRICS = {
+        "BACKEND": "chat.metrics.MemoryMetrics",
+    }
+    ROOM_HISTORY = {
+        "BACKEND": "chat.history.MemoryRoomHistory",
+        "CONFIG": {
+            "size": int(os.getenv("ROOM_HISTORY_SIZE", "50")),
+            "ttl": int(os.getenv("ROOM_HISTORY_TTL", "600")),
+        },
+    }
+
+
+# socket handshake: signed guest cookie + cached identity of logged-in sessions
+GUEST_TOKEN_MAX_AGE = int(os.getenv("GUEST_TOKEN_MAX_AGE", str(60 * 60 * 24)))
+CHAT_AUTH_CACHE_TTL = int(os.getenv("CHAT_AUTH_CACHE_TTL", "300"))
+
+# seconds an accepted reconnect waits for the other user before falling back to random
+RECONNECT_RENDEZVOUS_TTL = int(os.getenv("RECONNECT_RENDEZVOUS_TTL", "60"))
+
+# how room events reach both members: "direct" (one send to the partner's channel) or "group" (a group per room)
+CHAT_RELAY = os.getenv("CHAT_RELAY", "direct")
+
+# seconds a dropped socket keeps its room; reconnecting with its resume token reattaches it
+CHAT_RESUME_GRACE = float(os.getenv("CHAT_RESUME_GRACE", "20"))
+
+# "partner is typing": a partner sees at most one start/stop per interval; no TYPING for the timeout means stopped
+CHAT_TYPING_INTERVAL = float(os.getenv("CHAT_TYPING_INTERVAL", "5"))
+CHAT_TYPING_TIMEOUT = float(os.getenv("CHAT_TYPING_TIMEOUT", "5"))
+
+# seconds a waiter with interest tags holds out for a shared tag before matching randomly
+CHAT_TAG_WAIT = float(os.getenv("CHAT_TAG_WAIT", "15"))
+
+# pair sockets in a separate `manage.py runworker matchmaking` process (needs REDIS_URL)
+MATCHMAKING_WORKER = os.getenv("MATCHMAKING_WORKER", "False") == "True"
+MATCHMAKING_CHANNEL = os.getenv("MATCHMAKING_CHANNEL", "matchmaking")
+MATCHMAKING_TICK = float(os.getenv("MATCHMAKING_TICK", "0.05"))
+# seconds the worker waits for a matched socket to start its room before its partner goes back in line
+MATCHMAKING_CONFIRM_TIMEOUT = float(os.getenv("MATCHMAKING_CONFIRM_TIMEOUT", "10"))
+
+# Prometheus text endpoint (served by vibeconnect/asgi.py), behind a bearer token; 404 without one unless DEBUG
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# seconds an unanswered reconnect request stays in the inbox
+RECONNECT_REQUEST_TTL = int(os.getenv("RECONNECT_REQUEST_TTL", str(60 * 60 * 24)))
+
+# threads for password hashing (login/register), so a login burst can't hold up other requests
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+AUTHENTICATION_BACKENDS = ["chat.passwords.PasswordPoolBackend"]
+
+# seconds a user's saved-connections list is cached (dropped on every save)
+CONNECTIONS_CACHE_TTL = int(os.getenv("CONNECTIONS_CACHE_TTL", "300"))
+
+
+# ============================
+# CHAT EVENT LOG (for `manage.py chat_stats`)
+# ============================
+# CHAT_EVENT_LOG=file: hourly gzip JSON-lines files in CHAT_EVENT_LOG_DIR; =db: ChatEvent rows; unset: off
+CHAT_EVENT_LOG = {
+    "file": {
+        "BACKEND": "chat.events.FileEventSink",
+        "CONFIG": {
+            "path": os.getenv("CHAT_EVENT_LOG_DIR", str(BASE_DIR / "chatlog")),
+            "keep_hours": int(os.getenv("CHAT_EVENT_LOG_KEEP_HOURS", str(24 * 30))),
+        },
+    },
+    "db": {"BACKEND": "chat.events.DatabaseEventSink"},
+}.get(os.getenv("CHAT_EVENT_LOG", ""))
+# seconds between writes, and events held in memory at most (the oldest are dropped beyond it)
+CHAT_EVENT_LOG_INTERVAL = float(os.getenv("CHAT_EVENT_LOG_INTERVAL", "2"))
+CHAT_EVENT_LOG_BUFFER = int(os.getenv("CHAT_EVENT_LOG_BUFFER", "50000"))
+# key of the hash that anonymizes ids in the log (defaults to SECRET_KEY)
+CHAT_EVENT_LOG_SALT = os.getenv("CHAT_EVENT_LOG_SALT", "")
+
+
+# ============================
+# CONTENT FILTER
+# ============================
+# blocklist file: one word or phrase per line, "#" comments; edits are picked up within CHAT_BLOCKLIST_RELOAD seconds
+CHAT_BLOCKLIST = os.getenv("CHAT_BLOCKLIST", "")
+CHAT_BLOCKLIST_RELOAD = float(os.getenv("CHAT_BLOCKLIST_RELOAD", "10"))
+# mask: blocked words become asterisks; reject: the message is not sent
+CHAT_FILTER_ACTION = os.getenv("CHAT_FILTER_ACTION", "mask")
+
+
+# ============================
+# ADMISSION CONTROL (per process)
+# ============================
+# sockets one process serves at most (0 = no ceiling)
+CHAT_MAX_CONNECTIONS = int(os.getenv("CHAT_MAX_CONNECTIONS", "0"))
+# turn new sockets away while the event loop runs this many seconds late (0 = off)
+CHAT_MAX_LOOP_LAG = float(os.getenv("CHAT_MAX_LOOP_LAG", "0.5"))
+# seconds a turned-away client waits before retrying (chat.js adds jitter)
+CHAT_BUSY_RETRY = int(os.getenv("CHAT_BUSY_RETRY", "5"))
+
+
+# ============================
+# HEARTBEAT (per socket)
+# ============================
+# quiet sockets get a PING every interval; no frame at all for the timeout and the socket is reaped
+CHAT_HEARTBEAT_INTERVAL = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "20"))
+CHAT_HEARTBEAT_TIMEOUT = float(os.getenv("CHAT_HEARTBEAT_TIMEOUT", "60"))
+
+
+# ============================
+# OUTBOUND QUEUE (per socket)
+# ============================
+# policy: drop_oldest | notify | disconnect
+CHAT_OUTBOX_SIZE = int(os.getenv("CHAT_OUTBOX_SIZE", "256"))
+CHAT_OUTBOX_POLICY = os.getenv("CHAT_OUTBOX_POLICY", "drop_oldest")
+CHAT_OUTBOX_GRACE = float(os.getenv("CHAT_OUTBOX_GRACE", "10"))
+CHAT_OUTBOX_BATCH = int(os.getenv("CHAT_OUTBOX_BATCH", "32"))
+
+
+# ============================
+# RATE LIMITS (per socket)
+# ============================
+# command: (tokens per second, burst)
+CHAT_RATE_LIMITS = {
+    "MSG": (3, 10),
+    "NEXT": (0.5, 5),
+    "INTEREST": (0.2, 3),
+}
+# all sockets of one user together may go this many times faster than one socket
+CHAT_USER_RATE_FACTOR = 2